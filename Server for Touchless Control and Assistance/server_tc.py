@@ -1,15 +1,18 @@
 # Importazione delle librerie necessarie
 import cv2  # OpenCV per la gestione della GUI e rendering delle immagini
 import numpy as np  # NumPy per operazioni su array, usato per creare immagini vuote
-from flask import Flask, request, jsonify  # Flask per creare un server web API
+from flask import Flask, request, jsonify, Response  # Flask per creare un server web API
 import os  # Per operazioni sul file system (es. gestione cartelle e file)
 import threading  # Per gestire thread paralleli (es. server Flask e GUI OpenCV)
 import signal  # Per gestire segnali di sistema (es. SIGINT per Ctrl+C)
 import sys  # Per operazioni di sistema (es. uscita dal programma)
-import time  # Non usato esplicitamente, ma importato per possibili estensioni
+import time  # Per gli istanti di presa in carico/risoluzione degli alert
 from datetime import datetime  # Per formattare i timestamp degli alert
+from collections import deque, namedtuple  # Coda degli alert risolti e istantanee immutabili per la GUI
 import pygame  # Per la gestione di feedback audio (riproduzione suoni)
 import subprocess  # Per eseguire comandi di sistema (es. afplay su macOS)
+import heapq  # Coda con priorità dei suoni da riprodurre
+import json  # Per il journal degli alert (una riga JSON per record)
 
 # Creazione dell'istanza dell'applicazione Flask
 app = Flask(__name__)
@@ -18,13 +21,31 @@ app = Flask(__name__)
 # Definizione delle configurazioni di base
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # Directory assoluta del file corrente
 LOG_FILE = os.path.join(BASE_DIR, 'server_log.txt')  # Percorso del file di log per registrare gli alert
+JOURNAL_FILE = os.path.join(BASE_DIR, 'alerts_journal.jsonl')  # Journal degli alert (ricaricato all'avvio)
+JOURNAL_MAX_BYTES = 5 * 1024 * 1024  # Oltre questa dimensione il journal viene ruotato e compattato
+JOURNAL_BACKUPS = 3  # Journal ruotati da conservare (alerts_journal.jsonl.1, .2, ...)
+JOURNAL_COMMIT_TIMEOUT = 2.0  # Attesa massima (in secondi) della scrittura su disco prima di rispondere
+JOURNAL_RETRY_INTERVAL = 1.0  # Secondi di attesa prima di riprovare una scrittura del journal fallita
 WINDOW_TITLE = 'Notifiche Pazienti'  # Titolo della finestra OpenCV
 BASE_WIDTH = 1280  # Larghezza di base della finestra (ottimizzata per display Retina)
 BASE_HEIGHT = 960  # Altezza di base della finestra
+MAX_RESOLVED_ALERTS = 1000  # Alert risolti tenuti in memoria (i più vecchi vengono scartati)
+DEFAULT_PAGE_SIZE = 50  # Alert per pagina nelle query
+MAX_PAGE_SIZE = 500  # Dimensione massima di una pagina
+DEDUP_WINDOW = 10.0  # Secondi entro cui la stessa azione dallo stesso dispositivo è un duplicato
+IDEMPOTENCY_KEYS = 10000  # Chiavi (device_id, action, timestamp) ricordate per riconoscere i ritrasmessi
+RATE_LIMIT_PER_SEC = 0.5  # Nuovi alert al secondo concessi a ogni dispositivo (a regime)
+RATE_LIMIT_BURST = 5  # Nuovi alert consecutivi concessi a un dispositivo prima del limite
+RATE_LIMIT_MAX_DEVICES = 10000  # Dispositivi con un limite di frequenza in memoria (i meno recenti vengono dimenticati)
+STREAM_QUEUE_SIZE = 256  # Eventi in coda per ogni client dello stream (oltre, il client viene risincronizzato)
+STREAM_HISTORY = 1000  # Eventi recenti conservati per la ripresa con Last-Event-ID
+STREAM_KEEPALIVE = 15.0  # Secondi senza eventi dopo cui si invia un commento keep-alive
 
 # ====== Stato condiviso ======
 # Variabili globali per gestire lo stato condiviso tra thread
-alerts = []  # Lista degli alert ricevuti
+# (l'archivio degli alert, store, è creato dopo la definizione di AlertStore)
+ACTIONS = ['request_water', 'report_pain', 'urgent_assistance']  # Azioni riconosciute
+AlertView = namedtuple('AlertView', 'version alerts')  # Istantanea per la GUI: versione e alert mostrati
 lock = threading.Lock()  # Lock per sincronizzare l'accesso alle variabili condivise
 running = True  # Flag per controllare il ciclo principale
 
@@ -39,126 +60,813 @@ except Exception as e:
 SOUND_NORMAL = os.path.join(BASE_DIR, 'beep.wav')  # Percorso del file audio per notifiche standard
 SOUND_URGENT = os.path.join(BASE_DIR, 'urgent.wav')  # Percorso del file audio per notifiche urgenti
 
+FALLBACK_COMMAND = ['afplay', '/System/Library/Sounds/Ping.aiff']  # Suono di sistema (macOS) se pygame non funziona
+MAX_PENDING_SOUNDS = 8  # Suoni in attesa oltre i quali quelli non urgenti vengono scartati
+
 # Funzione per generare un beep sintetico
-def play_synthetic_beep(frequency=1000, duration=500):
+def make_synthetic_beep(frequency=1000, duration=500):
     """
-    Genera e riproduce un beep sintetico usando pygame.
+    Genera un beep sintetico come oggetto pygame.Sound (da generare una sola volta e riusare).
     Args:
         frequency (int): Frequenza del beep in Hz (default: 1000)
         duration (int): Durata del beep in millisecondi (default: 500)
+    Returns:
+        pygame.mixer.Sound: Suono pronto da riprodurre
     """
-    try:
-        sample_rate = 44100  # Frequenza di campionamento standard (44.1 kHz)
-        n_samples = int(sample_rate * duration / 1000)  # Numero di campioni per la durata
-        t = np.linspace(0, duration / 1000, n_samples, False)  # Vettore temporale
-        wave = 0.5 * np.sin(2 * np.pi * frequency * t)  # Genera un'onda sinusoidale
-        sound = np.array([32767 * wave], dtype=np.int16).T  # Converte in formato audio 16-bit
-        sound_obj = pygame.sndarray.make_sound(sound)  # Crea oggetto sonoro pygame
-        sound_obj.play()  # Riproduce il suono
-        print(f"Beep sintetico riprodotto: {frequency} Hz, {duration} ms")
-    except Exception as e:
-        print(f"Errore beep sintetico: {e}")
-        # Fallback con afplay (per macOS)
+    sample_rate, _, channels = pygame.mixer.get_init()  # Usa il formato effettivo del mixer
+    n_samples = int(sample_rate * duration / 1000)  # Numero di campioni per la durata
+    t = np.linspace(0, duration / 1000, n_samples, False)  # Vettore temporale
+    wave = 0.5 * np.sin(2 * np.pi * frequency * t)  # Genera un'onda sinusoidale
+    sound = np.ascontiguousarray(np.repeat((32767 * wave).astype(np.int16)[:, None], channels, axis=1))  # 16-bit, un canale per uscita
+    return pygame.sndarray.make_sound(sound)  # Crea oggetto sonoro pygame
+
+def build_sound_cache():
+    """
+    Prepara una sola volta il suono di ogni azione: file .wav se presente,
+    altrimenti beep sintetico. Le azioni senza suono disponibile restano None
+    e useranno il fallback di sistema.
+    Returns:
+        dict: azione -> pygame.mixer.Sound (o None)
+    """
+    cache = {}
+    for action in ACTIONS:
+        urgent = action == 'urgent_assistance'
+        path = SOUND_URGENT if urgent else SOUND_NORMAL
+        try:
+            if os.path.exists(path):  # Controlla se il file audio esiste
+                cache[action] = pygame.mixer.Sound(path)
+            else:  # Beep sintetico: più acuto e lungo per le urgenze
+                cache[action] = make_synthetic_beep(frequency=1500, duration=1000) if urgent else make_synthetic_beep(frequency=1000, duration=500)
+        except Exception as e:
+            print(f"Errore preparazione suono {action}: {e}")
+            cache[action] = None
+    return cache
+
+class AudioWorker:
+    """
+    Thread dedicato alla riproduzione degli alert sonori.
+    Gli handler HTTP si limitano ad accodare l'azione (play_alert_sound), quindi
+    non attendono mai la durata del suono. I suoni urgenti hanno priorità e
+    interrompono un suono normale in corso; le azioni già in coda non vengono
+    duplicate durante una raffica di chiamate.
+    """
+    def __init__(self, sounds):
+        self.sounds = sounds  # Cache azione -> pygame.Sound
+        self._queue = []  # Heap di (priorità, sequenza, azione)
+        self._seq = 0  # Mantiene l'ordine di arrivo a parità di priorità
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def priority(action):
+        return 0 if action == 'urgent_assistance' else 1  # 0 = più urgente
+
+    def enqueue(self, action):
+        """
+        Accoda un suono senza bloccare il chiamante.
+        """
+        with self._cond:
+            if any(a == action for _, _, a in self._queue):  # Stessa azione già in attesa
+                return
+            if len(self._queue) >= MAX_PENDING_SOUNDS and self.priority(action) > 0:  # Coda piena: scarta i non urgenti
+                return
+            heapq.heappush(self._queue, (self.priority(action), self._seq, action))
+            self._seq += 1
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                prio, _, action = heapq.heappop(self._queue)
+            self._play(prio, action)
+
+    def _play(self, prio, action):
+        """
+        Riproduce il suono e attende la fine, interrompendolo se arriva un suono più urgente.
+        """
+        sound = self.sounds.get(action)
         try:
-            subprocess.run(['afplay', '/System/Library/Sounds/Ping.aiff'])  # Usa suono di sistema
-            print("Beep di fallback (afplay) riprodotto")
+            if sound is not None:
+                channel = sound.play()
+                busy = (lambda: channel.get_busy()) if channel is not None else (lambda: False)
+                stop = (lambda: channel.stop()) if channel is not None else (lambda: None)
+                print(f"Suono riprodotto: {action}")
+            else:  # Fallback con afplay (per macOS), senza bloccare il thread
+                handle = subprocess.Popen(FALLBACK_COMMAND)
+                busy = lambda: handle.poll() is None
+                stop = handle.terminate
+                print("Beep di fallback (afplay) riprodotto")
         except Exception as e:
-            print(f"Errore afplay: {e}")
+            print(f"Errore riproduzione suono: {e}")
+            return
+        with self._cond:
+            while self._running and busy():
+                if self._queue and self._queue[0][0] < prio:  # Suono più urgente in attesa: interrompe
+                    stop()
+                    break
+                self._cond.wait(0.05)
 
 def play_alert_sound(action):
     """
-    Riproduce un suono in base al tipo di alert ricevuto.
+    Accoda il suono dell'alert al worker audio (ritorna subito).
     Args:
         action (str): Tipo di azione ('urgent_assistance' o altro)
     """
-    try:
-        if action == 'urgent_assistance':
-            if os.path.exists(SOUND_URGENT):  # Controlla se il file urgente esiste
-                pygame.mixer.Sound(SOUND_URGENT).play()  # Riproduce suono urgente
-                print(f"Suono urgente riprodotto: {SOUND_URGENT}")
-            else:
-                play_synthetic_beep(frequency=1500, duration=1000)  # Beep sintetico per urgenza
-        else:
-            if os.path.exists(SOUND_NORMAL):  # Controlla se il file standard esiste
-                pygame.mixer.Sound(SOUND_NORMAL).play()  # Riproduce suono standard
-                print(f"Suono standard riprodotto: {SOUND_NORMAL}")
-            else:
-                play_synthetic_beep(frequency=1000, duration=500)  # Beep sintetico standard
-    except Exception as e:
-        print(f"Errore riproduzione suono: {e}")
-        # Fallback con afplay (per macOS)
-        try:
-            subprocess.run(['afplay', '/System/Library/Sounds/Ping.aiff'])
-            print("Beep di fallback (afplay) riprodotto")
-        except Exception as e:
-            print(f"Errore afplay: {e}")
+    if audio_worker is not None:
+        audio_worker.enqueue(action)
 
-def log_alert(alert):
+# Worker audio con i suoni già pronti (None se il mixer non è disponibile)
+try:
+    audio_worker = AudioWorker(build_sound_cache() if pygame.mixer.get_init() else {})
+except Exception as e:
+    print(f"Errore avvio worker audio: {e}")
+    audio_worker = None
+
+def log_alerts(alerts):
     """
-    Scrive un alert nel file di log.
+    Scrive gli alert nel file di log leggibile (chiamata dal thread del journal).
     Args:
-        alert (dict): Dizionario con dettagli dell'alert (azione, dispositivo, posizione, timestamp)
+        alerts (list): Dizionari con dettagli degli alert (azione, dispositivo, posizione, timestamp)
     """
-    formatted_time = datetime.fromtimestamp(alert['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+    if not alerts:
+        return
     try:
         with open(LOG_FILE, 'a') as f:  # Apre il file di log in modalità append
-            f.write(f"{formatted_time}: {alert['action']} - Device: {alert['device_id']} - Location: {alert['location']}\n")
-        print(f"Log salvato: {formatted_time}, {alert['action']}")
+            for alert in alerts:
+                formatted_time = datetime.fromtimestamp(alert['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+                f.write(f"{formatted_time}: {alert['action']} - Device: {alert['device_id']} - Location: {alert['location']}\n")
+                print(f"Log salvato: {formatted_time}, {alert['action']}")
     except Exception as e:
         print(f"Errore scrittura log: {e}")
 
-def render_alerts(window_size):
+# ====== Journal degli alert ======
+class AlertJournal:
     """
-    Renderizza gli alert su un'immagine OpenCV, adattandosi alla dimensione della finestra.
-    Args:
-        window_size (tuple): Tuple con larghezza e altezza della finestra (width, height)
+    Journal append-only degli alert in formato JSON lines, scritto da un thread
+    dedicato. I record accodati durante una scrittura vengono scritti insieme alla
+    successiva con un solo fsync (group commit); chi deve sapere che un record è su
+    disco chiama wait_durable con il numero restituito da append.
+    Record: {"op": "add", "alert": {...}}, {"op": "state", "id", "state", "at"} e
+    {"op": "dup", "id", "count", "ts", "at"} (ripetizione contata su un alert esistente).
+    Quando i record aggiunti superano max_bytes il journal viene ruotato: il nuovo file parte da un'istantanea
+    degli alert in memoria (snapshot), così all'avvio basta rileggere un solo file.
+    """
+    def __init__(self, path=JOURNAL_FILE, max_bytes=JOURNAL_MAX_BYTES, backups=JOURNAL_BACKUPS,
+                 snapshot=None, on_commit=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.snapshot = snapshot  # Funzione che restituisce gli alert in memoria (per la rotazione)
+        self.on_commit = on_commit  # Chiamata con gli alert nuovi dopo ogni commit
+        self._pending = []  # Record in attesa di scrittura
+        self._seq = 0  # Record accodati finora
+        self._durable = 0  # Record già su disco (dopo fsync)
+        self._file = None
+        self._base_size = 0  # Dimensione dell'istantanea con cui è iniziato il file corrente
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, record):
+        """
+        Accoda un record (non blocca).
+        Returns:
+            int: Numero del record, da passare a wait_durable
+        """
+        with self._cond:
+            self._pending.append(record)
+            self._seq += 1
+            self._cond.notify_all()
+            return self._seq
+
+    def wait_durable(self, seq, timeout=JOURNAL_COMMIT_TIMEOUT):
+        """
+        Attende che il record seq sia su disco.
+        Returns:
+            bool: True se il record è stato scritto e sincronizzato
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._durable >= seq or not self._thread.is_alive(), timeout)
+            return self._durable >= seq
+
+    def close(self):
+        """
+        Scrive i record in attesa e ferma il thread.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or not self._running)
+                if not self._pending:  # Chiusura senza record in attesa
+                    break
+                batch, self._pending = self._pending, []
+                last = self._seq
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Errore scrittura journal: {e}")
+                self._reset_file()
+                with self._cond:
+                    # Il gruppo torna in testa alla coda: _durable non lo supera finché non è su disco
+                    self._pending[:0] = batch
+                    if not self._running:
+                        print(f"Journal: {len(self._pending)} record non scritti alla chiusura")
+                        break
+                    self._cond.wait(JOURNAL_RETRY_INTERVAL)
+                continue
+            with self._cond:
+                self._durable = last
+                self._cond.notify_all()
+            if self.on_commit is not None:
+                self.on_commit([r['alert'] for r in batch if r['op'] == 'add'])
+            try:
+                if os.path.getsize(self.path) > self._base_size + self.max_bytes:
+                    self._rotate()
+            except Exception as e:
+                print(f"Errore rotazione journal: {e}")
+        if self._file is not None:
+            self._file.close()
+
+    def _reset_file(self):
+        """
+        Chiude il file dopo un errore: la prossima scrittura lo riapre.
+        """
+        try:
+            if self._file is not None:
+                self._file.close()
+        except OSError:
+            pass
+        self._file = None
+
+    def _write(self, records, f=None):
+        if f is None:
+            if self._file is None:
+                torn = False
+                if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                    with open(self.path, 'rb') as tail:  # Dopo un errore l'ultima riga può essere rimasta a metà
+                        tail.seek(-1, os.SEEK_END)
+                        torn = tail.read(1) != b'\n'
+                self._file = open(self.path, 'a', encoding='utf-8')
+                if torn:
+                    self._file.write('\n')  # Non incolla il prossimo record alla riga interrotta
+            f = self._file
+        f.write(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records))
+        f.flush()
+        os.fsync(f.fileno())  # Un solo fsync per tutto il gruppo di record
+
+    def _rotate(self):
+        """
+        Scrive l'istantanea in un file temporaneo, poi sposta il journal in .1 (e i
+        precedenti in .2, ...) e mette l'istantanea al suo posto. I record accodati
+        nel frattempo finiscono nel nuovo file; la rilettura li applica in modo
+        idempotente.
+        """
+        alerts = self.snapshot() if self.snapshot is not None else []
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            self._write([{'op': 'add', 'alert': a} for a in alerts], f)
+        self._file.close()
+        self._file = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f'{self.path}.{i}'):
+                    os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+            os.replace(self.path, self.path + '.1')
+        os.replace(tmp_path, self.path)
+        self._base_size = os.path.getsize(self.path)
+        print(f"Journal ruotato: {len(alerts)} alert nell'istantanea")
+
+def read_journal(path=JOURNAL_FILE):
+    """
+    Legge i record del journal. Se il file manca ma esiste il ruotato .1 (arresto
+    durante una rotazione) legge quello; le righe illeggibili (es. l'ultima, troncata
+    da un crash) vengono saltate.
+    """
+    if not os.path.exists(path) and os.path.exists(path + '.1'):
+        path = path + '.1'
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print("Journal: riga non valida ignorata")
+
+# ====== Archivio degli alert ======
+ALERT_STATES = ['open', 'acknowledged', 'resolved']  # Ciclo di vita di un alert
+INDEXED_FIELDS = ['device_id', 'location', 'action', 'state']  # Campi con indice per le query
+
+class AlertStore:
+    """
+    Archivio in memoria degli alert, con indici per device_id, location, action e
+    stato. Ogni alert ha un id progressivo; gli indici sono dict ordinati di id
+    (insiemi con inserimento e rimozione O(1)). Gli alert aperti o presi in carico
+    restano sempre in memoria, quelli risolti solo gli ultimi max_resolved.
+    Non è thread-safe: va usato con il lock globale acquisito. Fa eccezione
+    l'attributo view, un'istantanea immutabile che la GUI legge senza lock.
+    """
+    def __init__(self, max_resolved=MAX_RESOLVED_ALERTS):
+        self._alerts = {}  # id -> alert, in ordine di arrivo
+        self._index = {field: {} for field in INDEXED_FIELDS}  # campo -> valore -> {id: None}
+        self._resolved = deque()  # id degli alert risolti, dal più vecchio
+        self.max_resolved = max_resolved
+        self.next_id = 1
+        self.total = 0  # Alert ricevuti dall'avvio (anche quelli scartati)
+        self.version = 0  # Incrementato a ogni modifica (la GUI ridisegna solo se cambia)
+        self._latest = {}  # (device_id, action) -> id dell'ultimo alert (finestra di deduplica)
+        self._keys = {}  # (device_id, action, timestamp del client) -> id, in ordine di arrivo (idempotenza)
+        self.view = AlertView(0, ())  # Ultima istantanea pubblicata per la GUI (vedi publish_view)
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def _index_add(self, alert):
+        for field in INDEXED_FIELDS:  # Valori non hashable: TypeError prima di toccare l'indice
+            hash(alert[field])
+        for field in INDEXED_FIELDS:
+            self._index[field].setdefault(alert[field], {})[alert['id']] = None
+
+    def _index_remove(self, alert, field):
+        ids = self._index[field].get(alert[field])
+        if ids is not None:
+            ids.pop(alert['id'], None)
+            if not ids:  # Non tiene valori senza alert
+                del self._index[field][alert[field]]
+
+    def _remember_key(self, alert, timestamp):
+        self._keys[(alert['device_id'], alert['action'], timestamp)] = alert['id']
+        while len(self._keys) > IDEMPOTENCY_KEYS:  # Dimentica le chiavi più vecchie
+            del self._keys[next(iter(self._keys))]
+
+    def add(self, alert, now=None):
+        """
+        Aggiunge un nuovo alert (stato 'open') e gli assegna un id.
+        Returns:
+            dict: L'alert memorizzato
+        """
+        now = time.time() if now is None else now
+        alert = dict(alert, id=self.next_id, state='open', acknowledged_at=None, resolved_at=None,
+                     duplicates=0, last_seen=now)
+        self._index_add(alert)  # Prima dell'inserimento: se fallisce l'archivio resta com'era
+        self.next_id += 1
+        self.total += 1
+        self._alerts[alert['id']] = alert
+        self._latest[(alert['device_id'], alert['action'])] = alert['id']
+        self._remember_key(alert, alert['timestamp'])
+        self.version += 1
+        return alert
+
+    def find_retry(self, device_id, action, timestamp):
+        """
+        Alert già creato (o già contato come duplicato) dalla stessa richiesta:
+        il client ritrasmette con lo stesso timestamp, che insieme a dispositivo e
+        azione fa da chiave di idempotenza. L'azione serve perché il firmware manda
+        secondi interi: due richieste diverse nello stesso secondo non sono ritrasmissioni.
+        """
+        alert_id = self._keys.get((device_id, action, timestamp))
+        return self._alerts.get(alert_id) if alert_id is not None else None
+
+    def find_duplicate(self, device_id, action, now, window=DEDUP_WINDOW):
+        """
+        Alert non risolto con stessi device_id e action visto negli ultimi window secondi.
+        """
+        alert = self._alerts.get(self._latest.get((device_id, action)))
+        if alert is None or alert['state'] == 'resolved' or now - alert['last_seen'] > window:
+            return None
+        return alert
+
+    def add_duplicate(self, alert_id, timestamp, now, count=None):
+        """
+        Conta una ripetizione sull'alert esistente invece di crearne uno nuovo.
+        Args:
+            count (int): Valore assoluto del contatore (rilettura del journal), altrimenti +1
+        Returns:
+            dict: L'alert aggiornato, None se l'id non esiste
+        """
+        alert = self._alerts.get(alert_id)
+        if alert is None:
+            return None
+        alert['duplicates'] = alert['duplicates'] + 1 if count is None else max(alert['duplicates'], count)
+        alert['last_seen'] = max(alert['last_seen'], now)
+        self._remember_key(alert, timestamp)
+        self.version += 1
+        return alert
+
+    def get(self, alert_id):
+        return self._alerts.get(alert_id)
+
+    def restore(self, alert):
+        """
+        Reinserisce un alert letto dal journal, con id e stato originali.
+        Gli id già presenti vengono ignorati (la rilettura è idempotente).
+        """
+        alert_id = alert['id']
+        if alert_id in self._alerts:
+            return
+        alert = dict(alert)
+        alert.setdefault('duplicates', 0)  # Campi assenti nei journal scritti prima della deduplica
+        alert.setdefault('last_seen', alert['timestamp'])
+        self._index_add(alert)
+        self._alerts[alert_id] = alert
+        self._latest[(alert['device_id'], alert['action'])] = alert_id
+        self._remember_key(alert, alert['timestamp'])
+        self.next_id = max(self.next_id, alert_id + 1)
+        self.total = max(self.total, alert_id)
+        if alert['state'] == 'resolved':
+            self._resolved.append(alert_id)
+            while len(self._resolved) > self.max_resolved:
+                self._discard(self._resolved.popleft())
+        self.version += 1
+
+    def snapshot(self):
+        """
+        Copia di tutti gli alert in memoria, in ordine di id.
+        """
+        return [dict(a) for a in self._alerts.values()]
+
+    def set_state(self, alert_id, state, when=None):
+        """
+        Porta un alert in stato 'acknowledged' o 'resolved' (O(1)).
+        Args:
+            alert_id (int): Id dell'alert
+            state (str): Nuovo stato
+            when (float): Istante della transizione (default: ora)
+        Returns:
+            dict: L'alert aggiornato, None se l'id non esiste
+        """
+        alert = self._alerts.get(alert_id)
+        if alert is None:
+            return None
+        if ALERT_STATES.index(state) <= ALERT_STATES.index(alert['state']):  # Gli stati vanno solo avanti
+            return alert
+        when = time.time() if when is None else when
+        self._index_remove(alert, 'state')
+        alert['state'] = state
+        alert[f'{state}_at'] = when
+        if state == 'resolved' and alert['acknowledged_at'] is None:  # Risolto senza presa in carico esplicita
+            alert['acknowledged_at'] = when
+        self._index['state'].setdefault(state, {})[alert_id] = None
+        if state == 'resolved':
+            self._resolved.append(alert_id)
+            while len(self._resolved) > self.max_resolved:  # Scarta i risolti più vecchi
+                self._discard(self._resolved.popleft())
+        self.version += 1
+        return alert
+
+    def _discard(self, alert_id):
+        alert = self._alerts.pop(alert_id, None)
+        if alert is not None:
+            for field in INDEXED_FIELDS:
+                self._index_remove(alert, field)
+            key = (alert['device_id'], alert['action'])
+            if self._latest.get(key) == alert_id:
+                del self._latest[key]
+
+    def query(self, offset=0, limit=DEFAULT_PAGE_SIZE, **filters):
+        """
+        Alert che soddisfano tutti i filtri (campo=valore), dal più recente.
+        Parte dall'indice più piccolo tra quelli filtrati e controlla gli altri.
+        Args:
+            offset (int): Alert da saltare (paginazione)
+            limit (int): Numero massimo di alert restituiti
+            filters: Valori richiesti per i campi di INDEXED_FIELDS
+        Returns:
+            tuple: (lista di copie degli alert, numero totale di risultati)
+        """
+        if not filters:
+            total = len(self._alerts)
+            ids = reversed(self._alerts)
+        else:
+            sets = sorted((self._index[f].get(v, {}) for f, v in filters.items()), key=len)
+            ids = sorted(i for i in sets[0] if all(i in other for other in sets[1:]))  # Id crescente = ordine di arrivo
+            total = len(ids)
+            ids = reversed(ids)
+        page = []
+        for n, alert_id in enumerate(ids):
+            if n >= offset + limit:
+                break
+            if n >= offset:
+                page.append(dict(self._alerts[alert_id]))
+        return page, total
+
+    def counts(self):
+        """
+        Numero di alert in memoria per ogni stato.
+        """
+        return {state: len(self._index['state'].get(state, {})) for state in ALERT_STATES}
+
+    def publish_view(self, n=5):
+        """
+        Pubblica per la GUI gli ultimi n alert attivi, se qualcosa è cambiato.
+        L'istantanea (tupla di copie) non viene più modificata e l'assegnazione di
+        view è atomica, quindi la GUI la legge senza prendere il lock.
+        """
+        if self.view.version != self.version:
+            self.view = AlertView(self.version, tuple(self.recent_active(n)))
+
+    def recent_active(self, n=5):
+        """
+        Ultimi n alert non ancora risolti (quelli mostrati nella finestra); tutti se n è None.
+        """
+        active = []
+        for state in ('open', 'acknowledged'):
+            active.extend(self._index['state'].get(state, {}))
+        active.sort()
+        if n is not None:
+            active = active[-n:]
+        return [dict(self._alerts[i]) for i in active]
+
+store = AlertStore()  # Archivio condiviso degli alert
+
+class TokenBucket:
+    """
+    Limite di frequenza: ogni nuovo alert consuma un gettone, i gettoni si
+    ricaricano a rate al secondo fino a burst.
+    """
+    def __init__(self, rate=RATE_LIMIT_PER_SEC, burst=RATE_LIMIT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def take(self, now):
+        """
+        Returns:
+            float: 0 se il gettone è stato preso, altrimenti i secondi di attesa
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+rate_limits = {}  # device_id -> TokenBucket, dal meno usato di recente (protetto dal lock globale)
+
+def rate_limit_bucket(device_id, now):
+    """
+    Restituisce il TokenBucket del dispositivo (creandolo se necessario) e scarta
+    quelli inutilizzati: un bucket fermo da burst / rate secondi è di nuovo pieno,
+    quindi equivale a uno nuovo e dimenticarlo non cambia il limite. Oltre
+    RATE_LIMIT_MAX_DEVICES vengono scartati comunque i meno recenti, così un
+    client che cambia device_id a ogni richiesta non fa crescere il dizionario.
+    """
+    bucket = rate_limits.pop(device_id, None)
+    if bucket is None:
+        bucket = TokenBucket()
+    rate_limits[device_id] = bucket  # In fondo: usato di recente
+    while len(rate_limits) > 1:
+        oldest = rate_limits[next(iter(rate_limits))]
+        if len(rate_limits) <= RATE_LIMIT_MAX_DEVICES and now - oldest.updated < oldest.burst / oldest.rate:
+            break
+        del rate_limits[next(iter(rate_limits))]
+    return bucket
+
+# ====== Stream degli alert (Server-Sent Events) ======
+class AlertSubscriber:
+    """
+    Coda limitata di un singolo client dello stream.
+    Se il client è troppo lento e la coda si riempie, gli eventi in coda vengono
+    scartati e il client riceve un'istantanea degli alert attivi (resync):
+    gli alert non si possono perdere in silenzio.
+    """
+    def __init__(self, maxlen, filters):
+        self.queue = deque()
+        self.maxlen = maxlen
+        self.filters = filters  # Campo -> valore richiesto (es. location)
+        self.cond = threading.Condition()
+        self.overflow = False  # True se sono stati scartati eventi
+
+    def matches(self, alert):
+        return all(alert.get(field) == value for field, value in self.filters.items())
+
+    def push(self, event):
+        with self.cond:
+            if len(self.queue) >= self.maxlen:
+                self.queue.clear()  # Inutile conservarli: il client riceverà un'istantanea
+                self.overflow = True
+            else:
+                self.queue.append(event)
+            self.cond.notify()
+
+    def pop_all(self, timeout):
+        """
+        Attende fino a timeout secondi e restituisce (eventi in coda, overflow).
+        """
+        with self.cond:
+            if not self.queue and not self.overflow:
+                self.cond.wait(timeout)
+            events = list(self.queue)
+            self.queue.clear()
+            overflow, self.overflow = self.overflow, False
+        return events, overflow
+
+class AlertBroadcaster:
+    """
+    Distribuisce ogni modifica degli alert agli iscritti allo stream (fan-out).
+    Ogni evento ha un id "<avvio>-<n>" crescente; gli ultimi history eventi
+    restano in memoria per chi si riconnette con Last-Event-ID. publish() non
+    blocca mai e va chiamata con il lock globale acquisito (ordine = ordine delle modifiche).
+    """
+    def __init__(self, queue_size=STREAM_QUEUE_SIZE, history=STREAM_HISTORY):
+        self.queue_size = queue_size
+        self.boot = int(time.time())  # Distingue gli id di avvii diversi del server
+        self.seq = 0  # Numero dell'ultimo evento pubblicato
+        self.history = deque(maxlen=history)  # Eventi recenti (seq, tipo, alert)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def event_id(self, seq):
+        return f'{self.boot}-{seq}'
+
+    def publish(self, kind, alert):
+        """
+        Args:
+            kind (str): 'alert' (nuovo alert) o 'update' (stato o contatore dei duplicati)
+            alert (dict): Copia dell'alert
+        """
+        with self._lock:
+            self.seq += 1
+            event = (self.seq, kind, alert)
+            self.history.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.matches(alert):
+                subscriber.push(event)
+
+    def subscribe(self, last_event_id=None, filters=None):
+        """
+        Registra un client. Con last_event_id restituisce gli eventi persi dal client,
+        se sono ancora in memoria; altrimenti il client deve partire da un'istantanea.
+        Returns:
+            tuple: (iscritto, eventi persi, True se serve un'istantanea)
+        """
+        subscriber = AlertSubscriber(self.queue_size, filters or {})
+        with self._lock:
+            self._subscribers.add(subscriber)
+            try:
+                boot, seen = (int(v) for v in last_event_id.split('-'))
+            except (AttributeError, ValueError):  # Nessun id o id non valido
+                return subscriber, [], True
+            oldest = self.history[0][0] if self.history else self.seq + 1
+            if boot != self.boot or seen > self.seq or seen + 1 < oldest:  # Altro avvio o eventi non più in memoria
+                return subscriber, [], True
+            backlog = [e for e in self.history if e[0] > seen and subscriber.matches(e[2])]
+        return subscriber, backlog, False
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+alert_stream = AlertBroadcaster()  # Stream degli alert per pager, tablet e postazione centrale
+
+def store_snapshot():
+    with lock:
+        return store.snapshot()
+
+journal = AlertJournal(snapshot=store_snapshot, on_commit=log_alerts)  # Journal su disco dell'archivio
+
+def replay_journal():
+    """
+    Ricostruisce l'archivio degli alert dal journal (da chiamare all'avvio).
     Returns:
-        np.ndarray: Immagine renderizzata con gli alert
-    """
-    width, height = window_size
-    print(f"Dimensioni finestra rilevate: {width}x{height}")  # Debug
-    # Calcola fattore di scala per adattarsi alla finestra
-    scale = min(width / BASE_WIDTH, height / BASE_HEIGHT)
-    scaled_width = int(BASE_WIDTH * scale)
-    scaled_height = int(BASE_HEIGHT * scale)
-    # Margine di sicurezza e dimensioni minime
-    margin = int(20 * scale)
-    scaled_width = max(scaled_width, 200)  # Dimensione minima per evitare errori
-    scaled_height = max(scaled_height, 200)
-    # Crea immagine nera con dimensioni scalate
-    img = np.zeros((scaled_height, scaled_width, 3), dtype=np.uint8)
-    # Aggiunge un bordo bianco per debug visivo
-    cv2.rectangle(img, (0, 0), (scaled_width-1, scaled_height-1), (255, 255, 255), 1)
-    print(f"Immagine renderizzata: {scaled_width}x{scaled_height}, scala: {scale}")  # Debug
-    if not alerts:
-        # Se non ci sono alert, mostra "Nessuna notifica"
-        text = "Nessuna notifica"
-        font_scale = 1.0 * scale  # Scala il font per leggibilità
-        thickness = max(2, int(3 * scale))  # Spessore del testo scalato
-        text_size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)[0]
-        text_x = (scaled_width - text_size[0]) // 2  # Centra orizzontalmente
-        text_y = (scaled_height + text_size[1]) // 2  # Centra verticalmente
-        cv2.putText(img, text, (text_x, text_y),
-                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 255, 0), thickness, cv2.LINE_AA)
-        print("Rendering: Nessuna notifica")
-        return img
-    # Rendering degli ultimi 5 alert
-    y = int(60 * scale)  # Margine superiore scalato
-    for alert in alerts[-5:]:  # Mostra solo gli ultimi 5 alert
-        # Mappa le azioni a testi leggibili
-        action_text = {
-            'request_water': 'Richiesta Acqua',
-            'report_pain': 'Segnalazione Dolore',
-            'urgent_assistance': 'Assistenza Urgente'
-        }.get(alert['action'], 'Azione Sconosciuta')
+        int: Numero di record applicati
+    """
+    n = 0
+    with lock:
+        for record in read_journal(journal.path):
+            try:
+                if record['op'] == 'add':
+                    store.restore(record['alert'])
+                elif record['op'] == 'state':
+                    store.set_state(record['id'], record['state'], record['at'])
+                elif record['op'] == 'dup':
+                    store.add_duplicate(record['id'], record['ts'], record['at'], record['count'])
+                n += 1
+            except (KeyError, TypeError, ValueError):
+                print(f"Journal: record non valido ignorato: {record}")
+        store.publish_view()
+    return n
+
+ACTION_LABELS = {
+    'request_water': 'Richiesta Acqua',
+    'report_pain': 'Segnalazione Dolore',
+    'urgent_assistance': 'Assistenza Urgente'
+}  # Mappa le azioni a testi leggibili
+
+class AlertRenderer:
+    """
+    Renderizza gli alert su un'immagine OpenCV, adattandosi alla dimensione della finestra.
+    Il frame viene ridisegnato solo quando cambiano gli alert (store.version) o la
+    dimensione della finestra; il buffer del frame è riusato finché la dimensione
+    resta uguale e ogni riga di testo viene rasterizzata una sola volta per scala.
+    """
+    def __init__(self):
+        self.frame = None  # Buffer del frame (riusato tra un render e l'altro)
+        self._key = None  # (versione degli alert, dimensione finestra) dell'ultimo render
+        self._rows = {}  # Cache delle righe rasterizzate: (alert, larghezza, scala) -> immagine
+
+    def is_current(self, version, window_size):
+        """
+        True se il frame in buffer corrisponde già a questa versione e dimensione.
+        """
+        return self._key == (version, tuple(window_size))
+
+    def render(self, recent, version, window_size):
+        """
+        Args:
+            recent (sequence): Alert da mostrare (gli ultimi 5, dall'istantanea store.view)
+            version (int): Versione della lista degli alert (cambia a ogni modifica)
+            window_size (tuple): Tuple con larghezza e altezza della finestra (width, height)
+        Returns:
+            tuple: (frame, changed) - immagine renderizzata e True se è stata ridisegnata
+        """
+        if self.is_current(version, window_size):  # Niente di nuovo: il frame precedente è ancora valido
+            return self.frame, False
+        self._key = (version, tuple(window_size))
+        width, height = window_size
+        # Calcola fattore di scala per adattarsi alla finestra
+        scale = min(width / BASE_WIDTH, height / BASE_HEIGHT)
+        # Dimensioni minime per evitare errori
+        scaled_width = max(int(BASE_WIDTH * scale), 200)
+        scaled_height = max(int(BASE_HEIGHT * scale), 200)
+        if self.frame is None or self.frame.shape[:2] != (scaled_height, scaled_width):
+            self.frame = np.zeros((scaled_height, scaled_width, 3), dtype=np.uint8)
+        else:
+            self.frame[:] = 0  # Riusa il buffer esistente
+        img = self.frame
+        if not recent:
+            # Se non ci sono alert, mostra "Nessuna notifica"
+            text = "Nessuna notifica"
+            font_scale = 1.0 * scale  # Scala il font per leggibilità
+            thickness = max(2, int(3 * scale))  # Spessore del testo scalato
+            text_size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)[0]
+            text_x = (scaled_width - text_size[0]) // 2  # Centra orizzontalmente
+            text_y = (scaled_height + text_size[1]) // 2  # Centra verticalmente
+            cv2.putText(img, text, (text_x, text_y),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 255, 0), thickness, cv2.LINE_AA)
+        else:
+            # Ogni riga occupa una fascia alta row_h con la linea di base a row_h - pad
+            row_h = max(int(50 * scale), 1)
+            pad = int(12 * scale)
+            y = int(60 * scale)  # Linea di base del primo alert (margine superiore scalato)
+            used = {}
+            for alert in recent:
+                row_key = (alert['id'], alert['state'], alert.get('duplicates', 0), scaled_width, scale)
+                row = self._rows.get(row_key)
+                if row is None:
+                    row = self._rasterize_row(alert, scaled_width, row_h, pad, scale)
+                used[row_key] = row
+                top = y - row_h + pad
+                src_top = max(0, -top)
+                bottom = min(top + row_h, scaled_height)
+                if bottom > top + src_top:
+                    img[top + src_top:bottom] = row[src_top:bottom - top]
+                y += row_h  # Incrementa la posizione y per il prossimo alert
+            self._rows = used  # Tiene in cache solo le righe visibili
+        # Aggiunge un bordo bianco per debug visivo
+        cv2.rectangle(img, (0, 0), (scaled_width-1, scaled_height-1), (255, 255, 255), 1)
+        return img, True
+
+    @staticmethod
+    def _rasterize_row(alert, width, row_h, pad, scale):
+        """
+        Disegna il testo di un alert su una fascia nera larga quanto il frame.
+        """
+        action_text = ACTION_LABELS.get(alert['action'], 'Azione Sconosciuta')
         text = f"{alert['formatted_time']} - {action_text} - {alert['device_id']} @ {alert['location']}"
+        if alert.get('duplicates'):
+            text += f" (x{alert['duplicates'] + 1})"  # Richieste ripetute raggruppate
+        acknowledged = alert.get('state') == 'acknowledged'
+        if acknowledged:
+            text += " [preso in carico]"
+        color = (128, 128, 128) if acknowledged else (255, 255, 255)  # Grigio per gli alert già presi in carico
         font_scale = 0.8 * scale  # Scala il font per leggibilità
         thickness = max(1, int(2 * scale))  # Spessore del testo scalato
-        cv2.putText(img, text, (margin, y),
-                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
-        y += int(50 * scale)  # Incrementa la posizione y per il prossimo alert
-        print(f"Rendering alert: {text}")
-    return img
+        margin = int(20 * scale)  # Margine sinistro scalato
+        row = np.zeros((row_h, width, 3), dtype=np.uint8)
+        cv2.putText(row, text, (margin, row_h - pad),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness, cv2.LINE_AA)
+        return row
 
 # ====== Flask endpoints ======
 @app.route('/status', methods=['GET'])
@@ -167,11 +875,15 @@ def status():
     Endpoint GET che restituisce lo stato attuale del sistema (JSON).
     """
     with lock:  # Sincronizza l'accesso alla lista degli alert
-        print(f"Status richiesto: {len(alerts)} alert")
-        return jsonify({
-            'alert_count': len(alerts),  # Numero totale di alert
-            'recent_alerts': alerts[-5:]  # Ultimi 5 alert
-        })
+        total = store.total
+        counts = store.counts()
+        recent = store.query(limit=5)[0][::-1]
+    print(f"Status richiesto: {total} alert")  # Log fuori dal lock
+    return jsonify({
+        'alert_count': total,  # Numero totale di alert ricevuti
+        'counts': counts,  # Alert in memoria per stato
+        'recent_alerts': recent  # Ultimi 5 alert (dal più vecchio)
+    })
 
 @app.route('/command', methods=['POST', 'GET'])
 def handle_command():
@@ -194,31 +906,160 @@ def handle_command():
     if any(field not in data for field in required_fields):
         print(f"Errore: campi mancanti {required_fields}")
         return jsonify({'status': 'error', 'message': 'missing fields'}), 400
+    # device_id e location finiscono negli indici dell'archivio: solo stringhe non vuote
+    if any(not isinstance(data[field], str) or not data[field] for field in ('device_id', 'location')):
+        print("Errore: device_id o location non validi")
+        return jsonify({'status': 'error', 'message': 'invalid device_id or location'}), 400
     try:
         timestamp = float(data['timestamp'])  # Converte il timestamp in float
-    except ValueError:
+    except (TypeError, ValueError):
         print("Errore: timestamp non valido")
         return jsonify({'status': 'error', 'message': 'invalid timestamp'}), 400
+    device_id = data['device_id']
+    now = time.time()
     with lock:  # Sincronizza l'accesso alle variabili condivise
         # Controlla se l'azione è valida
-        if action not in ['request_water', 'report_pain', 'urgent_assistance']:
+        if action not in ACTIONS:
             print(f"Errore: azione sconosciuta {action}")
             return jsonify({'status': 'error', 'message': 'unknown action'}), 400
-        # Formatta il timestamp
-        formatted_time = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        # Crea il dizionario dell'alert
-        alert = {
-            'action': action,
-            'device_id': data['device_id'],
-            'location': data['location'],
-            'timestamp': timestamp,
-            'formatted_time': formatted_time
-        }
-        alerts.append(alert)  # Aggiunge l'alert alla lista
-        log_alert(alert)  # Registra l'alert nel file di log
+        # Ritrasmissione della stessa richiesta: restituisce l'alert già registrato
+        existing = store.find_retry(device_id, action, timestamp)
+        if existing is not None:
+            print(f"Richiesta ripetuta: alert {existing['id']}")
+            return jsonify({'status': 'success', 'action': action, 'received': dict(existing), 'duplicate': True})
+        # Stessa azione ripetuta entro DEDUP_WINDOW: incrementa il contatore, niente suono
+        alert = store.find_duplicate(device_id, action, now)
+        duplicate = alert is not None
+        if duplicate:
+            alert = store.add_duplicate(alert['id'], timestamp, now)
+            seq = journal.append({'op': 'dup', 'id': alert['id'], 'count': alert['duplicates'],
+                                  'ts': timestamp, 'at': now})
+            alert_stream.publish('update', dict(alert))
+        else:
+            # Limite di frequenza per dispositivo (le richieste di assistenza urgente passano
+            # sempre e non consumano i gettoni delle richieste normali)
+            wait = 0.0
+            if action != 'urgent_assistance':
+                wait = rate_limit_bucket(device_id, now).take(now)
+            if wait > 0:
+                print(f"Limite di frequenza superato: {device_id}")
+                response = jsonify({'status': 'error', 'message': 'rate limited'})
+                response.headers['Retry-After'] = str(int(wait) + 1)
+                return response, 429
+            # Formatta il timestamp
+            formatted_time = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+            # Crea il dizionario dell'alert
+            alert = {
+                'action': action,
+                'device_id': device_id,
+                'location': data['location'],
+                'timestamp': timestamp,
+                'formatted_time': formatted_time
+            }
+            alert = store.add(alert, now)  # Aggiunge l'alert all'archivio (assegna id e stato)
+            seq = journal.append({'op': 'add', 'alert': dict(alert)})  # Registra l'alert nel journal (e nel file di log)
+            alert_stream.publish('alert', dict(alert))  # Notifica gli iscritti allo stream
+        store.publish_view()  # La GUI ridisegna al prossimo frame
+        alert = dict(alert)
+    if duplicate:
+        print(f"Duplicato: alert {alert['id']} (x{alert['duplicates'] + 1})")
+    else:
         play_alert_sound(action)  # Riproduce il suono appropriato
-        print(f"[ALERT] {action} | Device: {alert['device_id']} | Location: {alert['location']} | Time: {formatted_time}")
-        return jsonify({'status': 'success', 'action': action, 'received': alert})
+        print(f"[ALERT] {action} | Device: {alert['device_id']} | Location: {alert['location']} | Time: {alert['formatted_time']}")
+    # Risponde solo quando l'alert è su disco (fuori dal lock, così le scritture si raggruppano)
+    durable = journal.wait_durable(seq)
+    if not durable:
+        print(f"Attenzione: alert {alert['id']} non ancora salvato su disco")
+    return jsonify({'status': 'success', 'action': action, 'received': alert, 'duplicate': duplicate, 'durable': durable})
+
+@app.route('/alerts', methods=['GET'])
+def list_alerts():
+    """
+    Endpoint GET per interrogare gli alert, dal più recente, a pagine.
+    Parametri query (tutti opzionali): device_id, location, action, state, offset, limit.
+    """
+    filters = {field: request.args[field] for field in INDEXED_FIELDS if field in request.args}
+    if 'state' in filters and filters['state'] not in ALERT_STATES:
+        return jsonify({'status': 'error', 'message': 'invalid state'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(1, int(request.args.get('limit', DEFAULT_PAGE_SIZE))), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'invalid offset/limit'}), 400
+    with lock:
+        page, total = store.query(offset=offset, limit=limit, **filters)
+    return jsonify({'total': total, 'offset': offset, 'limit': limit, 'alerts': page})
+
+@app.route('/alerts/<int:alert_id>/<operation>', methods=['POST'])
+def update_alert(alert_id, operation):
+    """
+    Endpoint POST per prendere in carico (ack) o risolvere (resolve) un alert.
+    """
+    state = {'ack': 'acknowledged', 'resolve': 'resolved'}.get(operation)
+    if state is None:
+        return jsonify({'status': 'error', 'message': 'unknown operation'}), 404
+    with lock:
+        previous = store.get(alert_id)
+        previous = previous['state'] if previous is not None else None
+        alert = store.set_state(alert_id, state)
+        if alert is None:
+            return jsonify({'status': 'error', 'message': 'unknown alert'}), 404
+        alert = dict(alert)
+        seq = None
+        if alert['state'] != previous:  # Registra solo le transizioni effettive
+            seq = journal.append({'op': 'state', 'id': alert_id, 'state': state, 'at': alert[f'{state}_at']})
+            alert_stream.publish('update', dict(alert))
+            store.publish_view()
+    print(f"Alert {alert_id} -> {alert['state']}")
+    durable = journal.wait_durable(seq) if seq is not None else True
+    return jsonify({'status': 'success', 'alert': alert, 'durable': durable})
+
+@app.route('/alerts/stream', methods=['GET'])
+def stream_alerts():
+    """
+    Endpoint GET Server-Sent Events con gli alert in tempo reale.
+    Eventi: 'snapshot' (alert attivi, alla connessione o dopo un resync),
+    'alert' (nuovo alert) e 'update' (presa in carico, risoluzione, duplicati).
+    Alla riconnessione il client (es. EventSource) invia Last-Event-ID e riceve
+    solo gli eventi persi. Parametri opzionali: device_id, location (filtri).
+    """
+    filters = {field: request.args[field] for field in ('device_id', 'location') if field in request.args}
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
+    def snapshot_event(subscriber):
+        # Con il lock globale nessuna modifica può finire tra l'istantanea e la coda
+        with lock:
+            with subscriber.cond:
+                subscriber.queue.clear()
+                subscriber.overflow = False
+            alerts = [a for a in store.recent_active(None) if subscriber.matches(a)]
+            event_id = alert_stream.event_id(alert_stream.seq)
+        return f'id: {event_id}\nevent: snapshot\ndata: {json.dumps(alerts)}\n\n'
+
+    with lock:  # Iscrizione atomica rispetto alle modifiche degli alert
+        subscriber, backlog, resync = alert_stream.subscribe(last_event_id, filters)
+
+    def events():
+        try:
+            yield 'retry: 3000\n\n'  # Attesa suggerita prima della riconnessione (ms)
+            if resync:
+                yield snapshot_event(subscriber)
+            for seq, kind, alert in backlog:
+                yield f'id: {alert_stream.event_id(seq)}\nevent: {kind}\ndata: {json.dumps(alert)}\n\n'
+            while True:
+                queued, overflow = subscriber.pop_all(STREAM_KEEPALIVE)
+                if overflow:
+                    print("Stream: client lento, invio istantanea")
+                    yield snapshot_event(subscriber)
+                    continue
+                for seq, kind, alert in queued:
+                    yield f'id: {alert_stream.event_id(seq)}\nevent: {kind}\ndata: {json.dumps(alert)}\n\n'
+                if not queued:
+                    yield ': keep-alive\n\n'  # Mantiene aperta la connessione e rileva i client disconnessi
+        finally:
+            alert_stream.unsubscribe(subscriber)  # Il client si è disconnesso
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # ====== Thread Flask (server web) ======
 def run_flask():
@@ -240,35 +1081,43 @@ def main():
     if not os.path.exists(LOG_FILE):
         with open(LOG_FILE, 'w') as f:
             f.write("Log delle notifiche\n")
+    # Ricostruisce gli alert dal journal prima di accettare richieste
+    print(f"Journal: {replay_journal()} record riletti, {store.counts()['open']} alert aperti")
     # Avvia il server Flask in un thread separato (daemon per terminare con il programma)
-    t = threading.Thread(target=ಸrun_flask, daemon=True)
+    t = threading.Thread(target=run_flask, daemon=True)
     t.start()
     # Crea una finestra OpenCV ridimensionabile
     cv2.namedWindow(WINDOW_TITLE, cv2.WINDOW_NORMAL)
     cv2.resizeWindow(WINDOW_TITLE, BASE_WIDTH, BASE_HEIGHT)
     print("Finestra OpenCV avviata (ridimensionabile)")
+    renderer = AlertRenderer()
     # Ciclo principale della GUI
     while running:
-        with lock:  # Sincronizza l'accesso per rendere gli alert
-            try:
-                # Ottiene le dimensioni attuali della finestra
-                window_size = cv2.getWindowImageRect(WINDOW_TITLE)[2:4]
-                if window_size[0] <= 0 or window_size[1] <= 0:
-                    window_size = (BASE_WIDTH, BASE_HEIGHT)  # Usa dimensioni di default se non valide
-            except Exception as e:
-                print(f"Errore getWindowImageRect: {e}")
-                window_size = (BASE_WIDTH, BASE_HEIGHT)
-            frame = render_alerts(window_size)  # Renderizza gli alert
-        cv2.imshow(WINDOW_TITLE, frame)  # Mostra l'immagine nella finestra
+        try:
+            # Ottiene le dimensioni attuali della finestra
+            window_size = cv2.getWindowImageRect(WINDOW_TITLE)[2:4]
+            if window_size[0] <= 0 or window_size[1] <= 0:
+                window_size = (BASE_WIDTH, BASE_HEIGHT)  # Usa dimensioni di default se non valide
+        except Exception as e:
+            print(f"Errore getWindowImageRect: {e}")
+            window_size = (BASE_WIDTH, BASE_HEIGHT)
+        # Legge l'ultima istantanea pubblicata senza lock: i comandi non aspettano mai la GUI
+        view = store.view
+        if not renderer.is_current(view.version, window_size):
+            frame, _ = renderer.render(view.alerts, view.version, window_size)  # Renderizza gli alert
+            cv2.imshow(WINDOW_TITLE, frame)  # Mostra l'immagine solo quando è cambiata
         k = cv2.waitKey(30) & 0xFF  # Attende 30ms per input da tastiera
         if k == ord('q'):  # Se premuto 'q', esce dal ciclo
             running = False
             break
     cv2.destroyAllWindows()  # Chiude tutte le finestre OpenCV
     try:
+        if audio_worker is not None:
+            audio_worker.stop()  # Ferma il worker audio prima di chiudere il mixer
         pygame.mixer.quit()  # Chiude il mixer audio di pygame
     except:
         pass
+    journal.close()  # Scrive su disco gli ultimi record del journal
 
 def handle_sigint(sig, frame):
     """
@@ -287,6 +1136,7 @@ if __name__ == '__main__':
         try:
             cv2.destroyAllWindows()  # Chiude le finestre OpenCV
             pygame.mixer.quit()  # Chiude il mixer audio
+            journal.close()  # Scrive su disco gli ultimi record del journal
         except:
             pass
         sys.exit(1)  # Esce con codice di errore 1
@@ -6,7 +6,18 @@ import os  # Per operazioni sul file system (es. gestione cartelle e file)
 import threading  # Per gestire thread paralleli (es. server Flask e GUI OpenCV)
 import signal  # Per gestire segnali di sistema (es. SIGINT per Ctrl+C)
 import sys  # Per operazioni di sistema (es. uscita dal programma)
-import time  # Non usato esplicitamente nel codice, ma importato per possibili estensioni future
+import time  # Per l'intervallo di polling della cartella immagini
+import bisect  # Ricerca e inserimento nella lista ordinata dei file
+import select  # Attesa degli eventi inotify con timeout
+import struct  # Decodifica degli eventi inotify
+import ctypes  # Accesso a inotify (Linux) senza dipendenze esterne
+import ctypes.util
+from collections import OrderedDict, namedtuple  # Cache LRU delle immagini e istantanee immutabili della vista
+from concurrent.futures import ThreadPoolExecutor, Future  # Decodifica in background (prefetch)
+try:
+    import tifffile  # Lettura a tile dei TIFF molto grandi (opzionale: senza, i TIFF vengono decodificati interi)
+except ImportError:
+    tifffile = None
 
 # Creazione dell'istanza dell'applicazione Flask
 app = Flask(__name__)
@@ -17,68 +28,847 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # Directory assoluta del
 IMAGE_FOLDER = os.path.join(BASE_DIR, 'immagini')  # Cartella per le immagini, situata nella directory del programma
 VALID_EXT = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')  # Estensioni di file immagine valide
 WINDOW_TITLE = 'Immagine Chirurgica'  # Titolo della finestra OpenCV
+IMAGE_CACHE_BYTES = 1024 * 1024 * 1024  # Memoria massima per le immagini decodificate in cache (1 GB)
+PREFETCH_WORKERS = 2  # Thread che decodificano in anticipo le immagini vicine
+PREFETCH_RADIUS = 1  # Immagini precedenti/successive da decodificare in anticipo
+VIEWPORT_WIDTH = 1280  # Larghezza fissa della vista (il frame mostrato ha sempre questa dimensione)
+VIEWPORT_HEIGHT = 960  # Altezza fissa della vista
+PYRAMID_MIN_SIZE = 512  # Lato massimo del livello più piccolo della piramide
+PAN_STEP = 0.2  # Spostamento di un comando di pan, in frazione dell'area visibile
+TIFF_STREAM_MIN_PIXELS = 20_000_000  # TIFF più grandi di così vengono letti a tile invece che decodificati interi
+TILE_CACHE_BYTES = 256 * 1024 * 1024  # Memoria massima per i tile decodificati in cache (256 MB)
+OVERVIEW_MAX_SIZE = 2048  # Lato massimo della panoramica generata per i TIFF senza livelli ridotti
+OVERVIEW_BLOCK = 2048  # Lato dei blocchi letti per generare la panoramica (memoria limitata)
+TILED_SOURCE_BYTES = 16 * 1024 * 1024  # Costo di un TIFF a tile aperto (handle, memmap, metadati) nel limite della cache immagini
+WATCH_POLL_INTERVAL = 2.0  # Secondi tra due controlli della cartella se inotify non è disponibile
+ZOOM_STEP = 0.1  # Variazione dello zoom per ogni comando zoom_in/zoom_out
+COMMAND_TIMEOUT = 10.0  # Attesa massima (in secondi) dell'applicazione di un comando prima di rispondere
 
 # ====== Stato condiviso ======
 # Variabili globali per gestire lo stato condiviso tra thread
-image_files = []  # Lista dei file immagine trovati nella cartella
+image_files = []  # Lista ordinata dei file immagine trovati nella cartella (aggiornata dal watcher)
 current_image_index = 0  # Indice dell'immagine corrente nella lista
-current_image = None  # Immagine corrente caricata (matrice OpenCV)
-zoom_factor = 1.0  # Fattore di zoom attuale (1.0 = nessuna modifica)
+current_image = None  # Immagine corrente caricata (ImagePyramid o TiledTiffSource)
+zoom_factor = 1.0  # Fattore di zoom attuale (1.0 = immagine intera adattata alla vista)
 rotation_quarters = 0  # Rotazione in multipli di 90° (0, 1, 2, 3)
+pan_x, pan_y = 0.5, 0.5  # Centro della vista, in coordinate normalizzate (0-1) dell'immagine ruotata
 lock = threading.Lock()  # Lock per sincronizzare l'accesso alle variabili condivise
+# Istantanea immutabile della vista, pubblicata dai comandi e letta senza lock dalla GUI
+ViewState = namedtuple('ViewState', 'index name count source zoom quarters pan_x pan_y')
+view_state = ViewState(None, None, 0, None, 1.0, 0, 0.5, 0.5)
+rendered_state = None  # Istantanea da cui è stato renderizzato l'ultimo frame (usata solo dalla GUI)
+rendered_frame = None  # Ultimo frame renderizzato (riusato finché la vista non cambia)
 running = True  # Flag per controllare il ciclo principale
 
+# ====== Piramide multi-risoluzione ======
+class ImagePyramid:
+    """
+    Immagine con i livelli ridotti precalcolati: il livello 0 è l'originale, ogni
+    livello successivo è dimezzato (cv2.pyrDown) fino a PYRAMID_MIN_SIZE.
+    Il render legge solo la regione visibile dal livello più adatto allo zoom,
+    quindi il costo dipende dalla dimensione della vista e non dell'immagine.
+    """
+    def __init__(self, image, min_size=PYRAMID_MIN_SIZE):
+        self._levels = [image]
+        while max(self._levels[-1].shape[:2]) > min_size:
+            self._levels.append(cv2.pyrDown(self._levels[-1]))
+        self.shape = image.shape[:2]  # (altezza, larghezza) del livello 0
+        self.levels = len(self._levels)
+        self.nbytes = sum(level.nbytes for level in self._levels)  # Memoria occupata (per la cache)
+
+    def level_shape(self, level):
+        return self._levels[level].shape[:2]
+
+    def region(self, level, x0, y0, x1, y1):
+        """
+        Regione [y0:y1, x0:x1] di un livello (una vista, senza copia).
+        """
+        return self._levels[level][y0:y1, x0:x1]
+
+    def close(self):
+        """
+        Niente da rilasciare (stessa interfaccia di TiledTiffSource).
+        """
+
+# ====== TIFF di grandi dimensioni letti a tile ======
+class TileCache:
+    """
+    Cache LRU dei tile decodificati (condivisa da tutti i TIFF), con un limite in byte.
+    """
+    def __init__(self, max_bytes=TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._tiles = OrderedDict()  # (percorso, livello, indice tile) -> tile BGR
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._tiles[key] = tile
+            self._bytes += tile.nbytes
+            while self._bytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def invalidate(self, path):
+        """
+        Rimuove tutti i tile di un file.
+        """
+        with self._lock:
+            for key in [k for k in self._tiles if k[0] == path]:
+                self._bytes -= self._tiles.pop(key).nbytes
+
+tile_cache = TileCache()  # Cache condivisa dei tile
+
+def to_bgr(data, photometric):
+    """
+    Converte un blocco letto dal TIFF (RGB, RGBA o scala di grigi, 8 o 16 bit) in BGR a 8 bit.
+    """
+    if data.dtype == np.uint16:
+        data = (data >> 8).astype(np.uint8)
+    elif data.dtype != np.uint8:
+        data = np.clip(data, 0, 255).astype(np.uint8)
+    if data.ndim == 2 or data.shape[2] == 1:
+        gray = data.reshape(data.shape[:2])
+        if photometric == 0:  # MINISWHITE: 0 = bianco
+            gray = 255 - gray
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    if data.shape[2] == 4:
+        return cv2.cvtColor(np.ascontiguousarray(data), cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(np.ascontiguousarray(data[..., :3]), cv2.COLOR_RGB2BGR)
+
+class TiledTiffSource:
+    """
+    TIFF molto grande letto solo nelle regioni richieste, con la stessa interfaccia
+    di ImagePyramid (shape, levels, level_shape, region, nbytes, close).
+    I livelli sono quelli del file (piramide del vetrino, se presente): i livelli
+    a tile vengono decodificati tile per tile (con cache LRU), quelli non compressi
+    e contigui vengono letti con np.memmap. Se anche il livello più piccolo del
+    file supera OVERVIEW_MAX_SIZE, viene generata una panoramica leggendo il file
+    a blocchi, così le viste a basso zoom non leggono tutto il livello pieno.
+    close() chiude il file e i memmap: se la sorgente viene usata ancora (es. è
+    l'immagine mostrata), il file viene riaperto alla prima lettura.
+    """
+    def __init__(self, path, tif, pages):
+        self.path = path
+        self._tif = tif  # File aperto (None dopo close())
+        self._file = tif.filehandle  # Handle da cui vengono letti i tile su richiesta (None dopo close())
+        self._pages = pages  # Pagine dei livelli del file, dal più grande
+        self._memmap_args = {}  # livello -> (dtype, offset, shape) dei livelli non a tile
+        self._memmaps = {}  # livello -> np.memmap dei livelli non a tile (creati alla prima lettura)
+        self._io_lock = threading.Lock()  # Seek + read sul file condiviso, apertura e chiusura
+        for level, page in enumerate(pages):
+            if not page.is_tiled:
+                dtype = np.dtype(tif.byteorder + page.dtype.char)
+                self._memmap_args[level] = (dtype, page.dataoffsets[0], page.shape)
+        self.shape = pages[0].shape[:2]
+        self._overview = None
+        if max(pages[-1].shape[:2]) > OVERVIEW_MAX_SIZE:
+            self._overview = ImagePyramid(self._build_overview(len(pages) - 1))
+        self.levels = len(pages) + (self._overview.levels if self._overview is not None else 0)
+        # I tile stanno in tile_cache: qui contano la panoramica e il costo fisso del file aperto
+        self.nbytes = TILED_SOURCE_BYTES + (self._overview.nbytes if self._overview is not None else 0)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Apre il TIFF se conviene leggerlo a tile (grande e con livelli a tile o non
+        compressi e contigui); altrimenti restituisce None.
+        """
+        tif = tifffile.TiffFile(path)
+        try:
+            pages = []
+            for level in tif.series[0].levels:
+                page = level.keyframe
+                readable = (page.is_tiled and page.imagedepth == 1) or page.is_memmappable
+                if not readable or page.planarconfig != 1 or len(page.shape) not in (2, 3):
+                    break  # I livelli successivi non sarebbero raggiungibili comunque
+                pages.append(page)
+            if not pages or pages[0].shape[0] * pages[0].shape[1] < TIFF_STREAM_MIN_PIXELS:
+                tif.close()
+                return None
+            source = cls(path, tif, pages)
+            source.region(0, 0, 0, 1, 1, cache=False)  # Verifica che la compressione sia supportata
+            return source
+        except Exception:
+            tif.close()
+            raise
+
+    def level_shape(self, level):
+        if level >= len(self._pages):
+            return self._overview.level_shape(level - len(self._pages))
+        return self._pages[level].shape[:2]
+
+    def _tile(self, level, index, cache=True):
+        key = (self.path, level, index)
+        tile = tile_cache.get(key)
+        if tile is not None:
+            return tile
+        page = self._pages[level]
+        offset, count = page.dataoffsets[index], page.databytecounts[index]
+        if count:
+            with self._io_lock:
+                if self._file is None:  # Chiusa da close(): riapre il file
+                    self._file = open(self.path, 'rb')
+                self._file.seek(offset)
+                data = self._file.read(count)
+            tile = page.decode(data, index, jpegtables=page.jpegtables)[0][0]  # (altezza, larghezza, campioni)
+            tile = to_bgr(tile, page.photometric)
+        else:  # Tile assente nel file (sparso): nero
+            tile = np.zeros((page.tilelength, page.tilewidth, 3), dtype=np.uint8)
+        if cache:
+            tile_cache.put(key, tile)
+        return tile
+
+    def region(self, level, x0, y0, x1, y1, cache=True):
+        """
+        Regione [y0:y1, x0:x1] di un livello in BGR: legge solo i tile che la intersecano.
+        """
+        if level >= len(self._pages):
+            return self._overview.region(level - len(self._pages), x0, y0, x1, y1)
+        page = self._pages[level]
+        if level in self._memmap_args:  # Lettura diretta dal file mappato in memoria
+            return to_bgr(np.asarray(self._memmap(level)[y0:y1, x0:x1]), page.photometric)
+        th, tw = page.tilelength, page.tilewidth
+        across = (page.imagewidth + tw - 1) // tw  # Tile per riga
+        out = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        for ty in range(y0 // th, (y1 - 1) // th + 1):
+            for tx in range(x0 // tw, (x1 - 1) // tw + 1):
+                tile = self._tile(level, ty * across + tx, cache)
+                ys0, ys1 = max(y0, ty * th), min(y1, (ty + 1) * th)
+                xs0, xs1 = max(x0, tx * tw), min(x1, (tx + 1) * tw)
+                out[ys0 - y0:ys1 - y0, xs0 - x0:xs1 - x0] = tile[ys0 - ty * th:ys1 - ty * th, xs0 - tx * tw:xs1 - tx * tw]
+        return out
+
+    def _memmap(self, level):
+        with self._io_lock:
+            memmap = self._memmaps.get(level)
+            if memmap is None:
+                dtype, offset, shape = self._memmap_args[level]
+                memmap = self._memmaps[level] = np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape)
+            return memmap
+
+    def close(self):
+        """
+        Chiude il file e rilascia i memmap (le letture già in corso restano valide).
+        """
+        with self._io_lock:
+            if self._tif is not None:
+                self._tif.close()  # Chiude anche il suo filehandle
+            elif self._file is not None:
+                self._file.close()
+            self._tif = self._file = None
+            self._memmaps.clear()
+
+    def _build_overview(self, level):
+        """
+        Riduce un livello a lato <= OVERVIEW_MAX_SIZE leggendolo a blocchi di
+        OVERVIEW_BLOCK pixel (senza passare dalla cache dei tile).
+        """
+        h, w = self._pages[level].shape[:2]
+        f = 2 ** int(np.ceil(np.log2(max(h, w) / OVERVIEW_MAX_SIZE)))  # Fattore di riduzione (potenza di 2)
+        block = max(OVERVIEW_BLOCK // f, 1) * f  # Multiplo di f: i blocchi cadono su pixel interi della panoramica
+        overview = np.zeros(((h + f - 1) // f, (w + f - 1) // f, 3), dtype=np.uint8)
+        for y in range(0, h, block):
+            for x in range(0, w, block):
+                y1, x1 = min(y + block, h), min(x + block, w)
+                data = self.region(level, x, y, x1, y1, cache=False)
+                bh, bw = (y1 - y + f - 1) // f, (x1 - x + f - 1) // f
+                overview[y // f:y // f + bh, x // f:x // f + bw] = cv2.resize(data, (bw, bh), interpolation=cv2.INTER_AREA)
+        return overview
+
+def open_image_source(path):
+    """
+    Apre un'immagine per il render: i TIFF molto grandi come TiledTiffSource
+    (se tifffile è installato), tutte le altre decodificate con OpenCV in una ImagePyramid.
+    Returns:
+        ImagePyramid | TiledTiffSource | None: None se il file non è leggibile
+    """
+    if tifffile is not None and path.lower().endswith(('.tif', '.tiff')):
+        try:
+            source = TiledTiffSource.open(path)
+            if source is not None:
+                return source
+        except Exception as e:
+            print(f"Lettura a tile non possibile per {path}: {e}")
+    image = cv2.imread(path)
+    return ImagePyramid(image) if image is not None else None
+
+# ====== Cache delle immagini decodificate ======
+class ImageCache:
+    """
+    Cache LRU delle immagini decodificate (ImagePyramid o TiledTiffSource) con un limite in byte.
+    get() restituisce l'immagine dalla cache o la decodifica; prefetch() la
+    decodifica in anticipo nel pool di thread. Se la stessa immagine è già in
+    decodifica (es. da un prefetch) get() attende quel risultato invece di
+    decodificarla di nuovo.
+    """
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES, workers=PREFETCH_WORKERS):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()  # percorso -> immagine, dalla meno usata di recente
+        self._bytes = 0  # Memoria occupata dalle immagini in cache
+        self._loading = {}  # percorso -> Future delle decodifiche in corso
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def _store(self, path, image):
+        # Chiamata con self._lock acquisito
+        if image is None or image.nbytes > self.max_bytes:  # Immagini illeggibili o più grandi dell'intera cache
+            return
+        old = self._images.pop(path, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+            if old is not image:
+                old.close()
+        self._images[path] = image
+        self._bytes += image.nbytes
+        while self._bytes > self.max_bytes:  # Scarta le immagini usate meno di recente
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            evicted.close()  # Chiude i TIFF a tile (riaperti al volo se ancora mostrati)
+
+    def _decode(self, path, future):
+        try:
+            image = open_image_source(path)  # Piramide (o apertura del TIFF a tile) costruita anche lei in background
+        except Exception as e:
+            print(f"Errore decodifica {path}: {e}")
+            image = None
+        with self._lock:
+            if self._loading.get(path) is future:  # Non invalidata nel frattempo
+                del self._loading[path]
+                self._store(path, image)
+        future.set_result(image)
+        return image
+
+    def get(self, path):
+        """
+        Restituisce l'immagine decodificata (None se illeggibile).
+        """
+        with self._lock:
+            image = self._images.get(path)
+            if image is not None:
+                self._images.move_to_end(path)  # Usata di recente
+                return image
+            future = self._loading.get(path)
+            if future is None:  # Decodifica nel thread chiamante
+                future = self._loading[path] = Future()
+                decode = True
+            else:
+                decode = False
+        if decode:
+            return self._decode(path, future)
+        return future.result()
+
+    def prefetch(self, paths):
+        """
+        Avvia in background la decodifica delle immagini non ancora in cache.
+        """
+        for path in paths:
+            with self._lock:
+                if path in self._images or path in self._loading:
+                    continue
+                future = self._loading[path] = Future()
+            self._pool.submit(self._decode, path, future)
+
+    def invalidate(self, path):
+        """
+        Rimuove un'immagine dalla cache (es. file modificato).
+        """
+        with self._lock:
+            image = self._images.pop(path, None)
+            if image is not None:
+                self._bytes -= image.nbytes
+                image.close()
+            self._loading.pop(path, None)
+        tile_cache.invalidate(path)
+
+image_cache = ImageCache()  # Cache condivisa delle immagini decodificate
+
 # ====== Utility immagini ======
+def publish_view():
+    """
+    Pubblica una nuova istantanea dello stato della vista (da chiamare con il lock
+    acquisito, dopo ogni modifica). L'assegnazione di view_state è atomica: la GUI
+    legge sempre un'istantanea completa senza prendere il lock.
+    """
+    global view_state
+    name = image_files[current_image_index] if image_files else None
+    view_state = ViewState(current_image_index if image_files else None, name, len(image_files),
+                           current_image, zoom_factor, rotation_quarters, pan_x, pan_y)
+
+def find_image(name):
+    """
+    Posizione di un file nella lista ordinata (ricerca binaria), None se assente.
+    """
+    i = bisect.bisect_left(image_files, name)
+    return i if i < len(image_files) and image_files[i] == name else None
+
+def apply_folder_changes(added=(), removed=(), modified=()):
+    """
+    Aggiorna la lista ordinata dei file con le modifiche della cartella.
+    L'indice corrente continua a puntare allo stesso file anche se la lista si
+    sposta; le immagini modificate o rimosse vengono tolte dalla cache e, se
+    tocca l'immagine corrente, questa viene ricaricata.
+    Args:
+        added (iterable): Nomi di file presenti (quelli già in lista vengono ignorati)
+        removed (iterable): Nomi di file non più presenti
+        modified (iterable): Nomi di file il cui contenuto è cambiato
+    Returns:
+        tuple: (aggiunti, rimossi, modificati) effettivamente applicati
+    """
+    global current_image_index, zoom_factor, rotation_quarters, pan_x, pan_y
+    n_removed = n_modified = 0
+    with lock:
+        current = image_files[current_image_index] if image_files else None
+        for name in removed:
+            i = find_image(name)
+            if i is not None:
+                del image_files[i]
+                n_removed += 1
+                image_cache.invalidate(os.path.join(IMAGE_FOLDER, name))
+        new = set()
+        for name in added:
+            if find_image(name) is None:
+                bisect.insort(image_files, name)
+                new.add(name)
+        n_added = len(new)
+        for name in modified:
+            image_cache.invalidate(os.path.join(IMAGE_FOLDER, name))
+            n_modified += name not in new  # I file appena aggiunti non contano come modificati
+        reload = False
+        if current is not None and find_image(current) is not None:  # Stesso file, eventualmente in un'altra posizione
+            current_image_index = find_image(current)
+            reload = current in modified
+        else:  # Immagine corrente rimossa (passa alla successiva) o lista prima vuota
+            position = bisect.bisect_left(image_files, current) if current is not None else 0
+            current_image_index = min(position, max(len(image_files) - 1, 0))
+            zoom_factor = 1.0; rotation_quarters = 0  # Resetta zoom e rotazione
+            pan_x, pan_y = 0.5, 0.5
+            reload = True
+        publish_view()
+    if reload:
+        load_current_image()  # Fuori dal lock (la decodifica può essere lenta)
+    if n_added or n_removed or n_modified:
+        print(f"[WATCH] +{n_added} -{n_removed} ~{n_modified} | {len(image_files)} immagini")
+    return n_added, n_removed, n_modified
+
+def list_image_folder():
+    """
+    Stato della cartella: nome -> (mtime, dimensione) dei file con estensione valida.
+    """
+    files = {}
+    with os.scandir(IMAGE_FOLDER) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(VALID_EXT) and entry.is_file():
+                st = entry.stat()
+                files[entry.name] = (st.st_mtime_ns, st.st_size)
+    return files
+
 def scan_images():
     """
-    Scansiona la cartella delle immagini e aggiorna la lista dei file validi.
+    Scansiona la cartella delle immagini e aggiorna la lista dei file validi
+    (solo le differenze, tramite apply_folder_changes).
+    Returns:
+        tuple: (aggiunti, rimossi, modificati)
     """
-    global image_files
     os.makedirs(IMAGE_FOLDER, exist_ok=True)  # Crea la cartella 'immagini' se non esiste
-    # Filtra i file nella cartella con estensioni valide, ordinandoli alfabeticamente
-    image_files = sorted([f for f in os.listdir(IMAGE_FOLDER)
-                          if f.lower().endswith(VALID_EXT)])
+    names = set(list_image_folder())
+    with lock:
+        known = set(image_files)
+    return apply_folder_changes(sorted(names - known), known - names)
+
+# ====== Watcher della cartella immagini ======
+# Costanti di inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+class FolderWatcher:
+    """
+    Tiene image_files aggiornata senza riscansioni complete: su Linux usa inotify
+    (un evento per file creato, modificato, spostato o cancellato), altrove o se
+    inotify non è disponibile confronta mtime e dimensione dei file ogni
+    WATCH_POLL_INTERVAL secondi. I file nuovi vengono considerati solo quando sono
+    stati chiusi dopo la scrittura (IN_CLOSE_WRITE), non appena creati.
+    """
+    def __init__(self, folder=IMAGE_FOLDER, interval=WATCH_POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _open_inotify(self):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, os.fsencode(self.folder), WATCH_MASK) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _run(self):
+        fd = self._open_inotify()
+        if fd is not None:
+            print("Watcher cartella immagini: inotify")
+            try:
+                self._run_inotify(fd)
+            finally:
+                os.close(fd)
+        print(f"Watcher cartella immagini: polling ogni {self.interval}s")
+        self._run_polling()
+
+    def _run_inotify(self, fd):
+        """
+        Legge gli eventi finché il programma è attivo; ritorna se la cartella
+        stessa viene rimossa o spostata (si passa al polling).
+        """
+        while running:
+            ready, _, _ = select.select([fd], [], [], 1.0)  # Timeout per controllare running
+            if not ready:
+                continue
+            touched, changed, resync = set(), set(), False
+            while True:  # Legge tutti gli eventi disponibili in un'unica modifica
+                try:
+                    buf = os.read(fd, 65536)
+                except BlockingIOError:
+                    break
+                offset = 0
+                while offset < len(buf):
+                    _, mask, _, length = struct.unpack_from('iIII', buf, offset)
+                    name = os.fsdecode(buf[offset + 16:offset + 16 + length].rstrip(b'\0'))
+                    offset += 16 + length
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        return
+                    if mask & IN_Q_OVERFLOW:  # Eventi persi: serve una scansione completa
+                        resync = True
+                    elif name.lower().endswith(VALID_EXT):
+                        touched.add(name)
+                        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                            changed.add(name)
+            if resync:
+                scan_images()
+                continue
+            # Lo stato finale di ogni file si legge dal disco: l'ordine degli eventi non conta
+            present = {n for n in touched if os.path.isfile(os.path.join(self.folder, n))}
+            apply_folder_changes(sorted(present), touched - present, changed & present)
+
+    def _run_polling(self):
+        known = list_image_folder() if os.path.isdir(self.folder) else {}
+        while running:
+            time.sleep(self.interval)
+            try:
+                current = list_image_folder()
+            except FileNotFoundError:
+                current = {}
+            added = [n for n in current if n not in known]
+            removed = [n for n in known if n not in current]
+            modified = [n for n in current if n in known and current[n] != known[n]]
+            if added or removed or modified:
+                apply_folder_changes(sorted(added), removed, modified)
+            known = current
 
 def load_current_image():
     """
     Carica l'immagine corrente in base all'indice attuale.
+    Va chiamata senza il lock: la decodifica (se l'immagine non è in cache) avviene
+    fuori dal lock, così la GUI e gli altri comandi non restano bloccati. Avvia poi
+    il prefetch delle immagini vicine.
     """
     global current_image
-    if not image_files:  # Se non ci sono immagini, imposta current_image a None
-        current_image = None
-        return
-    # Costruisce il percorso dell'immagine corrente e la carica con OpenCV
-    path = os.path.join(IMAGE_FOLDER, image_files[current_image_index])
-    current_image = cv2.imread(path)
+    with lock:
+        if not image_files:  # Se non ci sono immagini, imposta current_image a None
+            current_image = None
+            publish_view()
+            return
+        index = current_image_index
+        name = image_files[index]
+        count = len(image_files)
+        neighbours = [image_files[(index + d) % count] for r in range(1, PREFETCH_RADIUS + 1) for d in (r, -r)]
+    # Costruisce il percorso dell'immagine corrente e la carica (dalla cache o con OpenCV)
+    image = image_cache.get(os.path.join(IMAGE_FOLDER, name))
+    with lock:
+        # Aggiorna solo se nel frattempo un altro comando non ha cambiato immagine
+        if image_files and current_image_index == index and image_files[index] == name:
+            current_image = image
+            publish_view()
+    image_cache.prefetch([os.path.join(IMAGE_FOLDER, n) for n in neighbours if n != name])
 
-def render_image():
+def make_blank_image():
     """
-    Restituisce l'immagine corrente con zoom e rotazione applicati.
-    Se non ci sono immagini, restituisce un'immagine vuota con un messaggio.
+    Immagine mostrata quando non ci sono immagini (creata una sola volta).
+    """
+    # Crea un'immagine nera grande quanto la vista (3 canali)
+    blank = np.zeros((VIEWPORT_HEIGHT, VIEWPORT_WIDTH, 3), dtype=np.uint8)
+    # Aggiunge un messaggio di errore in rosso
+    cv2.putText(blank, "Nessuna immagine trovata", (40, VIEWPORT_HEIGHT // 2),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2, cv2.LINE_AA)
+    return blank
+
+BLANK_IMAGE = make_blank_image()
+
+def view_geometry(shape, zoom, quarters, viewport=(VIEWPORT_WIDTH, VIEWPORT_HEIGHT)):
+    """
+    Geometria della vista per un'immagine.
+    Args:
+        shape (tuple): (altezza, larghezza) dell'immagine originale
+        zoom (float): Fattore di zoom (1.0 = immagine intera nella vista)
+        quarters (int): Rotazione in multipli di 90°
+    Returns:
+        tuple: (larghezza e altezza dell'immagine ruotata, pixel della vista per pixel
+               dell'immagine, frazione visibile in larghezza e in altezza)
+    """
+    h, w = shape
+    if quarters % 2:  # Con rotazione di 90° o 270° larghezza e altezza si scambiano
+        w, h = h, w
+    fit = min(viewport[0] / w, viewport[1] / h)  # Scala che adatta l'immagine intera alla vista
+    scale = fit * zoom
+    return w, h, scale, viewport[0] / (scale * w), viewport[1] / (scale * h)
+
+def clamp_pan(cx, cy, frac_w, frac_h):
+    """
+    Limita il centro della vista in modo che non esca dall'immagine
+    (se l'immagine è più piccola della vista resta centrata).
     """
-    if current_image is None:
-        # Crea un'immagine nera (480x640, 3 canali) se non ci sono immagini
-        blank = np.zeros((480, 640, 3), dtype=np.uint8)
-        # Aggiunge un messaggio di errore in rosso
-        cv2.putText(blank, "Nessuna immagine trovata", (40, 240),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2, cv2.LINE_AA)
-        return blank
-    img = current_image.copy()  # Crea una copia dell'immagine corrente per non modificarla
-    # Applica la rotazione in base a rotation_quarters (0, 90, 180, 270 gradi)
-    k = rotation_quarters % 4
+    cx = 0.5 if frac_w >= 1 else min(max(cx, frac_w / 2), 1 - frac_w / 2)
+    cy = 0.5 if frac_h >= 1 else min(max(cy, frac_h / 2), 1 - frac_h / 2)
+    return cx, cy
+
+def render_view(source, zoom, quarters, cx, cy, viewport=(VIEWPORT_WIDTH, VIEWPORT_HEIGHT)):
+    """
+    Renderizza la vista di dimensione fissa: ritaglia la regione visibile dal
+    livello della piramide più vicino alla scala richiesta, la ridimensiona e
+    solo alla fine la ruota (si ruota il ritaglio, non l'immagine intera).
+    Args:
+        source (ImagePyramid): Immagine sorgente
+        zoom (float): Fattore di zoom (1.0 = immagine intera nella vista)
+        quarters (int): Rotazione in multipli di 90°
+        cx, cy (float): Centro della vista in coordinate normalizzate dell'immagine ruotata
+    Returns:
+        np.ndarray: Frame (viewport[1], viewport[0], 3)
+    """
+    vw, vh = viewport
+    frame = np.zeros((vh, vw, 3), dtype=np.uint8)
+    wr, hr, scale, frac_w, frac_h = view_geometry(source.shape, zoom, quarters, viewport)
+    # Rettangolo visibile in pixel dell'immagine ruotata (livello 0), tagliato ai bordi
+    x0 = cx * wr - vw / scale / 2
+    y0 = cy * hr - vh / scale / 2
+    u0, u1 = max(0.0, x0), min(float(wr), x0 + vw / scale)
+    v0, v1 = max(0.0, y0), min(float(hr), y0 + vh / scale)
+    # Posizione del ritaglio nel frame
+    ox0, ox1 = int(round((u0 - x0) * scale)), int(round((u1 - x0) * scale))
+    oy0, oy1 = int(round((v0 - y0) * scale)), int(round((v1 - y0) * scale))
+    if ox1 <= ox0 or oy1 <= oy0:
+        return frame
+    # Da coordinate normalizzate dell'immagine ruotata a quelle dell'originale
+    u0, u1, v0, v1 = u0 / wr, u1 / wr, v0 / hr, v1 / hr
+    k = quarters % 4
+    if k == 0:
+        sx0, sx1, sy0, sy1 = u0, u1, v0, v1
+    elif k == 1:  # 90° orario: x = v, y = 1 - u
+        sx0, sx1, sy0, sy1 = v0, v1, 1 - u1, 1 - u0
+    elif k == 2:  # 180°: x = 1 - u, y = 1 - v
+        sx0, sx1, sy0, sy1 = 1 - u1, 1 - u0, 1 - v1, 1 - v0
+    else:  # 90° antiorario: x = 1 - v, y = u
+        sx0, sx1, sy0, sy1 = 1 - v1, 1 - v0, u0, u1
+    # Livello più piccolo che ha ancora almeno la risoluzione richiesta
+    level = 0
+    while level + 1 < source.levels and source.level_shape(level + 1)[1] / source.shape[1] >= scale:
+        level += 1
+    lh, lw = source.level_shape(level)
+    px0, px1 = int(sx0 * lw), max(int(np.ceil(sx1 * lw)), int(sx0 * lw) + 1)
+    py0, py1 = int(sy0 * lh), max(int(np.ceil(sy1 * lh)), int(sy0 * lh) + 1)
+    crop = source.region(level, px0, py0, min(px1, lw), min(py1, lh))
+    # Dimensione del ritaglio prima della rotazione
+    out_w, out_h = ox1 - ox0, oy1 - oy0
+    if k % 2:
+        out_w, out_h = out_h, out_w
+    interpolation = cv2.INTER_AREA if out_w < crop.shape[1] else cv2.INTER_LINEAR  # Riduzione senza aliasing
+    crop = cv2.resize(crop, (out_w, out_h), interpolation=interpolation)
+    # Applica la rotazione in base a rotation_quarters (0, 90, 180, 270 gradi), solo sul ritaglio
     if k == 1:
-        img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)  # Rotazione di 90° in senso orario
+        crop = cv2.rotate(crop, cv2.ROTATE_90_CLOCKWISE)  # Rotazione di 90° in senso orario
     elif k == 2:
-        img = cv2.rotate(img, cv2.ROTATE_180)  # Rotazione di 180°
+        crop = cv2.rotate(crop, cv2.ROTATE_180)  # Rotazione di 180°
     elif k == 3:
-        img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)  # Rotazione di 90° in senso antiorario
-    # Applica lo zoom se diverso da 1.0
-    if zoom_factor != 1.0:
-        h, w = img.shape[:2]  # Ottiene altezza e larghezza dell'immagine
-        # Ridimensiona l'immagine in base al fattore di zoom
-        img = cv2.resize(img, (max(1, int(w * zoom_factor)), max(1, int(h * zoom_factor))),
-                         interpolation=cv2.INTER_LINEAR)  # Interpolazione lineare per ridimensionamento
-    return img
+        crop = cv2.rotate(crop, cv2.ROTATE_90_COUNTERCLOCKWISE)  # Rotazione di 90° in senso antiorario
+    frame[oy0:oy1, ox0:ox1] = crop
+    return frame
+
+def render_image(state):
+    """
+    Restituisce la vista descritta da un'istantanea (zoom, rotazione e pan applicati).
+    Se non ci sono immagini, restituisce un'immagine vuota con un messaggio.
+    Non usa il lock: lavora solo sull'istantanea, che nessuno modifica. Il frame
+    viene ricalcolato solo quando cambiano indice, zoom, rotazione, pan o
+    l'immagine caricata; altrimenti restituisce lo stesso oggetto del render
+    precedente (il chiamante non deve modificarlo).
+    Args:
+        state (ViewState): Istantanea della vista (view_state)
+    """
+    global rendered_state, rendered_frame
+    if state.source is None:
+        return BLANK_IMAGE
+    if rendered_frame is not None and rendered_state is not None and rendered_state.source is state.source \
+            and rendered_state[:3] == state[:3] and rendered_state[4:] == state[4:]:
+        return rendered_frame  # Niente è cambiato: nessun ritaglio o ridimensionamento
+    rendered_frame = render_view(state.source, state.zoom, state.quarters, state.pan_x, state.pan_y)
+    rendered_state = state
+    return rendered_frame
+
+# ====== Coda dei comandi ======
+PAN_MOVES = {'pan_left': (-1, 0), 'pan_right': (1, 0), 'pan_up': (0, -1), 'pan_down': (0, 1)}  # Direzione di ogni pan
+COMMANDS = ('next_image', 'prev_image', 'zoom_in', 'zoom_out', 'rotate_right', 'rotate_left', *PAN_MOVES)  # Azioni valide
+
+def coalesce_commands(actions):
+    """
+    Riduce una raffica di comandi a pochi passi con lo stesso effetto.
+    I cambi di immagine diventano un solo spostamento netto, e i comandi che li
+    precedono si scartano (la vista viene comunque resettata). I comandi uguali
+    consecutivi diventano un solo passo con molteplicità (5 zoom_in -> zoom + 0.5).
+    Args:
+        actions (list): Azioni nell'ordine di arrivo
+    Returns:
+        tuple: (spostamento netto dell'indice, None se nessun cambio immagine;
+                lista di (azione, ripetizioni) da applicare dopo)
+    """
+    move = None
+    steps = []
+    for action in actions:
+        if action in ('next_image', 'prev_image'):
+            move = (move or 0) + (1 if action == 'next_image' else -1)
+            steps = []  # La vista viene resettata: i comandi precedenti non contano
+        elif steps and steps[-1][0] == action:
+            steps[-1] = (action, steps[-1][1] + 1)
+        else:
+            steps.append((action, 1))
+    return move, steps
+
+def apply_commands(move, steps):
+    """
+    Applica un gruppo di comandi già ridotto da coalesce_commands.
+    Prima cambia immagine (una sola decodifica, quella dell'immagine finale,
+    fuori dal lock), poi applica zoom, rotazioni e pan sull'immagine nuova.
+    Returns:
+        ViewState: Istantanea della vista dopo i comandi
+    """
+    global current_image_index, zoom_factor, rotation_quarters, pan_x, pan_y
+    if move is not None:
+        with lock:
+            if image_files:
+                index = (current_image_index + move) % len(image_files)  # Cicla alla prima/ultima
+                changed = index != current_image_index
+                current_image_index = index
+                zoom_factor = 1.0; rotation_quarters = 0  # Resetta zoom e rotazione
+                pan_x, pan_y = 0.5, 0.5  # Vista centrata
+                publish_view()
+            else:
+                changed = False
+        if changed:
+            load_current_image()  # Carica la nuova immagine (fuori dal lock: di solito è già in cache)
+    with lock:
+        for action, n in steps:
+            if not image_files:
+                break
+            if action == 'zoom_in':  # Aumenta lo zoom
+                zoom_factor = min(5.0, zoom_factor + ZOOM_STEP * n)  # Limita zoom massimo a 5x
+            elif action == 'zoom_out':  # Riduce lo zoom
+                zoom_factor = max(0.1, zoom_factor - ZOOM_STEP * n)  # Limita zoom minimo a 0.1x
+            elif action in ('rotate_right', 'rotate_left'):
+                for _ in range(n % 4):
+                    if action == 'rotate_right':  # Ruota di 90° in senso orario
+                        rotation_quarters = (rotation_quarters + 1) % 4
+                        pan_x, pan_y = 1 - pan_y, pan_x  # Il centro della vista ruota con l'immagine
+                    else:  # Ruota di 90° in senso antiorario
+                        rotation_quarters = (rotation_quarters - 1) % 4
+                        pan_x, pan_y = pan_y, 1 - pan_x
+            elif current_image is not None:  # Sposta la vista di PAN_STEP dell'area visibile per ogni ripetizione
+                _, _, _, frac_w, frac_h = view_geometry(current_image.shape, zoom_factor, rotation_quarters)
+                dx, dy = PAN_MOVES[action]
+                pan_x += dx * n * PAN_STEP * min(frac_w, 1.0)
+                pan_y += dy * n * PAN_STEP * min(frac_h, 1.0)
+            if current_image is not None:  # La vista non può uscire dall'immagine
+                pan_x, pan_y = clamp_pan(pan_x, pan_y, *view_geometry(current_image.shape, zoom_factor, rotation_quarters)[3:])
+        if steps:
+            publish_view()  # La GUI vede il nuovo stato al prossimo frame
+        state = view_state
+    # Stampa log del gruppo di comandi per debug (fuori dal lock)
+    applied = ([f"move {move:+d}"] if move is not None else []) + [f"{a} x{n}" if n > 1 else a for a, n in steps]
+    print(f"[CMD] {', '.join(applied)} | idx={state.index} zoom={state.zoom:.2f} rot90={state.quarters} pan=({state.pan_x:.2f}, {state.pan_y:.2f})")
+    return state
+
+class CommandQueue:
+    """
+    Coda dei comandi gestuali con un solo thread che li applica.
+    Gli handler HTTP accodano l'azione e attendono. Il thread preleva tutto ciò che
+    è arrivato nel frattempo, lo riduce con coalesce_commands e lo applica in un
+    colpo solo: una raffica di next_image decodifica solo l'immagine finale e
+    produce un solo nuovo frame. Mentre un'immagine viene caricata, i comandi
+    successivi si accumulano e vengono applicati insieme al giro seguente.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = []  # Azioni in attesa, in ordine di arrivo
+        self._seq = 0  # Numero dell'ultima azione accodata
+        self._done = 0  # Le azioni fino a questo numero sono state applicate
+        self._state = None  # Istantanea della vista dopo l'ultimo gruppo applicato
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, action, timeout=COMMAND_TIMEOUT):
+        """
+        Accoda un'azione e attende che sia applicata.
+        Returns:
+            ViewState: Stato della vista dopo l'azione (o dopo un gruppo successivo),
+                       None se scade il timeout
+        """
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+            self._pending.append(action)
+            self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._done >= seq, timeout):
+                return None
+            return self._state
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                actions, self._pending = self._pending, []
+                last = self._seq
+            try:
+                state = apply_commands(*coalesce_commands(actions))
+            except Exception as e:
+                print(f"Errore nell'applicazione dei comandi {actions}: {e}")
+                state = view_state
+            with self._cond:
+                self._done = last
+                self._state = state
+                self._cond.notify_all()
+
+command_queue = CommandQueue()  # Coda condivisa dei comandi
 
 # ====== Flask endpoints ======
 @app.route('/status', methods=['GET'])
@@ -86,75 +876,52 @@ def status():
     """
     Endpoint GET che restituisce lo stato attuale del sistema (JSON).
     """
-    with lock:  # Usa il lock per accedere in sicurezza alle variabili condivise
-        return jsonify({
-            'images_dir': IMAGE_FOLDER,  # Percorso della cartella immagini
-            'count': len(image_files),  # Numero di immagini disponibili
-            'index': current_image_index if image_files else None,  # Indice immagine corrente
-            'current': image_files[current_image_index] if image_files else None,  # Nome file corrente
-            'zoom': zoom_factor,  # Fattore di zoom attuale
-            'rot90': rotation_quarters  # Rotazione attuale (in multipli di 90°)
-        })
+    state = view_state  # Istantanea coerente, senza attendere il lock
+    return jsonify({
+        'images_dir': IMAGE_FOLDER,  # Percorso della cartella immagini
+        'count': state.count,  # Numero di immagini disponibili
+        'index': state.index,  # Indice immagine corrente
+        'current': state.name,  # Nome file corrente
+        'zoom': state.zoom,  # Fattore di zoom attuale
+        'rot90': state.quarters,  # Rotazione attuale (in multipli di 90°)
+        'pan': [state.pan_x, state.pan_y]  # Centro della vista (coordinate normalizzate)
+    })
 
 @app.route('/rescan', methods=['POST'])
 def rescan():
     """
-    Endpoint POST che forza una nuova scansione della cartella immagini.
-    """
-    global current_image_index, zoom_factor, rotation_quarters
-    with lock:  # Sincronizza l'accesso alle variabili condivise
-        old_count = len(image_files)  # Memorizza il numero di immagini precedenti
-        scan_images()  # Riscansiona la cartella
-        if not image_files:  # Se non ci sono immagini
-            current_image_index = 0
-            load_current_image()  # Imposta immagine corrente a None
-            return jsonify({'status': 'ok', 'message': 'No images found', 'count': 0})
-        if old_count == 0:  # Se non c'erano immagini prima, resetta stato
-            current_image_index = 0
-            zoom_factor = 1.0
-            rotation_quarters = 0
-            load_current_image()  # Carica la prima immagine
-        return jsonify({'status': 'ok', 'count': len(image_files)})
+    Endpoint POST che forza una nuova scansione della cartella immagini
+    (di norma non serve: il watcher aggiorna la lista da solo).
+    """
+    added, removed, _ = scan_images()  # Riscansiona la cartella (applica solo le differenze)
+    count = view_state.count
+    if not count:
+        return jsonify({'status': 'ok', 'message': 'No images found', 'count': 0})
+    return jsonify({'status': 'ok', 'count': count, 'added': added, 'removed': removed})
 
 @app.route('/command', methods=['POST', 'GET'])
 def handle_command():
     """
     Endpoint per gestire comandi (es. cambio immagine, zoom, rotazione).
     Accetta sia GET (con parametro 'action') che POST (con JSON).
+    Il comando passa dalla coda dei comandi: la risposta arriva quando è stato
+    applicato (insieme agli altri arrivati nel frattempo).
     """
-    global current_image_index, zoom_factor, rotation_quarters
     # Estrae il parametro 'action' dalla richiesta
     action = request.args.get('action') if request.method == 'GET' else (request.json or {}).get('action')
     if not action:  # Se manca il parametro action, restituisce errore
         return jsonify({'status': 'error', 'message': 'missing action'}), 400
-    with lock:  # Sincronizza l'accesso alle variabili condivise
-        # Controlla se ci sono immagini per comandi che le richiedono
-        if not image_files and action in ('next_image', 'prev_image', 'zoom_in', 'zoom_out', 'rotate_right', 'rotate_left'):
-            return jsonify({'status': 'error', 'message': 'no images available'}), 409
-        if action == 'next_image':  # Passa all'immagine successiva
-            current_image_index = (current_image_index + 1) % len(image_files)  # Cicla alla prima se alla fine
-            zoom_factor = 1.0; rotation_quarters = 0  # Resetta zoom e rotazione
-            load_current_image()  # Carica nuova immagine
-        elif action == 'prev_image':  # Passa all'immagine precedente
-            current_image_index = (current_image_index - 1) % len(image_files)  # Cicla all'ultima se all'inizio
-            zoom_factor = 1.0; rotation_quarters = 0  # Resetta zoom e rotazione
-            load_current_image()  # Carica nuova immagine
-        elif action == 'zoom_in':  # Aumenta lo zoom
-            zoom_factor = min(5.0, zoom_factor + 0.1)  # Limita zoom massimo a 5x
-        elif action == 'zoom_out':  # Riduce lo zoom
-            zoom_factor = max(0.1, zoom_factor - 0.1)  # Limita zoom minimo a 0.1x
-        elif action == 'rotate_right':  # Ruota di 90° in senso orario
-            rotation_quarters = (rotation_quarters + 1) % 4
-        elif action == 'rotate_left':  # Ruota di 90° in senso antiorario
-            rotation_quarters = (rotation_quarters - 1) % 4
-        else:  # Azione non riconosciuta
-            return jsonify({'status': 'error', 'message': 'unknown action'}), 400
-        # Stampa log del comando per debug
-        print(f"[CMD] {action} | idx={current_image_index} zoom={zoom_factor:.2f} rot90={rotation_quarters}")
-        # Restituisce stato aggiornato
-        return jsonify({'status': 'success', 'action': action,
-                        'image': image_files[current_image_index] if image_files else None,
-                        'zoom': zoom_factor, 'rot90': rotation_quarters})
+    # Controlla se ci sono immagini (tutti i comandi le richiedono)
+    if action in COMMANDS and not view_state.count:
+        return jsonify({'status': 'error', 'message': 'no images available'}), 409
+    if action not in COMMANDS:  # Azione non riconosciuta
+        return jsonify({'status': 'error', 'message': 'unknown action'}), 400
+    state = command_queue.submit(action)
+    if state is None:  # Ancora in coda (es. decodifica molto lenta): verrà applicato comunque
+        return jsonify({'status': 'queued', 'action': action}), 202
+    # Stato aggiornato da restituire
+    return jsonify({'status': 'success', 'action': action, 'image': state.name,
+                    'zoom': state.zoom, 'rot90': state.quarters, 'pan': [state.pan_x, state.pan_y]})
 
 # ====== Thread Flask (server web) ======
 def run_flask():
@@ -170,18 +937,21 @@ def main():
     Funzione principale che gestisce la GUI OpenCV e il ciclo principale.
     """
     global running
-    scan_images()  # Scansiona inizialmente la cartella immagini
-    load_current_image()  # Carica la prima immagine (se presente)
+    scan_images()  # Scansiona inizialmente la cartella immagini (e carica la prima immagine, se presente)
+    FolderWatcher().start()  # Da qui in poi la lista viene aggiornata in modo incrementale
     # Avvia il server Flask in un thread separato (daemon per terminare con il programma)
     t = threading.Thread(target=run_flask, daemon=True)
     t.start()
-    # Crea una finestra OpenCV con dimensione automatica
+    # Crea una finestra OpenCV con dimensione automatica (il frame ha sempre la dimensione della vista)
     cv2.namedWindow(WINDOW_TITLE, cv2.WINDOW_AUTOSIZE)
+    shown = None  # Ultimo frame mostrato
     # Ciclo principale della GUI
     while running:
-        with lock:  # Sincronizza l'accesso per rendere l'immagine
-            frame = render_image()  # Ottiene l'immagine renderizzata
-        cv2.imshow(WINDOW_TITLE, frame)  # Mostra l'immagine nella finestra
+        # Legge l'ultima istantanea senza lock e renderizza fuori dal lock: i comandi non aspettano la GUI
+        frame = render_image(view_state)  # Ottiene l'immagine renderizzata (dalla cache se nulla è cambiato)
+        if frame is not shown:
+            cv2.imshow(WINDOW_TITLE, frame)  # Mostra l'immagine solo quando è cambiata
+            shown = frame
         # Attende 30ms per input da tastiera
         k = cv2.waitKey(30) & 0xFF
         if k == ord('q'):  # Se premuto 'q', esce dal ciclo
@@ -0,0 +1,256 @@
+# Importazione delle librerie necessarie
+import numpy as np  # NumPy per lo stato compatto dei filtri e il calcolo vettoriale
+import datetime  # Per convertire i timestamp ISO dei log CSV
+import sys  # Per leggere gli argomenti da riga di comando
+import warnings  # Per silenziare l'avviso di np.nanmedian sulle finestre vuote
+from trilateration import load_anchors, solve_positions, rewrite_log  # Trilaterazione vettoriale e rielaborazione dei log
+
+# ====== Configurazioni ======
+# Filtri applicati alle distanze, in ordine (nome, parametri). 'spike_ema' replica FilteredDistance dei tag.
+RANGE_FILTERS = [
+    ('spike_ema', {'alpha': 0.4, 'validation_threshold': 1.5}),
+]
+# Filtro applicato alla posizione dopo la trilaterazione: None oppure ('kalman', parametri)
+POSITION_FILTER = None  # es. ('kalman', {'process_noise': 0.5, 'measurement_noise': 0.15})
+
+# ====== Stato per tag ======
+class TagSlots:
+    """
+    Assegna a ogni tag una riga fissa negli array di stato dei filtri.
+    """
+    def __init__(self):
+        self.slots = {}  # tag_id -> riga
+
+    def lookup(self, tags):
+        """
+        Restituisce le righe dei tag (creandole per i tag nuovi).
+        """
+        return np.array([self.slots.setdefault(t, len(self.slots)) for t in tags], dtype=np.intp)
+
+    def __len__(self):
+        return len(self.slots)
+
+def _grow(array, rows, fill):
+    """
+    Allarga un array di stato (prima dimensione = tag) raddoppiandone la capacità.
+    """
+    if rows <= len(array):
+        return array
+    capacity = max(rows, 2 * len(array), 8)
+    grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+# ====== Filtri sulle distanze ======
+class SpikeEmaFilter:
+    """
+    Validatore di spike + smoothing esponenziale (EMA) per ogni coppia tag/ancora,
+    con la stessa logica di FilteredDistance in 'Tag with corrections.py'.
+    Stato: due matrici (tag, ancora).
+    """
+    def __init__(self, n_anchors, alpha=0.4, validation_threshold=1.5):
+        self.alpha = alpha
+        self.threshold = validation_threshold
+        self.smoothed = np.full((0, n_anchors), np.nan)  # Valore filtrato
+        self.last_valid = np.full((0, n_anchors), np.nan)  # Ultima distanza grezza accettata
+
+    def step(self, slots, raw):
+        """
+        Elabora un campione per ciascuno dei tag in slots (tutti diversi).
+        Args:
+            slots (np.ndarray): Righe di stato dei tag (n,)
+            raw (np.ndarray): Distanze grezze (n, M), NaN dove mancanti
+        Returns:
+            np.ndarray: Distanze filtrate (n, M)
+        """
+        self.smoothed = _grow(self.smoothed, slots.max() + 1, np.nan)
+        self.last_valid = _grow(self.last_valid, slots.max() + 1, np.nan)
+        smoothed = self.smoothed[slots]
+        last_valid = self.last_valid[slots]
+        present = np.isfinite(raw)
+        first = present & ~np.isfinite(smoothed)  # Primo valore: inizializza lo stato
+        accept = present & ~first & (np.abs(raw - last_valid) <= self.threshold)  # Scarta gli spike
+        smoothed = np.where(first, raw, smoothed)
+        smoothed = np.where(accept, self.alpha * raw + (1 - self.alpha) * smoothed, smoothed)
+        last_valid = np.where(first | accept, raw, last_valid)
+        self.smoothed[slots] = smoothed
+        self.last_valid[slots] = last_valid
+        return smoothed
+
+class MedianWindowFilter:
+    """
+    Mediana mobile sugli ultimi window campioni di ogni coppia tag/ancora.
+    Stato: un buffer circolare (tag, ancora, finestra).
+    """
+    def __init__(self, n_anchors, window=5):
+        self.window = window
+        self.buffer = np.full((0, n_anchors, window), np.nan)
+        self.heads = np.zeros(0, dtype=np.intp)
+
+    def step(self, slots, raw):
+        self.buffer = _grow(self.buffer, slots.max() + 1, np.nan)
+        self.heads = _grow(self.heads, slots.max() + 1, 0)
+        heads = self.heads[slots]
+        present = np.isfinite(raw)
+        # Scrive le nuove distanze nella posizione corrente del buffer (le mancanti non lo sporcano)
+        current = self.buffer[slots, :, heads]
+        self.buffer[slots, :, heads] = np.where(present, raw, current)
+        self.heads[slots] = (heads + 1) % self.window
+        with warnings.catch_warnings():  # Finestre ancora vuote: il risultato è NaN, senza avvisi
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmedian(self.buffer[slots], axis=2)
+
+# ====== Filtri sulla posizione ======
+class ConstantVelocityKalman:
+    """
+    Filtro di Kalman a velocità costante su x/y, uno per tag.
+    Stato: vettore (tag, 4) = [x, y, vx, vy] e covarianza (tag, 4, 4).
+    """
+    def __init__(self, process_noise=0.5, measurement_noise=0.15):
+        self.q = process_noise ** 2  # Varianza dell'accelerazione (m/s^2)^2
+        self.r = measurement_noise ** 2  # Varianza della misura di posizione (m^2)
+        self.state = np.full((0, 4), np.nan)
+        self.cov = np.zeros((0, 4, 4))
+        self.last_ts = np.full(0, np.nan)
+        self.H = np.array([[1.0, 0, 0, 0], [0, 1.0, 0, 0]])
+
+    def step(self, slots, ts, xy):
+        """
+        Elabora una posizione per ciascuno dei tag in slots (tutti diversi).
+        Args:
+            slots (np.ndarray): Righe di stato dei tag (n,)
+            ts (np.ndarray): Timestamp epoch (n,)
+            xy (np.ndarray): Posizioni misurate (n, 2), NaN se non disponibili
+        Returns:
+            np.ndarray: Posizioni filtrate (n, 2)
+        """
+        rows = slots.max() + 1
+        self.state = _grow(self.state, rows, np.nan)
+        self.cov = _grow(self.cov, rows, 0.0)
+        self.last_ts = _grow(self.last_ts, rows, np.nan)
+        x = self.state[slots]
+        P = self.cov[slots]
+        measured = np.all(np.isfinite(xy), axis=1)
+        new = measured & ~np.isfinite(x[:, 0])  # Primo fix del tag: inizializza lo stato
+        x[new] = np.column_stack([xy[new], np.zeros((new.sum(), 2))])
+        P[new] = np.diag([self.r, self.r, 1.0, 1.0])
+        old = np.isfinite(x[:, 0]) & ~new
+        # Predizione con dt per tag
+        dt = np.where(old, np.clip(ts - self.last_ts[slots], 0.0, 10.0), 0.0)
+        dt = np.nan_to_num(dt)
+        F = np.broadcast_to(np.eye(4), (len(slots), 4, 4)).copy()
+        F[:, 0, 2] = dt
+        F[:, 1, 3] = dt
+        dt2, dt3, dt4 = dt ** 2, dt ** 3 / 2, dt ** 4 / 4
+        Q = np.zeros((len(slots), 4, 4))
+        Q[:, 0, 0] = Q[:, 1, 1] = dt4 * self.q
+        Q[:, 0, 2] = Q[:, 2, 0] = Q[:, 1, 3] = Q[:, 3, 1] = dt3 * self.q
+        Q[:, 2, 2] = Q[:, 3, 3] = dt2 * self.q
+        x_pred = np.einsum('nij,nj->ni', F, np.nan_to_num(x))
+        P_pred = F @ P @ F.transpose(0, 2, 1) + Q
+        # Aggiornamento con la misura (solo dove disponibile)
+        upd = old & measured
+        S = self.H @ P_pred @ self.H.T + self.r * np.eye(2)
+        K = P_pred @ self.H.T @ np.linalg.inv(S)
+        innovation = np.nan_to_num(xy) - x_pred[:, :2]
+        x_upd = x_pred + np.einsum('nij,nj->ni', K, innovation)
+        P_upd = (np.eye(4) - K @ self.H) @ P_pred
+        x = np.where(old[:, None], np.where(upd[:, None], x_upd, x_pred), x)
+        P = np.where(old[:, None, None], np.where(upd[:, None, None], P_upd, P_pred), P)
+        self.state[slots] = x
+        self.cov[slots] = P
+        self.last_ts[slots] = np.where(measured | old, ts, self.last_ts[slots])
+        return x[:, :2]
+
+# ====== Pipeline ======
+RANGE_FILTER_TYPES = {'spike_ema': SpikeEmaFilter, 'median': MedianWindowFilter}
+POSITION_FILTER_TYPES = {'kalman': ConstantVelocityKalman}
+
+class FilterPipeline:
+    """
+    Stadio di filtraggio lato server: filtri sulle distanze, trilaterazione e
+    filtro opzionale sulla posizione, con stato separato per tag e ancora.
+    Un lotto viene elaborato a "turni": al turno k si prende il k-esimo campione
+    di ogni tag, così ogni passo è vettoriale su tag e ancore e l'ordine
+    temporale di ogni tag viene rispettato.
+    """
+    def __init__(self, anchors, range_filters=None, position_filter=POSITION_FILTER):
+        self.anchors = np.asarray(anchors, dtype=float)
+        n = len(self.anchors)
+        config = RANGE_FILTERS if range_filters is None else range_filters
+        self.range_filters = [RANGE_FILTER_TYPES[name](n, **params) for name, params in config]
+        self.position_filter = None
+        if position_filter is not None:
+            name, params = position_filter
+            self.position_filter = POSITION_FILTER_TYPES[name](**params)
+        self.slots = TagSlots()
+
+    def process(self, tags, ts, ranges):
+        """
+        Filtra un lotto di campioni.
+        Args:
+            tags (list): tag_id di ogni campione
+            ts (array-like): Timestamp epoch (n,)
+            ranges (array-like): Distanze grezze (n, M), NaN dove mancanti
+        Returns:
+            tuple: (distanze filtrate (n, M), posizioni filtrate (n, 2), NaN se non calcolabili)
+        """
+        ts = np.asarray(ts, dtype=float)
+        ranges = np.asarray(ranges, dtype=float).reshape(len(ts), len(self.anchors))
+        slots = self.slots.lookup(tags)
+        rounds = self._rounds(slots)
+        filtered = ranges.copy()
+        for idx in rounds:
+            for f in self.range_filters:
+                filtered[idx] = f.step(slots[idx], filtered[idx])
+        fix = solve_positions(filtered, self.anchors)
+        xy = np.column_stack([fix['x'], fix['y']])
+        if self.position_filter is not None:
+            for idx in rounds:
+                xy[idx] = self.position_filter.step(slots[idx], ts[idx], xy[idx])
+        return filtered, xy
+
+    @staticmethod
+    def _rounds(slots):
+        """
+        Divide gli indici del lotto in turni con al massimo un campione per tag.
+        """
+        order = np.argsort(slots, kind='stable')
+        sorted_slots = slots[order]
+        starts = np.r_[0, np.nonzero(np.diff(sorted_slots))[0] + 1]
+        # Posizione di ogni campione tra quelli del suo tag (0, 1, 2, ...)
+        occurrence = np.empty(len(slots), dtype=np.intp)
+        occurrence[order] = np.arange(len(slots)) - np.repeat(starts, np.diff(np.r_[starts, len(slots)]))
+        return [np.nonzero(occurrence == k)[0] for k in range(occurrence.max() + 1)] if len(slots) else []
+
+def refilter_log(csv_in, csv_out, pipeline=None):
+    """
+    Rielabora offline un log grezzo (formato CSV_HEADER) con la pipeline di filtri
+    attuale e scrive il log filtrato. Utile per provare nuovi parametri
+    (alpha, validation_threshold, ...) sui dati registrati.
+    """
+    pipeline = FilterPipeline(load_anchors()) if pipeline is None else pipeline
+    rewrite_log(csv_in, csv_out, len(pipeline.anchors),
+                lambda block, cols, ix, iy: _refilter_block(block, cols, ix, iy, pipeline))
+
+def _refilter_block(block, cols, ix, iy, pipeline):
+    ts = [datetime.datetime.fromisoformat(r[0]).timestamp() for r in block]
+    ranges = [[float(r[c]) if r[c] != '' else np.nan for c in cols] for r in block]
+    filtered, xy = pipeline.process([None] * len(block), ts, ranges)
+    rows = []
+    for row, d, (x, y) in zip(block, filtered, xy):
+        if not np.isfinite(x):  # Nessun fix valido: la riga non compare nel log filtrato
+            continue
+        for c, v in zip(cols, d):
+            row[c] = float(v) if np.isfinite(v) else ''
+        row[ix], row[iy] = float(x), float(y)
+        rows.append(row)
+    return rows
+
+# ====== Esecuzione principale ======
+if __name__ == '__main__':
+    # Uso: python filters.py refilter <log_grezzo.csv> <output.csv>
+    if len(sys.argv) != 4 or sys.argv[1] != 'refilter':
+        print('Uso: python filters.py refilter <log_grezzo.csv> <output.csv>')
+        sys.exit(1)
+    refilter_log(sys.argv[2], sys.argv[3])
@@ -0,0 +1,204 @@
+# Importazione delle librerie necessarie
+import numpy as np  # NumPy per il conteggio vettoriale per cella
+import datetime  # Per convertire i timestamp ISO dei log CSV
+import os  # Per operazioni sul file system (es. verifica esistenza file)
+import io  # Per restituire l'immagine PNG come bytes
+import csv  # Per leggere i log CSV a blocchi
+import collections  # Counter per le visite sparse di ogni tag
+from tracking_storage import BinaryLogReader, chunk_dir_for  # Lettura veloce dei log binari
+
+# ====== Configurazioni ======
+DEFAULT_BOUNDS = (0.0, 1.7, 0.0, 6.3)  # Area coperta dalla griglia (x_min, x_max, y_min, y_max), in metri
+DEFAULT_CELL_SIZE = 0.1  # Lato di una cella della griglia (in metri)
+MAX_GAP = 5.0  # Oltre questo intervallo (in secondi) tra due campioni il tempo non viene attribuito
+CHUNK_ROWS = 50000  # Righe lette per blocco: la memoria usata non dipende dalla lunghezza del log
+MAX_CELLS = 1_000_000  # Celle massime della griglia (circa 8 MB per matrice densa): limita la memoria di una richiesta
+
+# ====== Aggregazione ======
+def grid_shape(bounds, cell_size, max_cells=MAX_CELLS):
+    """
+    Numero di celle (nx, ny) della griglia per l'area e il lato di cella indicati.
+    Raises:
+        ValueError: Se il lato non è un numero finito positivo o le celle sono più di max_cells
+    """
+    x_min, x_max, y_min, y_max = bounds
+    if not (np.isfinite(cell_size) and cell_size > 0):
+        raise ValueError(f'invalid cell size: {cell_size!r}')
+    nx = max(1, int(np.ceil((x_max - x_min) / cell_size)))
+    ny = max(1, int(np.ceil((y_max - y_min) / cell_size)))
+    if nx * ny > max_cells:
+        raise ValueError(f'grid too large: {nx}x{ny} cells (max {max_cells})')
+    return nx, ny
+
+class OccupancyGrid:
+    """
+    Accumula tempo di permanenza e visite su una griglia 2D, un blocco di
+    campioni alla volta. Ogni campione riceve il tempo fino al campione
+    successivo dello stesso tag (al massimo max_gap secondi); una visita è
+    l'ingresso di un tag in una cella diversa dalla precedente (o dopo una pausa
+    più lunga di max_gap). Lo stato tra un blocco e l'altro è solo l'ultimo
+    campione di ogni tag, quindi la memoria resta limitata; le visite di ogni
+    tag sono sparse (solo le celle visitate), così non crescono con nx * ny per tag.
+    Permanenza, campioni e visite usano tutti _cells per assegnare i punti alle celle.
+    """
+    def __init__(self, bounds=DEFAULT_BOUNDS, cell_size=DEFAULT_CELL_SIZE, max_gap=MAX_GAP):
+        self.x_min, self.x_max, self.y_min, self.y_max = bounds
+        self.cell_size = cell_size
+        self.max_gap = max_gap
+        self.nx, self.ny = grid_shape(bounds, cell_size)
+        self.x_edges = self.x_min + cell_size * np.arange(self.nx + 1)
+        self.y_edges = self.y_min + cell_size * np.arange(self.ny + 1)
+        self.dwell = np.zeros((self.nx, self.ny))  # Secondi di permanenza per cella
+        self.samples = np.zeros((self.nx, self.ny), dtype=np.int64)  # Campioni per cella
+        self.visits = {}  # tag_id -> Counter indice lineare della cella -> visite
+        self._last = {}  # tag_id -> (timestamp, x, y, cella) dell'ultimo campione non ancora attribuito
+
+    def _cells(self, x, y):
+        """
+        Indice lineare della cella di ogni punto (-1 se fuori dalla griglia).
+        """
+        ix = np.floor((x - self.x_min) / self.cell_size).astype(np.int64)
+        iy = np.floor((y - self.y_min) / self.cell_size).astype(np.int64)
+        inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny) & np.isfinite(x) & np.isfinite(y)
+        return np.where(inside, ix * self.ny + iy, -1)
+
+    def add(self, tag_id, ts, x, y):
+        """
+        Aggiunge un blocco di campioni di un tag, in ordine di tempo.
+        Args:
+            tag_id: Identificativo del tag (None per il log senza tag)
+            ts, x, y (np.ndarray): Timestamp epoch e coordinate dei campioni
+        """
+        ts = np.asarray(ts, dtype=float)
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if not len(ts):
+            return
+        cells = self._cells(x, y)
+        last = self._last.get(tag_id)
+        if last is not None:  # Riprende l'ultimo campione del blocco precedente
+            ts = np.concatenate(([last[0]], ts))
+            x = np.concatenate(([last[1]], x))
+            y = np.concatenate(([last[2]], y))
+            prev_cells = np.concatenate(([last[3]], cells))
+        else:
+            prev_cells = cells
+        n_cells = self.nx * self.ny
+        # Tempo attribuito a ogni campione: fino al successivo, tagliato a max_gap (l'ultimo resta in sospeso)
+        gaps = np.diff(ts)
+        dt = np.where((gaps >= 0) & (gaps <= self.max_gap), gaps, 0.0)
+        done = prev_cells[:-1]
+        inside = done >= 0
+        self.dwell += np.bincount(done[inside], weights=dt[inside], minlength=n_cells).reshape(self.nx, self.ny)
+        # Campioni e visite (solo quelli nuovi, non quello ripreso dal blocco precedente)
+        offset = 1 if last is not None else 0
+        new_cells = prev_cells[offset:]
+        self.samples += np.bincount(new_cells[new_cells >= 0], minlength=n_cells).reshape(self.nx, self.ny)
+        if last is not None:
+            before = prev_cells[:-1]
+            pause = gaps > self.max_gap
+        else:
+            before = np.concatenate(([-1], cells[:-1]))
+            pause = np.concatenate(([True], np.diff(ts) > self.max_gap))
+        entered = (new_cells >= 0) & ((new_cells != before) | pause)
+        visits = self.visits.setdefault(tag_id, collections.Counter())
+        cells_in, counts = np.unique(new_cells[entered], return_counts=True)
+        visits.update(dict(zip(cells_in.tolist(), counts.tolist())))
+        self._last[tag_id] = (ts[-1], x[-1], y[-1], prev_cells[-1])
+
+    def to_json(self):
+        """
+        Restituisce il risultato in forma serializzabile (per l'endpoint JSON).
+        Le visite per tag sono in forma sparsa: [[ix, iy, visite], ...].
+        """
+        tags = {}
+        for tag_id, visits in self.visits.items():
+            tags['' if tag_id is None else str(tag_id)] = {
+                'total_visits': sum(visits.values()),
+                'cells': [[i // self.ny, i % self.ny, n] for i, n in sorted(visits.items())],
+            }
+        return {
+            'bounds': [self.x_min, self.x_max, self.y_min, self.y_max],
+            'cell_size': self.cell_size,
+            'shape': [self.nx, self.ny],
+            'dwell_seconds': np.round(self.dwell, 3).tolist(),  # [ix][iy]
+            'samples': self.samples.tolist(),
+            'tags': tags,
+        }
+
+    def render_png(self, title='Occupazione'):
+        """
+        Disegna la mappa del tempo di permanenza e la restituisce come PNG.
+        Matplotlib viene importato solo qui, così il calcolo non ne dipende.
+        """
+        import matplotlib
+        matplotlib.use('Agg')  # Backend senza finestra (il server non ha display)
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(4, 8))
+        minutes = np.ma.masked_equal(self.dwell.T / 60.0, 0.0)  # Le celle mai visitate restano trasparenti
+        mesh = ax.pcolormesh(self.x_edges, self.y_edges, minutes, cmap='hot_r', shading='flat')
+        fig.colorbar(mesh, ax=ax, label='Permanenza (min)')
+        ax.set_aspect('equal')
+        ax.set_title(title)
+        ax.set_xlabel('x (m)')
+        ax.set_ylabel('y (m)')
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', bbox_inches='tight')
+        plt.close(fig)
+        return buf.getvalue()
+
+# ====== Lettura dei log a blocchi ======
+def iter_log_chunks(file_path, t_from=None, t_to=None, chunk_rows=CHUNK_ROWS):
+    """
+    Legge un log a blocchi e restituisce (ts, x, y) come array NumPy.
+    Se esiste la cartella dei chunk binari del log usa quella (nessun parsing
+    di testo), altrimenti legge il CSV chunk_rows righe alla volta.
+    """
+    chunk_dir = chunk_dir_for(file_path)
+    if os.path.isdir(chunk_dir):
+        lo = -np.inf if t_from is None else t_from
+        hi = np.inf if t_to is None else t_to
+        for recs in BinaryLogReader(chunk_dir).iter_chunks():
+            ts = recs['timestamp']
+            keep = (ts >= lo) & (ts <= hi)
+            if keep.any():
+                yield ts[keep], recs['x'][keep].astype(float), recs['y'][keep].astype(float)
+        return
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Salta l'intestazione
+        ts, xs, ys = [], [], []
+        for row in reader:
+            try:
+                t = datetime.datetime.fromisoformat(row[0]).timestamp()
+                x, y = float(row[5]), float(row[6])
+            except (IndexError, ValueError):  # Righe incomplete o senza posizione
+                continue
+            if (t_from is not None and t < t_from) or (t_to is not None and t > t_to):
+                continue
+            ts.append(t)
+            xs.append(x)
+            ys.append(y)
+            if len(ts) >= chunk_rows:
+                yield np.array(ts), np.array(xs), np.array(ys)
+                ts, xs, ys = [], [], []
+        if ts:
+            yield np.array(ts), np.array(xs), np.array(ys)
+
+def aggregate_logs(sources, t_from=None, t_to=None, **grid_kwargs):
+    """
+    Costruisce la griglia di occupazione da più log.
+    Args:
+        sources (list): Coppie (tag_id, percorso del log)
+        t_from, t_to (float): Intervallo temporale in secondi epoch (opzionale)
+        grid_kwargs: Parametri di OccupancyGrid (bounds, cell_size, max_gap)
+    Returns:
+        OccupancyGrid: Griglia aggregata
+    """
+    grid = OccupancyGrid(**grid_kwargs)
+    for tag_id, path in sources:
+        for ts, x, y in iter_log_chunks(path, t_from, t_to):
+            grid.add(tag_id, ts, x, y)
+    return grid
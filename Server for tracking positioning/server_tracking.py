@@ -1,56 +1,469 @@
 # Importazione delle librerie necessarie
-from flask import Flask, request, jsonify # Flask per creare un server web API, request per gestire le richieste, jsonify per risposte JSON
+from flask import Flask, request, jsonify, Response # Flask per creare un server web API, request per gestire le richieste, jsonify per risposte JSON
 import datetime # Per generare timestamp nel formato ISO
-import os # Per operazioni sul file system (es. verifica esistenza file)
-import csv # Per gestire la scrittura su file CSV
+import threading # Per proteggere il registro dei writer
+import atexit # Per svuotare i buffer alla chiusura del server
+import math # Per rappresentare le distanze mancanti (NaN)
+import os # Per costruire i percorsi delle partizioni per tag
+import re # Per validare gli identificativi dei tag
+import json # Per serializzare gli eventi dello stream
+import collections # deque a lunghezza fissa per le code degli iscritti
+import heapq # Per unire in ordine di tempo i log di più partizioni
+from tracking_storage import CsvLogWriter, BinaryLogWriter, chunk_dir_for, build_csv_index, iter_csv_range, sort_within_slack, CSV_HEADER # Backend di memorizzazione dei log
+from trilateration import load_anchors, solve_positions # Trilaterazione vettoriale lato server
+from occupancy import aggregate_logs, grid_shape # Mappe di occupazione e tempi di permanenza
+from filters import FilterPipeline # Filtraggio lato server delle distanze e delle posizioni
+import glob # Per trovare le partizioni dei tag
 # Creazione dell'istanza dell'applicazione Flask
 app = Flask(__name__)
 # ====== Configurazioni ======
 LOG_FILE_RAW = 'tracking_log.csv' # Nome del file CSV per i dati senza stabilizzazione
 LOG_FILE_FILTERED = 'tracking_log_filtered.csv' # Nome del file CSV per i dati con stabilizzazione
-CSV_HEADER = ['timestamp', 'dist0', 'dist1', 'dist2', 'dist3', 'x', 'y'] # Intestazione del file CSV con i campi attesi
+REQUIRED_FIELDS = ['dist0', 'dist1', 'dist2', 'dist3', 'x', 'y'] # Campi obbligatori di ogni campione
+MAX_BATCH_SIZE = 1000 # Numero massimo di campioni accettati in un singolo lotto
+# Backend di memorizzazione attivi: 'csv' (testo, formato CSV_HEADER) e/o 'binary' (chunk .npy a larghezza fissa)
+STORAGE_BACKENDS = ('csv',)
+ANCHORS = load_anchors() # Geometria delle ancore (anchors.json), una riga per ogni indice distN
+PARTITION_DIR = 'tags' # Cartella delle partizioni per tag (tags/<tag_id>/tracking_log.csv)
+TAG_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$') # Identificativi ammessi (usati anche come nomi di cartella)
+STREAM_QUEUE_SIZE = 256 # Fix in coda per ogni iscritto allo stream (oltre, si scartano i più vecchi)
+STREAM_KEEPALIVE = 15.0 # Secondi senza eventi dopo i quali lo stream invia un commento di keep-alive
+# Area della mappa di occupazione (x_min, x_max, y_min, y_max): per default il rettangolo delle ancore
+HEATMAP_BOUNDS = (float(ANCHORS[:, 0].min()), float(ANCHORS[:, 0].max()), float(ANCHORS[:, 1].min()), float(ANCHORS[:, 1].max()))
+HEATMAP_CELL_SIZE = 0.1 # Lato delle celle della mappa di occupazione (in metri)
+# Se True, i campioni grezzi (/log, /log_batch) passano anche dalla pipeline di filtri del server
+# (configurata in filters.py) e il risultato viene salvato nel log filtrato. In questo caso
+# /stream e /positions ricevono solo i fix filtrati (una sola serie per tag); i grezzi vanno solo nel log
+SERVER_FILTERING = False
 # ====== Funzioni di supporto ======
-def ensure_header(file_path):
+def parse_timestamp(value, clock_offset=0.0):
     """
-    Crea il file CSV con l'intestazione se non esiste o è vuoto.
+    Converte un timestamp inviato dal dispositivo in secondi epoch del server.
+    Args:
+        value: Secondi epoch (int/float) oppure stringa ISO; None usa l'ora del server
+        clock_offset (float): Secondi da sommare per allineare l'orologio del dispositivo a quello del server
+    Returns:
+        float: Secondi epoch
+    Raises:
+        ValueError: Se il timestamp non è valido, non è finito o non è rappresentabile come data
     """
-    # Controlla se il file non esiste o è vuoto (dimensione 0)
-    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-        with open(file_path, 'w', newline='') as f: # Apre il file in modalità scrittura
-            writer = csv.writer(f) # Crea un oggetto writer per il CSV
-            writer.writerow(CSV_HEADER) # Scrive l'intestazione definita
+    if value is None:  # Nessun timestamp dal dispositivo: usa l'ora di ricezione
+        return datetime.datetime.now().timestamp()
+    if isinstance(value, str):  # Stringa ISO: viene validata e convertita
+        return datetime.datetime.fromisoformat(value).timestamp()
+    # Valore numerico: secondi epoch del dispositivo, corretti con l'offset dell'orologio
+    ts = float(value) + clock_offset
+    # Il log lo scrive come data ISO: i valori non convertibili vanno rifiutati qui, non nel thread di scrittura
+    try:
+        datetime.datetime.fromtimestamp(ts)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f'timestamp out of range: {value!r}')
+    return ts
+
+def extract_ranges(data):
+    """
+    Estrae le distanze da tutte le ancore configurate.
+    Le distanze possono arrivare come lista "dists" oppure come campi dist0..distN.
+    Returns:
+        list: Una distanza per ancora (float), NaN dove mancante
+    Raises:
+        TypeError, ValueError: Se i valori non sono numerici o la lista ha lunghezza errata
+    """
+    if 'dists' in data:
+        ranges = data['dists']
+        if not isinstance(ranges, list) or len(ranges) != len(ANCHORS):
+            raise ValueError(f'dists must be a list of {len(ANCHORS)} values')
+    else:
+        ranges = [data.get(f'dist{i}') for i in range(len(ANCHORS))]
+    return [float(v) if v is not None else math.nan for v in ranges]
+
+def parse_sample(data, clock_offset=0.0):
+    """
+    Valida un singolo campione e lo converte in un record.
+    Se il campione non contiene x e y, la posizione viene lasciata a None e
+    calcolata in seguito dal server (vedi resolve_positions).
+    Args:
+        data (dict): Campione con i campi dist0..dist3, x, y (oppure solo le distanze) e opzionalmente timestamp
+        clock_offset (float): Correzione dell'orologio del dispositivo (vedi parse_timestamp)
+    Returns:
+        tuple: Record (timestamp epoch, dist0..dist3, x, y); le distanze mancanti sono None
+    Raises:
+        KeyError: Se mancano campi obbligatori (args[0] contiene la lista dei campi mancanti)
+        TypeError, ValueError: Se i valori non sono numerici
+    """
+    if 'x' in data or 'y' in data: # Posizione calcolata dal dispositivo: formato originale
+        missing = [k for k in REQUIRED_FIELDS if k not in data] # Trova eventuali campi mancanti
+        position = (float(data['x']) if 'x' in data else None, float(data['y']) if 'y' in data else None)
+    else: # Solo distanze: servono tutte le ancore configurate (valore null se non disponibile)
+        missing = [] if 'dists' in data else [f'dist{i}' for i in range(len(ANCHORS)) if f'dist{i}' not in data]
+        position = (None, None)
+    if missing:
+        raise KeyError(missing)
+    ranges = extract_ranges(data)[:4] # Il record conserva le prime 4 distanze (colonne dist0..dist3)
+    ranges += [math.nan] * (4 - len(ranges))
+    # Crea il record, convertendo i valori in float dove necessario
+    return (
+        parse_timestamp(data.get('timestamp'), clock_offset), # Timestamp del dispositivo o del server
+        *[None if math.isnan(d) else d for d in ranges], # dist0..dist3, None se mancanti
+        *position, # x, y (None se da calcolare)
+    )
+
+def request_object():
+    """
+    Corpo JSON della richiesta ({} se assente o non valido).
+    Returns:
+        dict: Il corpo, oppure None se è un JSON valido ma non un oggetto (es. una lista)
+    """
+    data = request.get_json(silent=True) # silent=True evita errori se il JSON non è valido
+    if data is None:
+        return {}
+    return data if isinstance(data, dict) else None
+
+def parse_tag_id(value):
+    """
+    Valida l'identificativo del tag.
+    Returns:
+        str: tag_id, oppure None per i dispositivi che non lo inviano (log storico)
+    Raises:
+        ValueError: Se l'identificativo non è valido come nome di partizione
+    """
+    if value is None:
+        return None
+    value = str(value)
+    if not TAG_ID_PATTERN.match(value) or value in ('.', '..'):
+        raise ValueError(f'invalid tag_id: {value!r}')
+    return value
+
+def partition_path(file_path, tag_id):
+    """
+    Restituisce il file di log della partizione del tag.
+    I campioni senza tag_id continuano a finire nel file di log storico.
+    """
+    if tag_id is None:
+        return file_path
+    directory = os.path.join(PARTITION_DIR, tag_id)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, os.path.basename(file_path))
+
+def log_sources(file_path, tag_id=None):
+    """
+    Restituisce le coppie (tag_id, percorso) dei log da leggere: il log storico
+    senza tag più le partizioni di tutti i tag (oppure solo quella richiesta).
+    """
+    if tag_id is not None:
+        return [(tag_id, os.path.join(PARTITION_DIR, tag_id, os.path.basename(file_path)))]
+    sources = [(None, file_path)]
+    for path in sorted(glob.glob(os.path.join(PARTITION_DIR, '*', os.path.basename(file_path)))):
+        sources.append((os.path.basename(os.path.dirname(path)), path))
+    return sources
+
+def resolve_positions(records, samples):
+    """
+    Calcola con un'unica trilaterazione vettoriale la posizione di tutti i record
+    arrivati senza x, y.
+    Args:
+        records (list): Record prodotti da parse_sample (modificati sul posto)
+        samples (list): Campioni originali corrispondenti (per leggere tutte le distanze)
+    Returns:
+        tuple: (fixes, unresolved) dove fixes è la lista dei fix calcolati
+               {index, x, y, residual, cond} e unresolved gli indici senza fix valido
+    """
+    pending = [i for i, r in enumerate(records) if r[5] is None]
+    if not pending:
+        return [], []
+    fix = solve_positions([extract_ranges(samples[i]) for i in pending], ANCHORS)
+    fixes, unresolved = [], []
+    for j, i in enumerate(pending):
+        if not fix['valid'][j]: # Sistema degenere o meno di 3 distanze
+            unresolved.append(i)
+            continue
+        x, y = float(fix['x'][j]), float(fix['y'][j])
+        records[i] = records[i][:5] + (x, y)
+        fixes.append({'index': i, 'x': x, 'y': y,
+                      'residual': float(fix['residual'][j]), 'cond': float(fix['cond'][j])})
+    return fixes, unresolved
+
+# Writer aperti, uno per coppia (backend, file di log), creati alla prima richiesta
+writers = {}
+writers_lock = threading.Lock()
+# Indici temporali dei log letti senza writer aperto: percorso -> ((inode, dimensione), indice)
+read_indexes = {}
+
+def get_writer(file_path, backend='csv'):
+    """
+    Restituisce il writer del backend indicato per il file di log, creandolo se necessario.
+    Il backend 'binary' scrive nella cartella dei chunk associata al file (vedi chunk_dir_for).
+    """
+    with writers_lock:
+        writer = writers.get((backend, file_path))
+        if writer is None:
+            if backend == 'csv':
+                writer = CsvLogWriter(file_path)
+            elif backend == 'binary':
+                writer = BinaryLogWriter(chunk_dir_for(file_path))
+            else:
+                raise ValueError(f'unknown storage backend: {backend}')
+            writers[(backend, file_path)] = writer
+            read_indexes.pop(file_path, None) # Da ora l'indice lo mantiene il writer
+        return writer
+
+def read_index(file_path):
+    """
+    Restituisce l'indice temporale per leggere un log CSV senza aprirlo in scrittura.
+    Se il writer del file esiste già ne svuota la coda e usa il suo indice;
+    altrimenti costruisce l'indice con una lettura del file e lo riusa finché
+    inode e dimensione non cambiano (nessun thread di scrittura avviato).
+    """
+    with writers_lock:
+        writer = writers.get(('csv', file_path))
+        cached = read_indexes.get(file_path)
+    if writer is not None:
+        writer.flush() # Rende leggibili anche le righe ancora in coda
+        return writer.index
+    st = os.stat(file_path)
+    key = (st.st_ino, st.st_size)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    index = build_csv_index(file_path)
+    with writers_lock:
+        if ('csv', file_path) not in writers: # Nel frattempo potrebbe essere stato aperto un writer
+            read_indexes[file_path] = (key, index)
+    return index
+
+def close_writers():
+    """
+    Svuota e chiude tutti i writer (chiamata alla chiusura del server).
+    """
+    with writers_lock:
+        for writer in writers.values():
+            writer.close()
+        writers.clear()
+
+atexit.register(close_writers) # Nessuna riga in coda viene persa alla chiusura
+
+def append_rows(file_path, rows):
+    """
+    Accoda uno o più record ai writer di tutti i backend attivi (la scrittura avviene in background).
+    """
+    for backend in STORAGE_BACKENDS:
+        get_writer(file_path, backend).append(rows)
+
+# ====== Stream dei fix ======
+class StreamSubscriber:
+    """
+    Coda limitata di un singolo client dello stream.
+    Se il client è lento, i fix più vecchi vengono scartati (e contati) invece
+    di rallentare l'ingest o gli altri client.
+    """
+    def __init__(self, maxlen, tag_id=None):
+        self.queue = collections.deque(maxlen=maxlen)
+        self.cond = threading.Condition()
+        self.tag_id = tag_id # Se impostato, riceve solo i fix di questo tag
+        self.dropped = 0 # Fix scartati dall'ultima lettura
+
+    def push(self, fixes):
+        with self.cond:
+            overflow = len(self.queue) + len(fixes) - self.queue.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self.queue.extend(fixes) # La deque a lunghezza fissa scarta i più vecchi
+            self.cond.notify()
+
+    def pop_all(self, timeout):
+        """
+        Attende fino a timeout secondi e restituisce (fix in coda, fix scartati).
+        """
+        with self.cond:
+            if not self.queue:
+                self.cond.wait(timeout)
+            fixes = list(self.queue)
+            self.queue.clear()
+            dropped, self.dropped = self.dropped, 0
+        return fixes, dropped
+
+class FixBroadcaster:
+    """
+    Distribuisce ogni fix accettato a tutti gli iscritti allo stream (fan-out).
+    publish() non blocca mai: copia i fix nelle code limitate degli iscritti.
+    """
+    def __init__(self, queue_size=STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, tag_id=None):
+        subscriber = StreamSubscriber(self.queue_size, tag_id)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, fixes):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            selected = fixes if subscriber.tag_id is None else [f for f in fixes if f['tag_id'] == subscriber.tag_id]
+            if selected:
+                subscriber.push(selected)
+
+broadcaster = FixBroadcaster()
+
+def make_fix(record, tag_id, source):
+    """
+    Converte un record nel fix pubblicato da /positions e /stream.
+    """
+    return {'tag_id': tag_id, 'timestamp': record[0], 'x': record[5], 'y': record[6], 'source': source}
+
+# Indice in memoria dell'ultimo fix di ogni tag (accesso O(1) per tag_id)
+latest_positions = {}
+latest_lock = threading.Lock()
+
+def record_samples(file_path, records, tags, publish=True):
+    """
+    Instrada i record verso le partizioni dei rispettivi tag (una scrittura per
+    partizione) e aggiorna l'indice degli ultimi fix.
+    Args:
+        file_path (str): File di log di destinazione (grezzo o filtrato)
+        records (list): Record validati e con posizione
+        tags (list): tag_id di ogni record (None per il log storico)
+        publish (bool): Se False i record vengono solo salvati, senza aggiornare /positions e /stream
+    """
+    groups = {} # Record raggruppati per tag, nell'ordine di arrivo
+    for record, tag_id in zip(records, tags):
+        groups.setdefault(tag_id, []).append(record)
+    source = 'filtered' if file_path == LOG_FILE_FILTERED else 'raw'
+    for tag_id, group in groups.items():
+        append_rows(partition_path(file_path, tag_id), group)
+        if not publish:
+            continue
+        last = max(group, key=lambda r: r[0]) # Record più recente del gruppo
+        fix = make_fix(last, tag_id, source)
+        with latest_lock:
+            current = latest_positions.get(tag_id)
+            if current is None or current['timestamp'] <= fix['timestamp']: # Ignora i campioni arrivati in ritardo
+                latest_positions[tag_id] = fix
+    if publish:
+        broadcaster.publish([make_fix(r, t, source) for r, t in zip(records, tags)]) # Notifica gli iscritti allo stream
+
+# Stato dei filtri per tag e ancora, condiviso da tutte le richieste
+filter_pipeline = FilterPipeline(ANCHORS)
+filter_lock = threading.Lock()
+
+def filter_samples(records, tags, samples):
+    """
+    Stadio di filtraggio lato server: filtra le distanze grezze dei campioni,
+    ricalcola la posizione e salva i fix validi nel log filtrato del tag.
+    Va chiamata solo con i campioni accettati (lo stato dei filtri avanza a ogni chiamata).
+    """
+    ranges = [extract_ranges(sample) for sample in samples]
+    with filter_lock: # Lo stato dei filtri avanza in ordine di arrivo
+        filtered, xy = filter_pipeline.process(tags, [r[0] for r in records], ranges)
+    out_records, out_tags = [], []
+    for record, tag_id, d, (x, y) in zip(records, tags, filtered, xy):
+        if not (math.isfinite(x) and math.isfinite(y)): # Nessun fix valido dopo il filtraggio
+            continue
+        dists = [float(v) if math.isfinite(v) else None for v in d[:4]]
+        dists += [None] * (4 - len(dists))
+        out_records.append((record[0], *dists, float(x), float(y)))
+        out_tags.append(tag_id)
+    if out_records:
+        record_samples(LOG_FILE_FILTERED, out_records, out_tags)
 
 def log_data_generic(file_path):
     """
     Funzione generica per registrare dati in un file CSV specifico.
     """
-    ensure_header(file_path) # Assicura che il file CSV abbia l'intestazione
-    # Estrae i dati JSON dalla richiesta (silent=True evita errori se JSON non valido)
-    data = request.get_json(silent=True) or {}
-    # Valida la presenza dei campi obbligatori
-    required = ['dist0', 'dist1', 'dist2', 'dist3', 'x', 'y']
-    missing = [k for k in required if k not in data] # Trova eventuali campi mancanti
-    if missing: # Se mancano campi, restituisce errore
-        return jsonify({'status': 'error', 'missing': missing}), 400
+    # Estrae i dati JSON dalla richiesta
+    data = request_object()
+    if data is None:
+        return jsonify({'status': 'error', 'message': 'JSON body must be an object'}), 400
+    try:
+        tag_id = parse_tag_id(data.get('tag_id')) # Identificativo del tag (opzionale)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'invalid tag_id'}), 400
     try:
-        # Crea una riga per il CSV, convertendo i valori in float dove necessario
-        row = [
-            datetime.datetime.now().isoformat(), # Timestamp corrente in formato ISO
-            float(data['dist0']) if data['dist0'] is not None else '', # Converte dist0 in float o lascia vuoto
-            float(data['dist1']) if data['dist1'] is not None else '', # Converte dist1 in float o lascia vuoto
-            float(data['dist2']) if data['dist2'] is not None else '', # Converte dist2 in float o lascia vuoto
-            float(data['dist3']) if data['dist3'] is not None else '', # Converte dist3 in float o lascia vuoto
-            float(data['x']), # Converte x in float
-            float(data['y']), # Converte y in float
-        ]
+        row = parse_sample(data) # Valida e converte il campione
+    except KeyError as e: # Se mancano campi, restituisce errore
+        return jsonify({'status': 'error', 'missing': e.args[0]}), 400
     except (TypeError, ValueError): # Gestisce errori di conversione numerica
         return jsonify({'status': 'error', 'message': 'invalid numeric payload'}), 400
-    # Scrive la riga nel file CSV
-    with open(file_path, 'a', newline='') as f: # Apre il file in modalità append
-        writer = csv.writer(f) # Crea un oggetto writer per il CSV
-        writer.writerow(row) # Scrive la riga con i dati
-    # Restituisce una risposta di successo
-    return jsonify({'status': 'ok'}), 200
+    rows = [row]
+    fixes, unresolved = resolve_positions(rows, [data]) # Trilaterazione se il dispositivo ha inviato solo distanze
+    if unresolved:
+        return jsonify({'status': 'error', 'message': 'position not computable'}), 422
+    server_filtering = SERVER_FILTERING and file_path == LOG_FILE_RAW
+    record_samples(file_path, rows, [tag_id], publish=not server_filtering) # Accoda il record alla partizione del tag
+    if server_filtering: # Filtraggio lato server dei dati grezzi (solo campioni accettati)
+        filter_samples(rows, [tag_id], [data])
+    # Restituisce una risposta di successo (con il fix calcolato dal server, se presente)
+    response = {'status': 'ok'}
+    if fixes:
+        response.update({k: v for k, v in fixes[0].items() if k != 'index'})
+    return jsonify(response), 200
+
+def log_batch_generic(file_path):
+    """
+    Registra un lotto di campioni: valida tutto il lotto in un solo passaggio
+    e, solo se è interamente valido, lo accoda con una singola scrittura.
+    Formato atteso: {"samples": [{...}, ...], "device_time": <opzionale>, "tag_id": <opzionale>}
+    dove device_time è l'orologio del dispositivo al momento dell'invio e tag_id
+    vale per tutti i campioni che non ne specificano uno proprio.
+    """
+    data = request_object()
+    if data is None:
+        return jsonify({'status': 'error', 'message': 'JSON body must be an object'}), 400
+    samples = data.get('samples')
+    if not isinstance(samples, list) or not samples: # Il lotto deve essere una lista non vuota
+        return jsonify({'status': 'error', 'message': 'samples must be a non-empty list'}), 400
+    if len(samples) > MAX_BATCH_SIZE: # Limita la dimensione del lotto
+        return jsonify({'status': 'error', 'message': f'too many samples (max {MAX_BATCH_SIZE})'}), 413
+    # Se il dispositivo invia il proprio orologio, calcola lo scarto rispetto al server
+    clock_offset = 0.0
+    if data.get('device_time') is not None:
+        try:
+            clock_offset = datetime.datetime.now().timestamp() - float(data['device_time'])
+            if not math.isfinite(clock_offset):
+                raise ValueError(data['device_time'])
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'invalid device_time'}), 400
+    rows = []
+    tags = []
+    errors = [] # Errori per indice del campione
+    for i, sample in enumerate(samples):
+        if not isinstance(sample, dict):
+            errors.append({'index': i, 'message': 'sample must be an object'})
+            continue
+        try:
+            tag_id = parse_tag_id(sample.get('tag_id', data.get('tag_id')))
+        except ValueError:
+            errors.append({'index': i, 'message': 'invalid tag_id'})
+            continue
+        try:
+            rows.append(parse_sample(sample, clock_offset))
+            tags.append(tag_id)
+        except KeyError as e:
+            errors.append({'index': i, 'missing': e.args[0]})
+        except (TypeError, ValueError):
+            errors.append({'index': i, 'message': 'invalid numeric payload'})
+    if errors: # Nessuna scrittura parziale: il lotto viene rifiutato per intero
+        return jsonify({'status': 'error', 'errors': errors}), 400
+    fixes, unresolved = resolve_positions(rows, samples) # Trilaterazione vettoriale dei campioni senza x, y
+    skipped = set(unresolved)
+    tags = [t for i, t in enumerate(tags) if i not in skipped]
+    rows = [r for i, r in enumerate(rows) if i not in skipped] # I campioni senza fix valido non vengono salvati
+    accepted = [sample for i, sample in enumerate(samples) if i not in skipped]
+    server_filtering = SERVER_FILTERING and file_path == LOG_FILE_RAW
+    if rows:
+        record_samples(file_path, rows, tags, publish=not server_filtering) # Una sola scrittura per partizione
+        if server_filtering: # Filtraggio lato server dei dati grezzi (solo campioni accettati)
+            filter_samples(rows, tags, accepted)
+    response = {'status': 'ok', 'count': len(rows)}
+    if fixes or unresolved:
+        response.update({'fixes': fixes, 'unresolved': unresolved})
+    return jsonify(response), 200
 
 # ====== Endpoint Flask ======
 @app.route('/log', methods=['POST'])
@@ -67,8 +480,162 @@ def log_data_filtered():
     """
     return log_data_generic(LOG_FILE_FILTERED)
 
+@app.route('/log_batch', methods=['POST'])
+def log_data_batch():
+    """
+    Endpoint POST per un lotto di campioni.
+    Con "filtered": true nel JSON salva in tracking_log_filtered.csv, altrimenti in tracking_log.csv.
+    """
+    data = request_object() or {} # Un corpo non valido viene rifiutato da log_batch_generic
+    return log_batch_generic(LOG_FILE_FILTERED if data.get('filtered') else LOG_FILE_RAW)
+
+@app.route('/positions', methods=['GET'])
+def positions():
+    """
+    Endpoint GET con l'ultimo fix di tutti i tag (dall'indice in memoria, senza leggere i log).
+    Con ?tag=<tag_id> restituisce solo quel tag.
+    """
+    tag_id = request.args.get('tag')
+    with latest_lock:
+        if tag_id is not None:
+            fix = latest_positions.get(tag_id)
+            if fix is None:
+                return jsonify({'status': 'error', 'message': 'unknown tag'}), 404
+            return jsonify(fix)
+        fixes = list(latest_positions.values())
+    return jsonify({'count': len(fixes), 'positions': fixes})
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """
+    Endpoint GET Server-Sent Events: invia ogni fix accettato appena arriva.
+    Con ?tag=<tag_id> riceve solo i fix di quel tag. Se il client è lento,
+    riceve un evento "dropped" con il numero di fix scartati.
+    """
+    subscriber = broadcaster.subscribe(request.args.get('tag'))
+    def events():
+        try:
+            yield ': connected\n\n'
+            while True:
+                fixes, dropped = subscriber.pop_all(STREAM_KEEPALIVE)
+                if dropped:
+                    yield f'event: dropped\ndata: {json.dumps({"count": dropped})}\n\n'
+                for fix in fixes:
+                    yield f'data: {json.dumps(fix)}\n\n'
+                if not fixes and not dropped:
+                    yield ': keep-alive\n\n' # Mantiene aperta la connessione e rileva i client disconnessi
+        finally:
+            broadcaster.unsubscribe(subscriber) # Il client si è disconnesso
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/heatmap', methods=['GET'])
+def heatmap():
+    """
+    Endpoint GET con la mappa di occupazione (tempo di permanenza per cella e visite per tag).
+    Parametri (tutti opzionali):
+        date=YYYY-MM-DD  giorno da aggregare (default: tutto il log)
+        tag=<tag_id>     solo un tag
+        filtered=1       usa i log con stabilizzazione
+        cell=<metri>     lato delle celle (default HEATMAP_CELL_SIZE)
+        format=json|png  risultato in JSON (default) o come immagine
+    I log vengono letti a blocchi, quindi la memoria non dipende dalla loro lunghezza.
+    """
+    try:
+        tag_id = parse_tag_id(request.args.get('tag'))
+        cell = float(request.args.get('cell', HEATMAP_CELL_SIZE))
+        grid_shape(HEATMAP_BOUNDS, cell) # Lato finito e positivo, griglia entro MAX_CELLS celle
+        t_from = t_to = None
+        if request.args.get('date'):
+            day = datetime.datetime.strptime(request.args['date'], '%Y-%m-%d')
+            t_from = day.timestamp()
+            t_to = (day + datetime.timedelta(days=1)).timestamp()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'invalid parameters'}), 400
+    file_path = LOG_FILE_FILTERED if request.args.get('filtered') == '1' else LOG_FILE_RAW
+    with writers_lock: # Copia del registro: altre richieste possono aggiungere writer
+        pending = list(writers.values())
+    for writer in pending: # I dati ancora in coda entrano nell'aggregazione
+        writer.flush()
+    grid = aggregate_logs(log_sources(file_path, tag_id), t_from, t_to, bounds=HEATMAP_BOUNDS, cell_size=cell)
+    if request.args.get('format') == 'png':
+        try:
+            png = grid.render_png(title=f"Occupazione {request.args.get('date', '')}".strip())
+        except ImportError: # matplotlib non installato sul gateway
+            return jsonify({'status': 'error', 'message': 'png rendering requires matplotlib'}), 501
+        return Response(png, mimetype='image/png')
+    return jsonify(grid.to_json())
+
+def parse_time_param(value):
+    """
+    Converte un parametro from/to (secondi epoch oppure data/ora ISO) in secondi epoch.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        ts = float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    if not math.isfinite(ts): # nan/inf costringerebbero a leggere tutto il log senza risultati
+        raise ValueError(f'non-finite time: {value}')
+    return ts
+
+def tag_rows(rows, tag_id):
+    """
+    Aggiunge il tag_id alle righe (timestamp, riga CSV) di un log.
+    """
+    for ts, line in rows:
+        yield ts, tag_id, line
+
+@app.route('/history', methods=['GET'])
+def history():
+    """
+    Endpoint GET con i campioni in un intervallo di tempo.
+    Parametri: from, to (epoch o ISO, opzionali), tag (opzionale), filtered=1,
+    format=csv (default, righe nel formato del log) oppure ndjson.
+    Senza tag unisce in ordine di tempo il log storico e le partizioni di tutti
+    i tag, e aggiunge a ogni riga la colonna tag_id (vuota per il log storico).
+    Le righe escono in ordine di tempo anche se i dispositivi hanno inviato
+    campioni fuori ordine, purché entro HISTORY_SLACK secondi.
+    L'inizio viene trovato con l'indice temporale sparso di ogni log e la risposta
+    viene inviata riga per riga, senza costruirla in memoria.
+    """
+    try:
+        t_from = parse_time_param(request.args.get('from'))
+        t_to = parse_time_param(request.args.get('to'))
+        tag_id = parse_tag_id(request.args.get('tag'))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'invalid parameters'}), 400
+    base = LOG_FILE_FILTERED if request.args.get('filtered') == '1' else LOG_FILE_RAW
+    sources = [(t, path) for t, path in log_sources(base, tag_id) if os.path.exists(path)]
+    if tag_id is not None and not sources:
+        return jsonify({'status': 'error', 'message': 'unknown tag'}), 404
+    merged = tag_id is None # Più log: ogni riga riporta il proprio tag
+    streams = []
+    for t, path in sources:
+        # Ogni log viene riordinato entro HISTORY_SLACK (campioni fuori ordine), poi i log vengono uniti
+        rows = sort_within_slack(iter_csv_range(path, read_index(path), t_from, t_to))
+        streams.append(tag_rows(rows, t))
+    rows = heapq.merge(*streams, key=lambda r: r[0]) # Unione in ordine di tempo, una riga alla volta
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for _, t, line in rows:
+                ts, *values = line.decode('ascii').rstrip('\r\n').split(',')
+                numbers = [float(v) if v else None for v in values] # Celle vuote -> null
+                sample = dict(zip(CSV_HEADER, [ts] + numbers))
+                if merged:
+                    sample['tag_id'] = t
+                yield json.dumps(sample) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+    def generate():
+        yield ','.join(CSV_HEADER + ['tag_id'] if merged else CSV_HEADER) + '\r\n'
+        for _, t, line in rows:
+            yield line.rstrip(b'\r\n') + b',' + (t or '').encode('ascii') + b'\r\n' if merged else line
+    return Response(generate(), mimetype='text/csv')
+
 # ====== Esecuzione principale ======
 if __name__ == '__main__':
     # Avvia il server Flask
     # Host 0.0.0.0 consente connessioni da qualsiasi indirizzo, porta 5050 per compatibilità con SERVER_URL
-    app.run(host='0.0.0.0', port=5050)
+    # threaded=True serve allo stream: ogni client resta collegato su un proprio thread
+    app.run(host='0.0.0.0', port=5050, threaded=True)
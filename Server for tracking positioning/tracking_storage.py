@@ -0,0 +1,456 @@
+# Importazione delle librerie necessarie
+import numpy as np  # NumPy per i record binari a larghezza fissa e la memoria mappata
+import datetime  # Per convertire i timestamp epoch in formato ISO
+import os  # Per operazioni sul file system (es. cartelle dei chunk)
+import sys  # Per leggere gli argomenti da riga di comando
+import csv  # Per gestire la scrittura su file CSV
+import json  # Per l'indice dei chunk
+import math  # Per riconoscere i valori mancanti (NaN)
+import threading  # Per il thread di scrittura in background
+import io  # Per formattare un blocco di righe prima di scriverlo
+import bisect  # Per la ricerca binaria nell'indice temporale
+import heapq  # Per riordinare le righe lette dentro la finestra di tolleranza
+
+# ====== Configurazioni ======
+CSV_HEADER = ['timestamp', 'dist0', 'dist1', 'dist2', 'dist3', 'x', 'y']  # Intestazione del file CSV con i campi attesi
+# Record binario a larghezza fissa (36 byte): timestamp epoch in float64, distanze e posizione in float32
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('dist0', '<f4'),
+    ('dist1', '<f4'),
+    ('dist2', '<f4'),
+    ('dist3', '<f4'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+])
+CHUNK_RECORDS = 65536  # Numero di record per chunk (circa 2.3 MB per file)
+INDEX_FILE = 'index.json'  # Nome del file indice dentro la cartella dei chunk
+FLUSH_MAX_ROWS = 500  # Numero di righe in coda oltre il quale il buffer viene scritto subito su disco
+FLUSH_INTERVAL = 1.0  # Intervallo massimo (in secondi) tra due scritture su disco
+INDEX_EVERY_ROWS = 256  # Una voce dell'indice temporale ogni N righe del CSV
+HISTORY_SLACK = 60.0  # Secondi oltre la fine dell'intervallo letti comunque (timestamp dei dispositivi non ordinati)
+
+# ====== Funzioni di supporto ======
+def ensure_header(file_path):
+    """
+    Crea il file CSV con l'intestazione se non esiste o è vuoto.
+    """
+    # Controlla se il file non esiste o è vuoto (dimensione 0)
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        with open(file_path, 'w', newline='') as f:  # Apre il file in modalità scrittura
+            writer = csv.writer(f)  # Crea un oggetto writer per il CSV
+            writer.writerow(CSV_HEADER)  # Scrive l'intestazione definita
+
+def format_csv_row(record):
+    """
+    Converte un record (timestamp epoch, dist0..dist3, x, y) in una riga CSV.
+    I valori mancanti (None o NaN) diventano celle vuote.
+    """
+    ts = datetime.datetime.fromtimestamp(float(record[0])).isoformat()  # Timestamp in formato ISO
+    values = [float(v) if v is not None and not math.isnan(v) else '' for v in record[1:]]
+    return [ts] + values
+
+def chunk_dir_for(file_path):
+    """
+    Restituisce la cartella dei chunk binari associata a un file di log CSV
+    (es. tracking_log.csv -> tracking_log.chunks).
+    """
+    return os.path.splitext(file_path)[0] + '.chunks'
+
+# ====== Writer con buffer ======
+class BufferedLogWriter:
+    """
+    Base per i writer a lungo termine di un singolo log.
+    Le righe vengono accodate in memoria e scritte da un thread in background
+    quando si supera max_rows o trascorre flush_interval, così la latenza
+    delle richieste non dipende da quella del disco.
+    Le sottoclassi implementano _write_rows() e _close_storage().
+    """
+    def __init__(self, name, max_rows=FLUSH_MAX_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.name = name
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._pending = []  # Record in attesa di essere scritti
+        self._cond = threading.Condition()  # Sveglia il thread quando il buffer è pieno
+        self._io_lock = threading.Lock()  # Serializza le scritture sul supporto
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f'log-writer:{name}', daemon=True)
+        self._thread.start()
+
+    def append(self, records):
+        """
+        Accoda i record senza toccare il disco.
+        Args:
+            records (list): Lista di record (timestamp epoch, dist0..dist3, x, y)
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f'writer closed: {self.name}')
+            self._pending.extend(records)
+            if len(self._pending) >= self.max_rows:  # Soglia di dimensione: sveglia subito il thread
+                self._cond.notify()
+
+    def flush(self):
+        """
+        Scrive subito tutti i record in coda. Al ritorno anche i record già presi
+        in carico dal thread in background sono su disco. Se la scrittura fallisce
+        i record tornano in testa alla coda (nell'ordine originale) e l'errore
+        viene rilanciato.
+        """
+        with self._io_lock:
+            with self._cond:
+                records, self._pending = self._pending, []  # Scambia il buffer sotto lock
+            if records:
+                try:
+                    self._write_rows(records)
+                except BaseException:
+                    with self._cond:
+                        self._pending[:0] = records  # Nessun record perso: riprova alla prossima scrittura
+                    raise
+
+    def _run(self):
+        """
+        Ciclo del thread di scrittura: attende la soglia di dimensione o di tempo.
+        """
+        failed = False
+        while True:
+            with self._cond:
+                # Dopo un errore attende comunque flush_interval prima di riprovare
+                if not self._closed and (failed or len(self._pending) < self.max_rows):
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+                failed = False
+            except Exception as e:  # Nessun errore deve terminare il thread (i record restano in coda)
+                print(f'Errore scrittura {self.name}: {e!r}')
+                failed = True
+            if closed:
+                if failed:
+                    print(f'{self.name}: {len(self._pending)} record non scritti alla chiusura')
+                return
+
+    def close(self):
+        """
+        Ferma il thread dopo aver scritto gli ultimi record e chiude il supporto.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        with self._io_lock:
+            self._close_storage()
+
+    def _write_rows(self, records):
+        raise NotImplementedError
+
+    def _close_storage(self):
+        raise NotImplementedError
+
+class SparseTimeIndex:
+    """
+    Indice sparso timestamp -> offset in byte di un log CSV.
+    Ogni every righe memorizza l'offset della riga e il timestamp massimo di
+    tutte le righe precedenti: questo valore non decresce mai, quindi la
+    ricerca binaria resta corretta anche se i dispositivi inviano campioni
+    leggermente fuori ordine.
+    """
+    def __init__(self, every=INDEX_EVERY_ROWS):
+        self.every = every
+        self.bounds = []  # Timestamp massimo delle righe prima di offsets[i]
+        self.offsets = []  # Offset in byte dell'inizio della riga indicizzata
+        self._rows = 0
+        self._max_ts = -math.inf
+        self._lock = threading.Lock()
+
+    def add(self, ts, offset):
+        """
+        Registra una riga appena accodata (chiamata in ordine di scrittura).
+        """
+        with self._lock:
+            if self._rows % self.every == 0:
+                self.bounds.append(self._max_ts)
+                self.offsets.append(offset)
+            self._rows += 1
+            if ts > self._max_ts:
+                self._max_ts = ts
+
+    def seek(self, t_from):
+        """
+        Restituisce l'offset da cui iniziare a leggere per trovare tutte le righe
+        con timestamp >= t_from (None se il log è vuoto).
+        """
+        with self._lock:
+            if not self.offsets:
+                return None
+            if t_from is None:
+                return self.offsets[0]
+            # Ultima voce prima della quale tutte le righe hanno timestamp < t_from
+            i = max(0, bisect.bisect_left(self.bounds, t_from) - 1)
+            return self.offsets[i]
+
+def build_csv_index(file_path, every=INDEX_EVERY_ROWS):
+    """
+    Costruisce l'indice temporale di un CSV esistente con una sola lettura sequenziale.
+    """
+    index = SparseTimeIndex(every)
+    if not os.path.exists(file_path):
+        return index
+    with open(file_path, 'rb') as f:
+        offset = len(f.readline())  # Salta l'intestazione
+        for line in f:
+            try:
+                ts = datetime.datetime.fromisoformat(line.split(b',', 1)[0].decode('ascii')).timestamp()
+            except (ValueError, UnicodeDecodeError):  # Riga incompleta (es. scrittura interrotta)
+                ts = -math.inf
+            index.add(ts, offset)
+            offset += len(line)
+    return index
+
+class CsvLogWriter(BufferedLogWriter):
+    """
+    Backend testuale: accoda le righe nel formato di CSV_HEADER e mantiene
+    l'indice temporale sparso mentre scrive.
+    """
+    def __init__(self, file_path, **kwargs):
+        self.file_path = file_path
+        ensure_header(file_path)  # Controllo dell'intestazione una sola volta, all'apertura
+        self.index = build_csv_index(file_path)  # Indice delle righe già presenti
+        self._file = open(file_path, 'ab')  # File aperto per tutta la vita del writer (binario: offset esatti)
+        super().__init__(file_path, **kwargs)
+
+    def _write_rows(self, records):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        base = self._file.tell()  # Offset di fine file prima della scrittura
+        positions = []
+        for r in records:
+            positions.append(buf.tell())  # Le righe sono ASCII: posizione nel testo = offset in byte
+            writer.writerow(format_csv_row(r))
+        self._file.write(buf.getvalue().encode('ascii'))  # Una sola scrittura per tutto il blocco
+        self._file.flush()
+        for r, pos in zip(records, positions):  # Le righe diventano visibili nell'indice solo dopo la scrittura
+            self.index.add(float(r[0]), base + pos)
+
+    def _close_storage(self):
+        self._file.close()
+
+def iter_csv_range(file_path, index, t_from=None, t_to=None, slack=HISTORY_SLACK):
+    """
+    Restituisce (una alla volta) le righe CSV con t_from <= timestamp <= t_to.
+    Salta direttamente all'offset trovato nell'indice e si ferma alla prima riga
+    più recente di t_to + slack, quindi legge solo la parte utile del file.
+    Yields:
+        tuple: (timestamp epoch, riga CSV come bytes, terminatore incluso)
+    """
+    offset = index.seek(t_from)
+    if offset is None:
+        return
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):  # Riga ancora in scrittura
+                return
+            try:
+                ts = datetime.datetime.fromisoformat(line.split(b',', 1)[0].decode('ascii')).timestamp()
+            except (ValueError, UnicodeDecodeError):
+                continue
+            if t_to is not None and ts > t_to + slack:
+                return
+            if (t_from is None or ts >= t_from) and (t_to is None or ts <= t_to):
+                yield ts, line
+
+def sort_within_slack(rows, slack=HISTORY_SLACK):
+    """
+    Riordina per timestamp le righe di iter_csv_range. I dispositivi possono
+    inviare campioni fuori ordine fino a slack secondi: una riga viene emessa
+    solo quando è stata letta una riga più recente di lei di oltre slack secondi,
+    quindi la memoria resta limitata alle righe dentro la finestra. Righe fuori
+    ordine di più di slack secondi escono comunque, ma non in ordine.
+    Yields:
+        tuple: (timestamp epoch, riga CSV come bytes) in ordine di timestamp
+    """
+    heap = []  # (timestamp, ordine di lettura, riga): a parità di tempo resta l'ordine del file
+    newest = -math.inf
+    for n, (ts, line) in enumerate(rows):
+        heapq.heappush(heap, (ts, n, line))
+        newest = max(newest, ts)
+        while heap[0][0] < newest - slack:  # Nessuna riga successiva può essere più vecchia
+            ts_min, _, line_min = heapq.heappop(heap)
+            yield ts_min, line_min
+    while heap:
+        ts_min, _, line_min = heapq.heappop(heap)
+        yield ts_min, line_min
+
+# ====== Backend binario a chunk ======
+def _read_index(directory):
+    """
+    Legge l'indice dei chunk (lista di dizionari file/count/t_min/t_max/sorted).
+    """
+    path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return json.load(f)['chunks']
+
+def _write_index(directory, chunks):
+    """
+    Scrive l'indice in modo atomico (file temporaneo + rename), così un lettore
+    concorrente vede sempre una versione completa.
+    """
+    path = os.path.join(directory, INDEX_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'dtype': RECORD_DTYPE.descr, 'chunks': chunks}, f)
+    os.replace(tmp, path)
+
+class BinaryLogWriter(BufferedLogWriter):
+    """
+    Backend binario: scrive record a larghezza fissa (RECORD_DTYPE) in file .npy
+    preallocati da chunk_records record ciascuno, mappati in memoria.
+    L'indice tiene per ogni chunk il numero di record validi e l'intervallo
+    temporale coperto, così le query aprono solo i chunk necessari.
+    """
+    def __init__(self, directory, chunk_records=CHUNK_RECORDS, **kwargs):
+        self.directory = directory
+        self.chunk_records = chunk_records
+        os.makedirs(directory, exist_ok=True)
+        self._chunks = _read_index(directory)  # Riprende una sessione esistente
+        self._mm = None  # Chunk corrente mappato in memoria
+        if self._chunks and self._chunks[-1]['count'] < self._chunks[-1].get('capacity', chunk_records):
+            last = self._chunks[-1]
+            self._mm = np.load(os.path.join(directory, last['file']), mmap_mode='r+')
+        super().__init__(directory, **kwargs)
+
+    def _new_chunk(self):
+        """
+        Crea un nuovo file .npy preallocato e lo aggiunge all'indice.
+        """
+        name = f'chunk_{len(self._chunks):06d}.npy'
+        self._mm = np.lib.format.open_memmap(os.path.join(self.directory, name), mode='w+',
+                                             dtype=RECORD_DTYPE, shape=(self.chunk_records,))
+        self._chunks.append({'file': name, 'count': 0, 'capacity': self.chunk_records,
+                             't_min': None, 't_max': None, 'sorted': True})
+
+    def _write_rows(self, records):
+        # Conversione dell'intero blocco in un array strutturato (None -> NaN)
+        block = np.array([tuple(np.nan if v is None else v for v in r) for r in records], dtype=RECORD_DTYPE)
+        pos = 0
+        while pos < len(block):
+            if self._mm is None or self._chunks[-1]['count'] >= self._chunks[-1]['capacity']:
+                self._new_chunk()
+            meta = self._chunks[-1]
+            n = min(len(block) - pos, meta['capacity'] - meta['count'])
+            part = block[pos:pos + n]
+            self._mm[meta['count']:meta['count'] + n] = part  # Copia diretta nella memoria mappata
+            ts = part['timestamp']
+            # Un chunk resta "ordinato" se i timestamp non decrescono mai (abilita la ricerca binaria)
+            prev = meta['t_max'] if meta['count'] else -np.inf
+            meta['sorted'] = bool(meta['sorted'] and ts[0] >= prev and np.all(np.diff(ts) >= 0))
+            t_min, t_max = float(ts.min()), float(ts.max())
+            meta['t_min'] = t_min if meta['t_min'] is None else min(meta['t_min'], t_min)
+            meta['t_max'] = t_max if meta['t_max'] is None else max(meta['t_max'], t_max)
+            meta['count'] += n
+            pos += n
+            self._mm.flush()  # I dati arrivano su disco prima dell'indice che li rende visibili
+        _write_index(self.directory, self._chunks)
+
+    def _close_storage(self):
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm = None
+
+class BinaryLogReader:
+    """
+    Lettore del backend binario: apre i chunk in memoria mappata (senza copiarli)
+    e usa l'indice per saltare quelli fuori dall'intervallo richiesto.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _chunk_records(self, meta):
+        """
+        Restituisce la vista (memoria mappata) dei record validi di un chunk.
+        """
+        mm = np.load(os.path.join(self.directory, meta['file']), mmap_mode='r')
+        return mm[:meta['count']]
+
+    def iter_chunks(self):
+        """
+        Itera sui chunk in ordine di scrittura, uno alla volta (memoria limitata).
+        """
+        for meta in _read_index(self.directory):
+            if meta['count']:
+                yield self._chunk_records(meta)
+
+    def query(self, t_from=None, t_to=None):
+        """
+        Restituisce i record con t_from <= timestamp <= t_to (estremi opzionali).
+        Args:
+            t_from (float): Inizio dell'intervallo in secondi epoch (None = dall'inizio)
+            t_to (float): Fine dell'intervallo in secondi epoch (None = fino alla fine)
+        Returns:
+            np.ndarray: Array strutturato con dtype RECORD_DTYPE
+        """
+        lo = -np.inf if t_from is None else t_from
+        hi = np.inf if t_to is None else t_to
+        parts = []
+        for meta in _read_index(self.directory):
+            # Salta i chunk il cui intervallo temporale non interseca la richiesta
+            if not meta['count'] or meta['t_max'] < lo or meta['t_min'] > hi:
+                continue
+            recs = self._chunk_records(meta)
+            ts = recs['timestamp']
+            if meta['sorted']:  # Ricerca binaria sui chunk ordinati
+                start = np.searchsorted(ts, lo, side='left')
+                end = np.searchsorted(ts, hi, side='right')
+                parts.append(recs[start:end])
+            else:  # Filtro vettoriale sui chunk non ordinati
+                parts.append(recs[(ts >= lo) & (ts <= hi)])
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.concatenate(parts)
+
+    def at(self, t):
+        """
+        Restituisce l'ultimo record con timestamp <= t (la posizione "all'istante t"),
+        oppure None se non esiste.
+        """
+        best = None
+        for meta in _read_index(self.directory):
+            if not meta['count'] or meta['t_min'] > t:
+                continue
+            recs = self._chunk_records(meta)
+            ts = recs['timestamp']
+            if meta['sorted']:
+                i = np.searchsorted(ts, t, side='right') - 1
+            else:
+                valid = np.nonzero(ts <= t)[0]
+                i = valid[np.argmax(ts[valid])] if len(valid) else -1
+            if i >= 0 and (best is None or ts[i] >= best['timestamp']):
+                best = recs[i].copy()
+        return best
+
+def export_csv(directory, csv_path):
+    """
+    Esporta il contenuto di una cartella di chunk binari nel formato CSV attuale.
+    I chunk vengono letti uno alla volta, quindi la memoria usata è limitata.
+    """
+    reader = BinaryLogReader(directory)
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for recs in reader.iter_chunks():
+            for r in recs:
+                # I campi float32 vengono riportati alla rappresentazione decimale più corta (es. 1.7, non 1.7000000476837158)
+                writer.writerow(format_csv_row((r['timestamp'],) + tuple(float(str(r[k])) for k in CSV_HEADER[1:])))
+
+# ====== Esecuzione principale ======
+if __name__ == '__main__':
+    # Uso: python tracking_storage.py export <cartella_chunk> <file.csv>
+    if len(sys.argv) != 4 or sys.argv[1] != 'export':
+        print('Uso: python tracking_storage.py export <cartella_chunk> <file.csv>')
+        sys.exit(1)
+    export_csv(sys.argv[2], sys.argv[3])
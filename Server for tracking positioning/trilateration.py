@@ -0,0 +1,142 @@
+# Importazione delle librerie necessarie
+import numpy as np  # NumPy per il calcolo vettoriale su molti campioni
+import os  # Per operazioni sul file system (es. percorso della configurazione)
+import sys  # Per leggere gli argomenti da riga di comando
+import csv  # Per rielaborare i log CSV esistenti
+import json  # Per leggere la configurazione delle ancore
+
+# ====== Configurazioni ======
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # Directory assoluta del file corrente
+ANCHORS_FILE = os.path.join(BASE_DIR, 'anchors.json')  # Configurazione della geometria delle ancore
+# Ancore di default (in metri), usate se il file di configurazione non esiste
+DEFAULT_ANCHORS = [
+    (0.0, 0.0),  # Coordinata dell'ancora A0 (origine)
+    (1.7, 0.0),  # Coordinata dell'ancora A1
+    (0.0, 6.3),  # Coordinata dell'ancora A2
+    (1.7, 6.3),  # Coordinata dell'ancora A3
+]
+MAX_CONDITION = 1e6  # Numero di condizionamento oltre il quale il fix è considerato degenere
+RECOMPUTE_CHUNK_ROWS = 10000  # Righe elaborate per blocco durante la rielaborazione dei log
+
+# ====== Funzioni di supporto ======
+def load_anchors(path=ANCHORS_FILE):
+    """
+    Legge le coordinate delle ancore dalla configurazione.
+    Formato atteso: {"anchors": [[x0, y0], [x1, y1], ...]} (in metri, ordine = indice distN)
+    Returns:
+        np.ndarray: Matrice (M, 2) con le coordinate delle M ancore
+    """
+    if not os.path.exists(path):  # Senza configurazione usa le ancore di default
+        return np.array(DEFAULT_ANCHORS, dtype=float)
+    with open(path, 'r') as f:
+        anchors = np.array(json.load(f)['anchors'], dtype=float)
+    if anchors.ndim != 2 or anchors.shape[1] != 2 or len(anchors) < 3:
+        raise ValueError(f'{path}: servono almeno 3 ancore nel formato [[x, y], ...]')
+    return anchors
+
+def solve_positions(dists, anchors):
+    """
+    Trilaterazione ai minimi quadrati lineari per N campioni e M ancore.
+    Ogni distanza d_i dà l'equazione -2*a_i.p + |p|^2 = d_i^2 - |a_i|^2, lineare nelle
+    incognite (x, y, |p|^2). Le distanze mancanti (NaN) hanno peso zero, quindi ogni
+    campione usa solo le ancore disponibili (ne servono almeno 3). Il sistema di tutti
+    i campioni viene risolto in un'unica SVD vettoriale.
+    Args:
+        dists (array-like): Matrice (N, M) delle distanze, NaN dove mancanti
+        anchors (array-like): Matrice (M, 2) delle coordinate delle ancore
+    Returns:
+        dict: Array di lunghezza N con chiavi
+              'x', 'y': posizione stimata (NaN se non calcolabile)
+              'residual': errore quadratico medio sulle distanze (m)
+              'cond': numero di condizionamento del sistema (inf se degenere)
+              'valid': True se il fix è affidabile
+              e 'residuals', matrice (N, M) dei residui per ancora (|p - a_i| - d_i)
+    """
+    dists = np.atleast_2d(np.asarray(dists, dtype=float))
+    anchors = np.asarray(anchors, dtype=float)
+    n, m = dists.shape
+    if m != len(anchors):
+        raise ValueError(f'{m} distanze per campione ma {len(anchors)} ancore configurate')
+    mask = np.isfinite(dists)  # Distanze disponibili
+    w = mask.astype(float)  # Peso 0 per le distanze mancanti
+    d = np.where(mask, dists, 0.0)
+    # Matrice del sistema per ogni campione (N, M, 3) e termine noto (N, M)
+    a_row = np.column_stack([-2.0 * anchors[:, 0], -2.0 * anchors[:, 1], np.ones(m)])
+    A = w[:, :, None] * a_row[None, :, :]
+    b = w * (d ** 2 - np.sum(anchors ** 2, axis=1)[None, :])
+    # SVD vettoriale: p = V * diag(1/s) * U^T * b
+    U, s, Vt = np.linalg.svd(A, full_matrices=False)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cond = s[:, 0] / s[:, -1]
+        coeffs = np.einsum('nmk,nm->nk', U, b) / s
+    cond = np.where(np.isfinite(cond), cond, np.inf)
+    valid = (mask.sum(axis=1) >= 3) & (cond < MAX_CONDITION)
+    coeffs = np.where(valid[:, None], coeffs, 0.0)
+    p = np.einsum('nkj,nk->nj', Vt, coeffs)[:, :2]  # Scarta la terza incognita |p|^2
+    p[~valid] = np.nan
+    # Residui sulle distanze per ancora e RMS per fix
+    ranges = np.linalg.norm(p[:, None, :] - anchors[None, :, :], axis=2)
+    residuals = np.where(mask, ranges - dists, np.nan)
+    with np.errstate(invalid='ignore'):
+        rms = np.sqrt(np.nansum(residuals ** 2, axis=1) / np.maximum(mask.sum(axis=1), 1))
+    rms[~valid] = np.nan
+    return {
+        'x': p[:, 0],
+        'y': p[:, 1],
+        'residual': rms,
+        'residuals': residuals,
+        'cond': cond,
+        'valid': valid,
+    }
+
+def rewrite_log(csv_in, csv_out, n_anchors, transform, chunk_rows=RECOMPUTE_CHUNK_ROWS):
+    """
+    Riscrive un log CSV (formato CSV_HEADER) a blocchi di chunk_rows righe,
+    quindi la memoria usata è limitata. L'intestazione viene copiata così com'è.
+    Args:
+        n_anchors (int): Numero di colonne distN da passare a transform
+        transform (callable): transform(block, cols, ix, iy) riceve le righe di un
+            blocco (liste di stringhe), gli indici delle colonne delle distanze e di
+            x, y, e restituisce le righe da scrivere
+    """
+    with open(csv_in, 'r', newline='') as fin, open(csv_out, 'w', newline='') as fout:
+        reader = csv.reader(fin)
+        writer = csv.writer(fout)
+        header = next(reader)
+        writer.writerow(header)
+        cols = [header.index(f'dist{i}') for i in range(n_anchors)]  # Colonne delle distanze per ogni ancora
+        ix, iy = header.index('x'), header.index('y')
+        block = []
+        for row in reader:
+            block.append(row)
+            if len(block) >= chunk_rows:
+                writer.writerows(transform(block, cols, ix, iy))
+                block = []
+        if block:
+            writer.writerows(transform(block, cols, ix, iy))
+
+def recompute_log(csv_in, csv_out, anchors=None):
+    """
+    Ricalcola le colonne x, y di un log CSV (formato CSV_HEADER) a partire dalle
+    distanze, con la geometria delle ancore attuale (a blocchi, vedi rewrite_log).
+    Le righe senza fix valido vengono scritte con x, y vuoti.
+    """
+    anchors = load_anchors() if anchors is None else np.asarray(anchors, dtype=float)
+    rewrite_log(csv_in, csv_out, len(anchors),
+                lambda block, cols, ix, iy: _recompute_block(block, cols, ix, iy, anchors))
+
+def _recompute_block(block, cols, ix, iy, anchors):
+    dists = np.array([[float(r[c]) if r[c] != '' else np.nan for c in cols] for r in block])
+    fix = solve_positions(dists, anchors)
+    for row, x, y, ok in zip(block, fix['x'], fix['y'], fix['valid']):
+        row[ix] = float(x) if ok else ''
+        row[iy] = float(y) if ok else ''
+    return block
+
+# ====== Esecuzione principale ======
+if __name__ == '__main__':
+    # Uso: python trilateration.py recompute <log.csv> <output.csv>
+    if len(sys.argv) != 4 or sys.argv[1] != 'recompute':
+        print('Uso: python trilateration.py recompute <log.csv> <output.csv>')
+        sys.exit(1)
+    recompute_log(sys.argv[2], sys.argv[3])
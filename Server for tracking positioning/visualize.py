@@ -1,8 +1,15 @@
 # Importazione delle librerie necessarie
 import matplotlib.pyplot as plt  # Matplotlib per la creazione di grafici e visualizzazioni
 from matplotlib.animation import FuncAnimation  # Per animazioni in tempo reale
+import numpy as np  # NumPy per i buffer circolari preallocati delle scie
+import collections  # deque per i fix ricevuti dallo stream e non ancora disegnati
 import csv  # Per leggere il file CSV con i dati di tracking
 import os  # Per operazioni sul file system (es. verifica esistenza file)
+import json  # Per decodificare gli eventi dello stream
+import threading  # Per leggere lo stream in background
+import time  # Per l'attesa tra un tentativo di riconnessione e l'altro
+import urllib.request  # Per collegarsi allo stream del server
+import glob  # Per trovare le partizioni dei tag
 
 # ====== Configurazioni ======
 # Coordinate delle ancore (fisse, definite in metri)
@@ -12,6 +19,13 @@ anchor1 = (1.7, 0.0)  # Coordinata dell'ancora A1
 anchor2 = (0.0, 6.3)  # Coordinata dell'ancora A2
 anchor3 = (1.7, 6.3)  # Coordinata dell'ancora A3
 LOG_FILE = 'tracking_log.csv'  # Nome del file CSV contenente i dati di tracking
+SOURCE = 'file'  # Sorgente dei dati: 'file' (legge LOG_FILE) oppure 'stream' (si collega a STREAM_URL)
+STREAM_URL = 'http://127.0.0.1:5050/stream'  # Endpoint Server-Sent Events del server di tracking
+RENDER_MODE = 'simple'  # 'simple' (un punto per tag, aggiornato ogni 200 ms) oppure 'trails' (scie di più tag con blitting)
+TAGS_DIR = 'tags'  # Cartella delle partizioni per tag scritte dal server (letta con SOURCE = 'file')
+TRAIL_LENGTH = 30  # Numero di fix mostrati nella scia di ogni tag
+MAX_TAGS = 64  # Numero massimo di tag disegnati contemporaneamente
+TRAIL_INTERVAL_MS = 33  # Intervallo tra due frame in modalità 'trails' (circa 30 FPS)
 
 # ====== Inizializzazione del grafico ======
 # Crea una figura e un asse per il grafico
@@ -40,50 +54,252 @@ scatter, = ax.plot([], [], 'ro', label='Tag')  # 'r' per rosso, 'o' per cerchio
 ax.legend(loc='upper left')  # Aggiunge la legenda in alto a sinistra
 
 # ====== Funzioni di supporto ======
-def read_last_xy(filepath):
+class CsvTailReader:
     """
-    Legge l'ultima riga valida del file CSV e restituisce le coordinate (x, y).
-    Args:
-        filepath (str): Percorso del file CSV
-    Returns:
-        tuple: (x, y) se valide, altrimenti (None, None)
+    Lettore incrementale di un file CSV in crescita (come "tail -f").
+    Ricorda l'offset in byte già letto e a ogni chiamata analizza solo le righe
+    aggiunte, quindi il costo non cresce con la lunghezza della sessione.
+    Gestisce il troncamento (file più corto dell'offset) e la rotazione
+    (file sostituito, riconosciuto dal cambio di inode). La data di modifica non
+    viene usata: può cambiare prima che i byte aggiunti compaiano nella dimensione,
+    e un normale accodamento verrebbe scambiato per una riscrittura.
+    """
+    def __init__(self, filepath, initial_tail_bytes=4096):
+        self.filepath = filepath
+        self.initial_tail_bytes = initial_tail_bytes  # Byte letti dalla fine alla prima apertura
+        self.offset = None  # Offset in byte fino a cui il file è stato letto (None = da aprire)
+        self.file_id = None  # (device, inode) del file letto, per riconoscere la rotazione
+        self.partial = b''  # Ultima riga non ancora terminata da '\n'
+        self.skip_first_line = False  # True se la lettura è partita a metà di una riga
+        self.last_row = None  # Ultima riga completa letta
+
+    def _reset(self, file_id, size):
+        """
+        Riparte da un file nuovo: salta alla fine, tenendo solo gli ultimi byte
+        per recuperare subito l'ultima riga senza rileggere tutto il file.
+        """
+        self.file_id = file_id
+        self.offset = max(0, size - self.initial_tail_bytes)
+        self.partial = b''
+        self.skip_first_line = self.offset > 0  # La prima riga letta a metà file è incompleta
+
+    def read_new_rows(self):
+        """
+        Legge le righe complete aggiunte dall'ultima chiamata.
+        Returns:
+            list: Righe CSV (liste di stringhe), senza l'intestazione
+        """
+        try:
+            st = os.stat(self.filepath)
+        except FileNotFoundError:  # Il file non esiste (ancora) o è in rotazione
+            self.offset = None
+            return []
+        file_id = (st.st_dev, st.st_ino)
+        if self.offset is None or file_id != self.file_id:  # Prima apertura o file ruotato
+            self._reset(file_id, st.st_size)
+        elif st.st_size < self.offset:  # File troncato: riparte dall'inizio
+            self.offset = 0
+            self.partial = b''
+            self.skip_first_line = False
+        if st.st_size == self.offset:  # Nessun dato nuovo
+            return []
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.offset)  # Salta direttamente ai byte non ancora letti
+            chunk = f.read(st.st_size - self.offset)
+        self.offset += len(chunk)
+        lines = (self.partial + chunk).split(b'\n')
+        self.partial = lines.pop()  # L'ultimo frammento può essere una riga incompleta
+        if self.skip_first_line and lines:
+            lines.pop(0)
+            self.skip_first_line = False
+        rows = [r for r in csv.reader(l.decode('utf-8', 'replace').rstrip('\r') for l in lines)
+                if r and r[0] != 'timestamp']  # Scarta righe vuote e intestazione
+        if rows:
+            self.last_row = rows[-1]
+        return rows
+
+_tail_readers = {}  # Un lettore incrementale per ogni file osservato
+
+class FixStreamClient:
     """
-    # Controlla se il file esiste e non è vuoto
-    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
-        return None, None
-    last = None
-    # Apre il file CSV in modalità lettura
-    with open(filepath, 'r', newline='') as f:
-        reader = csv.reader(f)  # Crea un oggetto reader per il CSV
-        rows = list(reader)  # Legge tutte le righe in una lista
-        if len(rows) < 2:  # Se c'è solo l'intestazione o il file è vuoto
-            return None, None
-        last = rows[-1]  # Prende l'ultima riga
-    # Formato atteso: [timestamp, dist0, dist1, dist2, dist3, x, y]
-    try:
-        x = float(last[5])  # Estrae e converte la coordinata x
-        y = float(last[6])  # Estrae e converte la coordinata y
-        return x, y
-    except (IndexError, ValueError):  # Gestisce errori di formato o valori non numerici
-        return None, None
+    Client dello stream Server-Sent Events del server di tracking.
+    Un thread in background riceve i fix e tiene solo l'ultimo per ogni tag,
+    quindi il visualizzatore non ha bisogno di accedere al file system del server.
+    """
+    def __init__(self, url, max_backoff=10.0):
+        self.url = url
+        self.max_backoff = max_backoff  # Attesa massima tra due tentativi di riconnessione
+        self.latest = {}  # Ultimo fix per tag_id
+        self.pending = collections.deque(maxlen=10000)  # Fix non ancora disegnati (modalità 'trails')
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        backoff = 0.5
+        while True:
+            try:
+                with urllib.request.urlopen(self.url) as resp:
+                    backoff = 0.5  # Connessione riuscita: azzera l'attesa
+                    for raw in resp:  # Una riga dello stream alla volta
+                        line = raw.decode('utf-8').rstrip('\r\n')
+                        if line.startswith('data: '):
+                            self._handle(json.loads(line[6:]))
+            except Exception as e:  # Server non raggiungibile o connessione interrotta
+                print(f'Stream non disponibile ({e}), nuovo tentativo tra {backoff:.1f} s')
+            time.sleep(backoff)
+            backoff = min(self.max_backoff, backoff * 2)
+
+    def _handle(self, fix):
+        if 'x' not in fix:  # Eventi di servizio (es. "dropped")
+            return
+        with self._lock:
+            self.latest[fix.get('tag_id')] = fix
+        self.pending.append((fix.get('tag_id'), fix['x'], fix['y']))  # append su deque è thread-safe
+
+    def drain(self):
+        """
+        Restituisce (tag_id, x, y) dei fix ricevuti dall'ultima chiamata.
+        """
+        while self.pending:
+            yield self.pending.popleft()
+
+    def latest_positions(self):
+        """
+        Returns:
+            dict: tag_id -> (x, y) dell'ultimo fix ricevuto per ogni tag
+        """
+        with self._lock:
+            return {tag_id: (fix['x'], fix['y']) for tag_id, fix in self.latest.items()}
+
+stream_client = FixStreamClient(STREAM_URL) if SOURCE == 'stream' else None
+
+_partition_scan = [0.0]  # Istante dell'ultima ricerca di nuove partizioni
+
+def read_new_fixes():
+    """
+    Restituisce (tag_id, x, y) delle righe aggiunte a LOG_FILE e ai log delle
+    partizioni dei tag (TAGS_DIR/<tag_id>/LOG_FILE) dall'ultima chiamata.
+    Le nuove partizioni vengono cercate al massimo una volta al secondo.
+    """
+    now = time.monotonic()
+    if now - _partition_scan[0] > 1.0:
+        _partition_scan[0] = now
+        for path in glob.glob(os.path.join(TAGS_DIR, '*', os.path.basename(LOG_FILE))):
+            if path not in _tail_readers:
+                _tail_readers[path] = CsvTailReader(path)
+    if LOG_FILE not in _tail_readers:
+        _tail_readers[LOG_FILE] = CsvTailReader(LOG_FILE)
+    for path, reader in _tail_readers.items():
+        tag_id = None if path == LOG_FILE else os.path.basename(os.path.dirname(path))
+        for row in reader.read_new_rows():
+            try:
+                yield tag_id, float(row[5]), float(row[6])
+            except (IndexError, ValueError):  # Righe senza posizione valida
+                continue
+
+class TrailRenderer:
+    """
+    Disegno ad alte prestazioni di molti tag con scia.
+    Tutti i punti stanno in buffer circolari NumPy preallocati (un riga per tag),
+    disegnati con due sole collezioni (scie e posizioni attuali). La trasparenza
+    delle scie si ottiene da una tabella precalcolata, quindi un frame non
+    crea liste né oggetti nuovi. Gli artisti sono 'animated' e FuncAnimation con
+    blit=True ridisegna solo loro sopra lo sfondo statico (ancore ed etichette)
+    messo in cache.
+    """
+    def __init__(self, ax, max_tags=MAX_TAGS, trail_length=TRAIL_LENGTH):
+        self.ax = ax
+        self.max_tags = max_tags
+        self.trail_length = trail_length
+        self.slots = {}  # tag_id -> riga dei buffer
+        self.points = np.full((max_tags, trail_length, 2), np.nan)  # Scie (NaN = punto non ancora scritto)
+        self.current = np.full((max_tags, 2), np.nan)  # Ultima posizione di ogni tag
+        self.heads = np.zeros(max_tags, dtype=np.intp)  # Indice dell'ultimo punto scritto nella scia
+        # Tabella della trasparenza: riga h = alpha di ogni cella quando la testa della scia è in h
+        age = (np.arange(trail_length)[:, None] - np.arange(trail_length)[None, :]) % trail_length
+        self.alpha_table = np.linspace(0.9, 0.05, trail_length)[age]
+        self.alpha = np.empty((max_tags, trail_length))  # Buffer di lavoro per la trasparenza
+        base = plt.get_cmap('tab20')(np.arange(max_tags) % 20)  # Un colore per tag
+        self.colors = np.repeat(base[:, None, :], trail_length, axis=1)  # Colori RGBA di ogni punto della scia
+        self.trails = ax.scatter([], [], s=10, linewidths=0, animated=True)
+        self.markers = ax.scatter([], [], s=60, edgecolors='k', animated=True)
+        self.markers.set_offsets(self.current)
+        self.markers.set_facecolors(base)
+        self.artists = [self.trails, self.markers]  # Artisti restituiti a FuncAnimation (più le etichette dei tag)
+
+    def add_fix(self, tag_id, x, y):
+        """
+        Aggiunge un fix alla scia del tag (nessuna allocazione per i tag già visti).
+        """
+        slot = self.slots.get(tag_id)
+        if slot is None:
+            if len(self.slots) >= self.max_tags:  # Oltre MAX_TAGS i nuovi tag vengono ignorati
+                return
+            slot = self.slots[tag_id] = len(self.slots)
+            label = self.ax.text(x, y, 'Tag' if tag_id is None else str(tag_id), fontsize=8, animated=True)
+            self.artists.append(label)
+        head = (self.heads[slot] + 1) % self.trail_length
+        self.heads[slot] = head
+        self.points[slot, head] = (x, y)
+        self.current[slot] = (x, y)
+        self.artists[2 + slot].set_position((x + 0.05, y + 0.05))
+
+    def draw(self):
+        """
+        Aggiorna gli artisti dai buffer e li restituisce per il blitting.
+        """
+        np.take(self.alpha_table, self.heads, axis=0, out=self.alpha)  # Trasparenza in base all'età
+        self.colors[:, :, 3] = self.alpha
+        self.trails.set_offsets(self.points.reshape(-1, 2))
+        self.trails.set_facecolors(self.colors.reshape(-1, 4))
+        self.markers.set_offsets(self.current)
+        return self.artists
 
 # ====== Funzione di aggiornamento per l'animazione ======
+latest_xy = {}  # tag_id -> ultima posizione (x, y) letta dai log (modalità 'simple')
+
 def update(_frame):
     """
-    Aggiorna il grafico con le coordinate più recenti del tag.
+    Aggiorna il grafico con la posizione più recente di ogni tag: il log
+    storico senza tag e le partizioni TAGS_DIR/<tag_id>/ (o lo stream).
     Args:
         _frame: Parametro richiesto da FuncAnimation (non usato)
     Returns:
-        tuple: Oggetti da aggiornare (il punto del tag)
+        tuple: Oggetti da aggiornare (i punti dei tag)
     """
-    x, y = read_last_xy(LOG_FILE)  # Legge le coordinate x, y più recenti
-    if x is not None and y is not None:
-        scatter.set_data([x], [y])  # Aggiorna la posizione del punto del tag
+    if stream_client is not None:
+        positions = stream_client.latest_positions()  # Ultimo fix ricevuto dallo stream per ogni tag
+    else:
+        for tag_id, x, y in read_new_fixes():  # Solo le righe aggiunte dall'ultima chiamata
+            latest_xy[tag_id] = (x, y)
+        positions = latest_xy
+    if positions:
+        xs, ys = zip(*positions.values())
+        scatter.set_data(xs, ys)  # Aggiorna la posizione dei punti dei tag
     return scatter,  # Restituisce l'oggetto scatter per l'animazione
 
+def update_trails(_frame):
+    """
+    Aggiorna le scie con i fix arrivati dall'ultimo frame (modalità 'trails').
+    Returns:
+        list: Artisti da ridisegnare con il blitting
+    """
+    fixes = stream_client.drain() if stream_client is not None else read_new_fixes()
+    for tag_id, x, y in fixes:
+        renderer.add_fix(tag_id, x, y)
+    return renderer.draw()
+
 # ====== Animazione ======
-# Crea un'animazione che aggiorna il grafico ogni 200 ms
-ani = FuncAnimation(fig, update, interval=200)  # Chiama update ogni 200 millisecondi
+if RENDER_MODE == 'trails':
+    scatter.set_visible(False)  # Il punto singolo è sostituito dalle scie
+    renderer = TrailRenderer(ax)
+    # Con blit=True lo sfondo statico viene messo in cache e a ogni frame si ridisegnano solo le scie
+    ani = FuncAnimation(fig, update_trails, init_func=renderer.draw, interval=TRAIL_INTERVAL_MS,
+                        blit=True, cache_frame_data=False)
+else:
+    # Crea un'animazione che aggiorna il grafico ogni 200 ms
+    ani = FuncAnimation(fig, update, interval=200)  # Chiama update ogni 200 millisecondi
 
 # ====== Esecuzione principale ======
 plt.show()  # Mostra il grafico con l'animazione attiva
@@ -7,6 +7,8 @@ import time
 import math
 import network
 import requests
+import machine
+import binascii
 # ====================================================================
 # CLASSE PER IL FILTRAGGIO DELLA DISTANZA
 # ====================================================================
@@ -55,6 +57,7 @@ position_y = None
 WIFI_SSID = 'Modem 4G Wi-Fi_CA5A'
 WIFI_PASSWORD = '02738204'
 SERVER_URL = 'http://192.168.1.129:5050/log_filtered'  # Usa il tuo IP corretto
+TAG_ID = 'TAG_' + binascii.hexlify(machine.unique_id()).decode()  # Identificativo del tag, diverso per ogni dispositivo (chip ID); sostituibile con un nome fisso univoco
 # ====== OGGETTI FILTRO ======
 # Filtri solo per le ancore funzionanti (0,2,3)
 dist_filter0 = FilteredDistance(alpha=0.4, validation_threshold=1.5)
@@ -175,6 +178,7 @@ def loop():
    
     # Invia dati (dist1 incluso per compatibilità, anche se non usato)
     data = {
+        'tag_id': TAG_ID,
         'dist0_raw': distance0_raw,
         'dist1_raw': distance1_raw,
         'dist2_raw': distance2_raw,
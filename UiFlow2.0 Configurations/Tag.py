@@ -7,6 +7,8 @@ import time  # Per gestione del tempo e ritardi
 import math  # Per calcoli matematici
 import network  # Per gestire la connessione Wi-Fi
 import requests  # Per inviare richieste HTTP al server
+import machine  # Per leggere l'identificativo univoco del chip (usato come tag_id)
+import binascii  # Per convertire l'identificativo del chip in esadecimale
 
 # ====== Variabili globali ======
 # Etichette per l'interfaccia utente
@@ -37,6 +39,7 @@ position_y = None  # Coordinata y calcolata del tag
 WIFI_SSID = 'Modem 4G Wi-Fi_CA5A'  # Nome della rete Wi-Fi
 WIFI_PASSWORD = '02738204'  # Password della rete Wi-Fi
 SERVER_URL = 'http://192.168.1.163:5050/log'  # URL del server per inviare i dati
+TAG_ID = 'TAG_' + binascii.hexlify(machine.unique_id()).decode()  # Identificativo del tag, diverso per ogni dispositivo (chip ID); sostituibile con un nome fisso univoco
 
 # ====== Funzioni principali ======
 def setup():
@@ -144,6 +147,7 @@ def loop():
         print(f'Posizione: ({position_x:.2f}, {position_y:.2f}) m')  # Stampa la posizione
         # Prepara i dati da inviare al server
         data = {
+            'tag_id': TAG_ID,
             'dist0': distance0,
             'dist1': distance1,
             'dist2': distance2,
@@ -4,68 +4,268 @@ import M5  # Libreria specifica per l'hardware M5Stack
 from M5 import *  # Importa tutte le funzionalità di M5Stack (es. Widgets)
 import m5ui  # Modulo per l'interfaccia utente grafica su M5Stack
 import lvgl as lv  # Libreria LVGL per la gestione di interfacce grafiche
-import requests2  # Per inviare richieste HTTP al server
+import socket  # Connessione TCP persistente verso il server delle immagini
+import select  # Per controllare la connessione senza bloccare il ciclo dei gesti
+import errno  # Codici di errore dei socket non bloccanti
+import json  # Per comporre i comandi e leggere lo stato restituito dal server
 from hardware import I2C, Pin  # Per gestire l'interfaccia I2C e i pin
 from unit import GestureUnit  # Modulo per il sensore di gesti
 import time  # Per gestione del tempo e ritardi
 
+# ====== Configurazioni ======
+SERVER_HOST = '192.168.1.163'  # Indirizzo IP del server delle immagini
+SERVER_PORT = 5050  # Porta del server delle immagini
+MAX_IN_FLIGHT = 4  # Richieste inviate sulla connessione senza aspettare la risposta (pipelining)
+MAX_QUEUED = 8  # Comandi in attesa oltre i quali i più vecchi vengono scartati
+RECONNECT_MIN_MS = 250  # Prima attesa prima di riconnettersi dopo un errore (raddoppia a ogni errore)
+RECONNECT_MAX_MS = 8000  # Attesa massima tra due tentativi di connessione
+RESPONSE_TIMEOUT_MS = 5000  # Oltre questo tempo senza risposta la connessione viene considerata persa
+FEEDBACK_MS = 1000  # Durata del messaggio e del colore dopo un gesto
+
 # ====== Variabili globali ======
 page0 = None  # Oggetto per la pagina dell'interfaccia grafica
 label0 = None  # Etichetta per mostrare lo stato dei gesti
-http_req = None  # Oggetto per la richiesta HTTP
+label1 = None  # Etichetta per mostrare lo stato restituito dal server
+client = None  # Client HTTP persistente verso il server delle immagini
 i2c0 = None  # Oggetto per l'interfaccia I2C
 gesture_0 = None  # Oggetto per il sensore di gesti
 gesture_num = None  # Numero del gesto rilevato
+feedback_until = 0  # Istante (ticks_ms) fino a cui resta visibile il feedback dell'ultimo gesto
+shown_status = None  # Ultimo testo mostrato in label1
+
+# ====== Client HTTP persistente ======
+class CommandClient:
+    """
+    Client HTTP/1.1 non bloccante con una sola connessione persistente al server.
+    send() accoda il comando e ritorna subito; poll(), chiamata a ogni giro del
+    ciclo, apre la connessione (con attesa crescente dopo gli errori), scrive le
+    richieste una dopo l'altra senza aspettare le risposte (fino a MAX_IN_FLIGHT)
+    e legge le risposte, salvando in state l'ultimo stato restituito dal server.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = None  # Socket della connessione (None se chiusa)
+        self.poller = None  # Oggetto poll per controllare il socket senza bloccare
+        self.connected = False  # True quando la connessione non bloccante è stabilita
+        self.queue = []  # Comandi ancora da inviare
+        self.in_flight = []  # Comandi inviati in attesa di risposta, in ordine
+        self.out = b''  # Byte ancora da scrivere sul socket
+        self.buf = b''  # Byte ricevuti non ancora interpretati
+        self.state = None  # Ultimo stato restituito dal server (dict)
+        self.last_status = None  # Codice HTTP dell'ultima risposta
+        self.backoff = RECONNECT_MIN_MS
+        self.retry_at = time.ticks_ms()  # Istante del prossimo tentativo di connessione
+        self.waiting_since = time.ticks_ms()  # Inizio dell'attesa della prossima risposta (o della connessione)
+
+    def send(self, action):
+        """
+        Accoda un comando (non blocca: l'invio avviene in poll()).
+        """
+        self.queue.append(action)
+        if len(self.queue) > MAX_QUEUED:  # Server irraggiungibile: tiene solo i comandi più recenti
+            self.queue.pop(0)
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.connected = False
+        self.out = b''
+        self.buf = b''
+
+    def _fail(self, requeue=False):
+        """
+        Chiude la connessione dopo un errore e programma il prossimo tentativo.
+        Le richieste senza risposta vengono ripetute solo se di sicuro non sono
+        arrivate (requeue): un next_image applicato due volte è peggio di uno perso.
+        """
+        if requeue:
+            self.queue = self.in_flight + self.queue
+        self.in_flight = []
+        self._close()
+        self.retry_at = time.ticks_add(time.ticks_ms(), self.backoff)
+        self.backoff = min(self.backoff * 2, RECONNECT_MAX_MS)
+
+    def _connect(self):
+        addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+        sock = socket.socket()
+        sock.setblocking(False)
+        try:
+            sock.connect(addr)  # Non bloccante: la connessione si completa nei giri successivi
+        except OSError as e:
+            if e.errno not in (errno.EINPROGRESS, errno.EAGAIN):
+                sock.close()
+                raise
+        self.sock = sock
+        self.poller = select.poll()
+        self.poller.register(sock, select.POLLIN | select.POLLOUT)
+        self.waiting_since = time.ticks_ms()
+
+    def poll(self):
+        """
+        Avanza connessione, invio e ricezione senza mai bloccare.
+        """
+        now = time.ticks_ms()
+        if self.sock is None:
+            if not self.queue or time.ticks_diff(now, self.retry_at) < 0:
+                return
+            try:
+                self._connect()
+            except OSError:
+                self._fail(requeue=True)
+                return
+        events = self.poller.poll(0)
+        flags = events[0][1] if events else 0
+        if not self.connected:
+            if flags & (select.POLLERR | select.POLLHUP):  # Connessione rifiutata: niente è stato inviato
+                self._fail(requeue=True)
+            elif flags & select.POLLOUT:
+                self.connected = True
+                self.backoff = RECONNECT_MIN_MS
+            elif time.ticks_diff(now, self.waiting_since) > RESPONSE_TIMEOUT_MS:
+                self._fail(requeue=True)
+            return
+        # Scrive i comandi in coda senza aspettare le risposte precedenti
+        while self.queue and len(self.in_flight) < MAX_IN_FLIGHT:
+            action = self.queue.pop(0)
+            body = json.dumps({'action': action})
+            self.out += ('POST /command HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n'
+                         'Content-Length: %d\r\n\r\n%s' % (self.host, len(body), body)).encode()
+            if not self.in_flight:
+                self.waiting_since = now
+            self.in_flight.append(action)
+        if self.out:
+            try:
+                self.out = self.out[self.sock.send(self.out):]
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    self._fail()
+                    return
+        if flags & (select.POLLIN | select.POLLHUP | select.POLLERR):
+            try:
+                data = self.sock.recv(1024)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    self._fail()
+                return
+            if not data:  # Il server ha chiuso la connessione
+                self._fail()
+                return
+            self.buf += data
+            self._parse_responses(now)
+        if self.in_flight and time.ticks_diff(now, self.waiting_since) > RESPONSE_TIMEOUT_MS:
+            self._fail()  # Nessuna risposta: la connessione è considerata persa
+
+    def _parse_responses(self, now):
+        """
+        Estrae dal buffer le risposte complete (intestazioni + Content-Length byte).
+        """
+        while self.sock is not None:
+            end = self.buf.find(b'\r\n\r\n')
+            if end < 0:
+                return
+            try:
+                status, closing, length = self._parse_head(self.buf[:end])
+            except (IndexError, ValueError, UnicodeError):  # Risposta malformata: la connessione non è più affidabile
+                self._fail()
+                return
+            if len(self.buf) < end + 4 + length:  # Corpo non ancora arrivato del tutto
+                return
+            body = self.buf[end + 4:end + 4 + length]
+            self.buf = self.buf[end + 4 + length:]
+            self.last_status = status
+            if self.in_flight:
+                self.in_flight.pop(0)
+            self.waiting_since = now
+            if self.last_status == 200:
+                try:
+                    self.state = json.loads(body)  # Stato della vista dopo il comando
+                except ValueError:
+                    pass
+            if closing:
+                # Il server chiude dopo questa risposta: le richieste successive non sono state lette
+                self.queue = self.in_flight + self.queue
+                self.in_flight = []
+                self._close()
+                self.retry_at = now  # Riconnessione immediata, non è un errore
+
+    def _parse_head(self, head):
+        """
+        Analizza riga di stato e intestazioni di una risposta.
+        Returns:
+            tuple: (codice di stato, True se il server chiude dopo la risposta, Content-Length)
+        Raises:
+            IndexError, ValueError, UnicodeError: Se la risposta è malformata
+        """
+        lines = head.decode().split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip().lower()
+        length = int(headers.get('content-length', 0))
+        if length < 0:
+            raise ValueError('invalid content-length')
+        closing = headers.get('connection') == 'close' or lines[0].startswith('HTTP/1.0')
+        return status, closing, length
+
+    def status_text(self):
+        """
+        Testo breve con lo stato del server da mostrare sullo schermo.
+        """
+        if self.sock is None and time.ticks_diff(self.retry_at, time.ticks_ms()) > 0:
+            return 'Server non raggiungibile'
+        if not self.state:
+            return ''
+        return '%s  %.1fx  %d°' % (self.state.get('image'), self.state.get('zoom', 1.0), self.state.get('rot90', 0) * 90)
 
 # ====== Funzioni per la gestione dei gesti ======
 def next_image():
     """
-    Invia una richiesta HTTP per passare all'immagine successiva.
+    Invia il comando per passare all'immagine successiva.
     """
-    global gesture_num, page0, label0, http_req, i2c0, gesture_0
-    http_req = requests2.post('http://192.168.1.163:5050/command', json={'action': 'next_image'})
+    client.send('next_image')
 
 def prev_image():
     """
-    Invia una richiesta HTTP per passare all'immagine precedente.
+    Invia il comando per passare all'immagine precedente.
     """
-    global gesture_num, page0, label0, http_req, i2c0, gesture_0
-    http_req = requests2.post('http://192.168.1.163:5050/command', json={'action': 'prev_image'})
+    client.send('prev_image')
 
 def zoom_in():
     """
-    Invia una richiesta HTTP per ingrandire l'immagine.
+    Invia il comando per ingrandire l'immagine.
     """
-    global gesture_num, page0, label0, http_req, i2c0, gesture_0
-    http_req = requests2.post('http://192.168.1.163:5050/command', json={'action': 'zoom_in'})
+    client.send('zoom_in')
 
 def zoom_out():
     """
-    Invia una richiesta HTTP per rimpicciolire l'immagine.
+    Invia il comando per rimpicciolire l'immagine.
     """
-    global gesture_num, page0, label0, http_req, i2c0, gesture_0
-    http_req = requests2.post('http://192.168.1.163:5050/command', json={'action': 'zoom_out'})
+    client.send('zoom_out')
 
 def rotate_right():
     """
-    Invia una richiesta HTTP per ruotare l'immagine a destra.
+    Invia il comando per ruotare l'immagine a destra.
     """
-    global gesture_num, page0, label0, http_req, i2c0, gesture_0
-    http_req = requests2.post('http://192.168.1.163:5050/command', json={'action': 'rotate_right'})
+    client.send('rotate_right')
 
 def rotate_left():
     """
-    Invia una richiesta HTTP per ruotare l'immagine a sinistra.
+    Invia il comando per ruotare l'immagine a sinistra.
     """
-    global gesture_num, page0, label0, http_req, i2c0, gesture_0
-    http_req = requests2.post('http://192.168.1.163:5050/command', json={'action': 'rotate_left'})
+    client.send('rotate_left')
 
 # ====== Funzione di inizializzazione ======
 def setup():
     """
     Inizializza l'hardware, l'interfaccia utente e il sensore di gesti.
     """
-    global page0, label0, http_req, i2c0, gesture_0, gesture_num
+    global page0, label0, label1, client, i2c0, gesture_0, gesture_num
     M5.begin()  # Inizializza l'hardware M5Stack
     Widgets.setRotation(1)  # Imposta la rotazione dello schermo
     m5ui.init()  # Inizializza il modulo UI
@@ -73,6 +273,9 @@ def setup():
     page0 = m5ui.M5Page(bg_c=0xffffff)
     # Crea un'etichetta per mostrare lo stato dei gesti
     label0 = m5ui.M5Label("label0", x=15, y=105, text_c=0x000000, bg_c=0xffffff, bg_opa=0, font=lv.font_montserrat_24, parent=page0)
+    # Crea un'etichetta per lo stato restituito dal server (immagine, zoom, rotazione)
+    label1 = m5ui.M5Label("", x=15, y=150, text_c=0x000000, bg_c=0xffffff, bg_opa=0, font=lv.font_montserrat_14, parent=page0)
+    client = CommandClient(SERVER_HOST, SERVER_PORT)  # La connessione viene aperta al primo comando
     # Inizializza l'interfaccia I2C e il sensore di gesti
     i2c0 = I2C(0, scl=Pin(1), sda=Pin(2), freq=100000)  # Configura I2C con frequenza 100 kHz
     gesture_0 = GestureUnit(i2c0)  # Inizializza il sensore di gesti
@@ -81,47 +284,40 @@ def setup():
     page0.set_bg_color(0xcccccc, 255, 0)  # Imposta lo sfondo grigio chiaro
 
 # ====== Ciclo principale ======
+GESTURES = {
+    1: ('Prossima Immagine', 0xff6666, next_image),  # Sfondo rosso chiaro
+    2: ('Immagine Precedente', 0xff6666, prev_image),
+    4: ('Zoom +', 0x66ff99, zoom_in),  # Sfondo verde chiaro
+    8: ('Zoom -', 0x66ff99, zoom_out),
+    16: ('Ruota Dx', 0x9999ff, rotate_right),  # Sfondo blu chiaro
+    32: ('Ruota Sx', 0x9999ff, rotate_left),
+}  # Numero del gesto -> (messaggio, colore di sfondo, comando)
+
 def loop():
     """
     Ciclo principale per rilevare gesti e aggiornare l'interfaccia utente.
+    Non si blocca mai: il comando viene solo accodato e client.poll() fa
+    avanzare invio e ricezione a ogni giro.
     """
-    global page0, label0, http_req, i2c0, gesture_0, gesture_num
+    global page0, label0, label1, client, i2c0, gesture_0, gesture_num, feedback_until, shown_status
     M5.update()  # Aggiorna lo stato dell'hardware M5Stack
     gesture_num = gesture_0.get_hand_gestures()  # Rileva il gesto
     # Gestisce i gesti e aggiorna l'interfaccia
-    if gesture_num == 1:
-        label0.set_text(str('Prossima Immagine'))  # Mostra messaggio
-        page0.set_bg_color(0xff6666, 255, 0)  # Sfondo rosso chiaro
-        time.sleep(1)  # Attende 1 secondo per il feedback
-        next_image()  # Invia richiesta per immagine successiva
-    elif gesture_num == 2:
-        label0.set_text(str('Immagine Precedente'))  # Mostra messaggio
-        page0.set_bg_color(0xff6666, 255, 0)  # Sfondo rosso chiaro
-        time.sleep(1)  # Attende 1 secondo
-        prev_image()  # Invia richiesta per immagine precedente
-    elif gesture_num == 4:
-        label0.set_text(str('Zoom +'))  # Mostra messaggio
-        page0.set_bg_color(0x66ff99, 255, 0)  # Sfondo verde chiaro
-        time.sleep(1)  # Attende 1 secondo
-        zoom_in()  # Invia richiesta per ingrandire
-    elif gesture_num == 8:
-        label0.set_text(str('Zoom -'))  # Mostra messaggio
-        page0.set_bg_color(0x66ff99, 255, 0)  # Sfondo verde chiaro
-        time.sleep(1)  # Attende 1 secondo
-        zoom_out()  # Invia richiesta per rimpicciolire
-    elif gesture_num == 16:
-        label0.set_text(str('Ruota Dx'))  # Mostra messaggio
-        page0.set_bg_color(0x9999ff, 255, 0)  # Sfondo blu chiaro
-        time.sleep(1)  # Attende 1 secondo
-        rotate_right()  # Invia richiesta per rotazione a destra
-    elif gesture_num == 32:
-        label0.set_text(str('Ruota Sx'))  # Mostra messaggio
-        page0.set_bg_color(0x9999ff, 255, 0)  # Sfondo blu chiaro
-        time.sleep(1)  # Attende 1 secondo
-        rotate_left()  # Invia richiesta per rotazione a sinistra
-    else:
+    gesture = GESTURES.get(gesture_num)
+    if gesture is not None:
+        text, color, command = gesture
+        command()  # Accoda la richiesta (l'invio avviene subito dopo, in client.poll())
+        label0.set_text(str(text))  # Mostra messaggio
+        page0.set_bg_color(color, 255, 0)
+        feedback_until = time.ticks_add(time.ticks_ms(), FEEDBACK_MS)  # Feedback visibile per 1 secondo, senza attendere
+    elif time.ticks_diff(time.ticks_ms(), feedback_until) >= 0:
         label0.set_text(str('In attesa di gesto...'))  # Stato predefinito
         page0.set_bg_color(0xcccccc, 255, 0)  # Sfondo grigio chiaro
+    client.poll()  # Invia i comandi in coda e legge le risposte
+    status = client.status_text()
+    if status != shown_status:  # Aggiorna l'etichetta solo quando lo stato cambia
+        label1.set_text(status)
+        shown_status = status
     time.sleep(0.1)  # Ritardo di 100 ms per il ciclo
 
 # ====== Esecuzione principale ======